@@ -0,0 +1,96 @@
+# run all audits in a single pass over the osm file
+
+import pprint
+from collections import defaultdict, OrderedDict
+
+from audit_tag import key_type
+from audit_street_name import audit_street_type, is_street_name
+from audit_postcode import is_postcode
+from audit_tourism import is_tourism
+from osm_stream import iter_tags
+
+
+def new_key_report():
+    """This function returns an empty report for the key_type audit."""
+
+    return {"lower": [0, set()], "lower_colon": [0, set()], "problemchars": [0, set()], "other": [0, set()]}
+
+def new_set_report():
+    """This function returns an empty defaultdict(set) report."""
+
+    return defaultdict(set)
+
+def new_count_report():
+    """This function returns an empty defaultdict(int) report."""
+
+    return defaultdict(int)
+
+
+# auditors take the running report and a <tag> element and update the report in place
+def tag_auditor(keys, tag):
+    """This function catalogs the key of a <tag> element with key_type."""
+
+    key_type(tag, keys)
+
+def street_auditor(street_types, tag):
+    """This function collects unexpected street types from 'addr:street' tags."""
+
+    if is_street_name(tag):
+        audit_street_type(street_types, tag.attrib["v"])
+
+def postcode_auditor(postcode_types, tag):
+    """This function counts the values of 'addr:postcode' tags."""
+
+    if is_postcode(tag):
+        postcode_types[tag.attrib["v"]] += 1
+
+def tourism_auditor(tourism_types, tag):
+    """This function counts the values of 'tourism' tags."""
+
+    if is_tourism(tag):
+        tourism_types[tag.attrib["v"]] += 1
+
+
+# registered auditors as name: (report factory, auditor function)
+AUDITORS = OrderedDict([
+    ("tag", (new_key_report, tag_auditor)),
+    ("street", (new_set_report, street_auditor)),
+    ("postcode", (new_count_report, postcode_auditor)),
+    ("tourism", (new_count_report, tourism_auditor)),
+])
+
+
+def register_auditor(name, report_factory, auditor, auditors=AUDITORS):
+    """This function adds an auditor to the registry. The report_factory is called once
+    to create the empty report and auditor(report, tag) is called for every <tag> element."""
+
+    auditors[name] = (report_factory, auditor)
+
+
+def audit_map(filename, auditors=AUDITORS):
+    """This function takes an osm file and runs every registered auditor over its <tag>
+    elements while parsing the file only once.
+
+    It returns a dictionary with the auditor names as keys and their reports as values."""
+
+    reports = OrderedDict((name, report_factory()) for name, (report_factory, _) in auditors.iteritems())
+    dispatch = [(reports[name], auditor) for name, (_, auditor) in auditors.iteritems()]
+
+    for tag in iter_tags(filename):
+        for report, auditor in dispatch:
+            auditor(report, tag)
+
+    return reports
+
+
+if __name__ == "__main__":
+    from audit_cache import cached_audit_map
+    audit_reports = cached_audit_map("boston_massachusetts.osm")
+
+    for name, report in audit_reports.iteritems():
+        print name, "audit:"
+        print "---------------------------------------------------------------------------------"
+        if isinstance(report, defaultdict):
+            report = dict(report)
+        pprint.pprint(report)
+        print
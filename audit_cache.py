@@ -0,0 +1,296 @@
+# persistent cache of audit reports keyed by the input file and the auditor rules
+
+import argparse
+import cPickle as pickle
+import hashlib
+import os
+import pprint
+import re
+import types
+from collections import defaultdict, namedtuple, OrderedDict
+from functools import partial
+
+from audit import AUDITORS
+from osm_stream import iter_tags
+
+AUDIT_CACHE_DIR = "audit_cache"
+
+# bytes hashed at the start, middle and end of a file for its fingerprint
+SAMPLE_SIZE = 64 * 1024
+
+PATTERN_TYPE = type(re.compile(''))
+
+# stand in for a <tag> element when a report is replayed from the tag summary
+SummaryTag = namedtuple('SummaryTag', ['tag', 'attrib'])
+
+
+# ================================================== #
+#               Fingerprints                         #
+# ================================================== #
+def file_fingerprint(path, sample_size=SAMPLE_SIZE):
+    """This function returns a key for the content of path made of its size, its mtime and
+    a hash of a block at its start, middle and end, so it costs the same for any file size"""
+
+    size = os.path.getsize(path)
+    digest = hashlib.sha1('{0}:{1!r}'.format(size, os.path.getmtime(path)))
+    with open(path, 'rb') as sampled_file:
+        for offset in sorted(set([0, max(size // 2 - sample_size // 2, 0), max(size - sample_size, 0)])):
+            sampled_file.seek(offset)
+            digest.update(sampled_file.read(sample_size))
+    return digest.hexdigest()[:20]
+
+
+class Unfingerprintable(Exception):
+    """Raised by hash_value for a value whose effect on an auditor it cannot capture"""
+
+
+def hash_value(value, digest, seen):
+    """This function feeds the parts of value that decide what an auditor does into digest.
+
+    Functions contribute their code, defaults, closure cells and, recursively, the globals
+    their code refers to, so a change to a helper such as audit_street_type, to a rule such
+    as expected or street_type_re, or to the arguments an auditor factory was called with
+    changes the hash. functools.partial objects contribute their function and arguments,
+    methods their function and instance, and classes written in python their attributes.
+    Compiled regexes contribute their pattern and flags. Modules, builtin functions and
+    builtin types are library code and only contribute their names.
+
+    Any other object, such as an instance of a callable class, raises Unfingerprintable."""
+
+    if isinstance(value, types.FunctionType):
+        if value in seen:
+            return
+        seen.add(value)
+        digest.update(value.__name__)
+        hash_value(value.__code__, digest, seen)
+        hash_value(value.__defaults__, digest, seen)
+        for cell in value.__closure__ or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                digest.update('<empty cell>')
+            else:
+                hash_value(contents, digest, seen)
+        for name in sorted(code_names(value.__code__)):
+            if name in value.__globals__:
+                digest.update(name)
+                hash_value(value.__globals__[name], digest, seen)
+    elif isinstance(value, partial):
+        digest.update('<partial>')
+        hash_value(value.func, digest, seen)
+        hash_value(value.args, digest, seen)
+        hash_value(value.keywords or {}, digest, seen)
+    elif isinstance(value, types.MethodType):
+        digest.update('<method>')
+        hash_value(value.__func__, digest, seen)
+        hash_value(value.__self__, digest, seen)
+    elif isinstance(value, (staticmethod, classmethod)):
+        hash_value(value.__func__, digest, seen)
+    elif isinstance(value, types.CodeType):
+        digest.update(value.co_code)
+        for const in value.co_consts:
+            hash_value(const, digest, seen)
+    elif isinstance(value, (types.ModuleType, types.BuiltinFunctionType)):
+        digest.update('<{0}>'.format(value.__name__))
+    elif isinstance(value, (type, types.ClassType)):
+        digest.update('<class {0}>'.format(value.__name__))
+        # only classes written in python have their module in their own namespace
+        if '__module__' in vars(value) and value not in seen:
+            seen.add(value)
+            for name, attribute in sorted(vars(value).iteritems()):
+                if not (name.startswith('__') and name.endswith('__')):
+                    digest.update(name)
+                    hash_value(attribute, digest, seen)
+    elif isinstance(value, PATTERN_TYPE):
+        digest.update('{0!r}:{1}'.format(value.pattern, value.flags))
+    elif isinstance(value, (list, tuple)):
+        digest.update('[')
+        for item in value:
+            hash_value(item, digest, seen)
+        digest.update(']')
+    elif isinstance(value, (set, frozenset)):
+        digest.update('{')
+        for item in sorted(value):
+            hash_value(item, digest, seen)
+        digest.update('}')
+    elif isinstance(value, dict):
+        digest.update('{:')
+        for key, item in sorted(value.iteritems()):
+            hash_value(key, digest, seen)
+            hash_value(item, digest, seen)
+        digest.update('}')
+    elif isinstance(value, (basestring, int, long, float, bool, type(None))):
+        digest.update(repr(value))
+    else:
+        raise Unfingerprintable("cannot fingerprint {0!r}".format(value))
+
+
+def code_names(code):
+    """This function returns the global names used by code and the code nested in it"""
+
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return names
+
+
+def auditor_fingerprint(report_factory, auditor):
+    """This function returns a hash of the report factory and auditor function of a
+    registered auditor and of every rule they depend on, or None if they depend on
+    something hash_value cannot fingerprint"""
+
+    digest = hashlib.sha1()
+    seen = set()
+    try:
+        hash_value(report_factory, digest, seen)
+        hash_value(auditor, digest, seen)
+    except Unfingerprintable:
+        return None
+    return digest.hexdigest()[:20]
+
+
+# ================================================== #
+#               Cache Files                          #
+# ================================================== #
+def load(path):
+    """This function returns the object pickled at path, or None if there is none"""
+
+    try:
+        with open(path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def store(path, value):
+    """This function pickles value to path through a temporary file, so an interrupted
+    run never leaves a truncated cache entry behind"""
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+
+def summary_path(cache_dir, file_key):
+    return os.path.join(cache_dir, '{0}.summary'.format(file_key))
+
+
+def report_path(cache_dir, file_key, name, config_key):
+    return os.path.join(cache_dir, '{0}.{1}.{2}.report'.format(file_key, name, config_key))
+
+
+def drop_stale_reports(cache_dir, file_key, name, config_key):
+    """This function removes the reports of auditor name for the file that were made with
+    other rules"""
+
+    prefix = '{0}.{1}.'.format(file_key, name)
+    current = os.path.basename(report_path(cache_dir, file_key, name, config_key))
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith(prefix) and file_name.endswith('.report') and file_name != current:
+            os.remove(os.path.join(cache_dir, file_name))
+
+
+# ================================================== #
+#               Auditing                             #
+# ================================================== #
+def scan(filename, missing):
+    """This function runs the auditors in missing over the <tag> elements of the file and
+    counts every distinct (k, v) pair on the way. It returns the reports and the counts."""
+
+    reports = OrderedDict((name, report_factory()) for name, (report_factory, _) in missing.iteritems())
+    dispatch = [(reports[name], auditor) for name, (_, auditor) in missing.iteritems()]
+    summary = defaultdict(int)
+
+    for tag in iter_tags(filename):
+        summary[(tag.attrib["k"], tag.attrib["v"])] += 1
+        for report, auditor in dispatch:
+            auditor(report, tag)
+
+    return reports, dict(summary)
+
+
+def replay(summary, missing):
+    """This function runs the auditors in missing over the tag summary instead of the file.
+    Auditors only look at the k and v of a tag, so feeding each distinct pair as many times
+    as it occurs gives the same report as the full scan."""
+
+    reports = OrderedDict((name, report_factory()) for name, (report_factory, _) in missing.iteritems())
+    dispatch = [(reports[name], auditor) for name, (_, auditor) in missing.iteritems()]
+
+    for (key, value), count in summary.iteritems():
+        tag = SummaryTag("tag", {"k": key, "v": value})
+        for report, auditor in dispatch:
+            for _ in xrange(count):
+                auditor(report, tag)
+
+    return reports
+
+
+def cached_audit_map(filename, names=None, auditors=AUDITORS, cache_dir=AUDIT_CACHE_DIR, refresh=False):
+    """This function returns the same reports as audit.audit_map, restricted to the
+    auditors in names if given, and keeps them in cache_dir.
+
+    A report is keyed by the fingerprint of the file and of the auditor's rules, so it is
+    returned straight from the cache until either changes. Auditors whose report is missing
+    are recomputed from the cached (k, v, count) summary of the file's tags when there is
+    one, and otherwise in a single pass over the file that also stores the summary.
+    Auditors that cannot be fingerprinted are recomputed on every call and never stored.
+    refresh=True ignores the cached entries."""
+
+    if names is None:
+        names = list(auditors)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    file_key = file_fingerprint(filename)
+    config_keys = dict((name, auditor_fingerprint(*auditors[name])) for name in names)
+
+    reports = OrderedDict()
+    missing = OrderedDict()
+    for name in names:
+        report = None
+        if not refresh and config_keys[name] is not None:
+            report = load(report_path(cache_dir, file_key, name, config_keys[name]))
+        if report is None:
+            missing[name] = auditors[name]
+        reports[name] = report
+
+    if missing:
+        summary = None if refresh else load(summary_path(cache_dir, file_key))
+        if summary is None:
+            computed, summary = scan(filename, missing)
+            store(summary_path(cache_dir, file_key), summary)
+        else:
+            computed = replay(summary, missing)
+
+        for name, report in computed.iteritems():
+            if config_keys[name] is not None:
+                store(report_path(cache_dir, file_key, name, config_keys[name]), report)
+                drop_stale_reports(cache_dir, file_key, name, config_keys[name])
+            reports[name] = report
+
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the registered audits with a persistent cache")
+    parser.add_argument('filename', nargs='?', default="boston_massachusetts.osm")
+    parser.add_argument('--audit', action='append', choices=list(AUDITORS), help="run only these audits")
+    parser.add_argument('--cache-dir', default=AUDIT_CACHE_DIR)
+    parser.add_argument('--refresh', action='store_true', help="recompute every report")
+    args = parser.parse_args(argv)
+
+    audit_reports = cached_audit_map(args.filename, args.audit, cache_dir=args.cache_dir, refresh=args.refresh)
+    for name, report in audit_reports.iteritems():
+        print name, "audit:"
+        print "---------------------------------------------------------------------------------"
+        if isinstance(report, defaultdict):
+            report = dict(report)
+        pprint.pprint(report)
+        print
+
+
+if __name__ == '__main__':
+    main()
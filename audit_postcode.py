@@ -1,8 +1,10 @@
 # imports
-import xml.etree.cElementTree as ET
 import pprint
 from collections import defaultdict
 
+from compressed_io import open_input
+from osm_stream import iter_tags
+
 def is_postcode(elem):
     """This function takes an element and returns whether it contains an attrib key
     'addr:street'.
@@ -17,18 +19,19 @@ def audit_postcode(filename):
 
     This is an modification from https://classroom.udacity.com/nanodegrees/nd002/parts/0021345404/modules/316820862075461/lessons/5436095827/concepts/54446302850923"""
 
-    osmfile = open(filename, "r")
+    osmfile = open_input(filename)
     postcode_types = defaultdict(int)
-    for event, elem in ET.iterparse(osmfile, events = ("start",)):
-        for tag in elem.iter("tag"):
-            if is_postcode(tag):
-                postcode_types[tag.attrib["v"]] += 1
+    for tag in iter_tags(osmfile):
+        if is_postcode(tag):
+            postcode_types[tag.attrib["v"]] += 1
 
     osmfile.close()
     return postcode_types
 
-postcode_audit = audit_postcode('boston_massachusetts.osm')
+if __name__ == "__main__":
+    from audit_cache import cached_audit_map
+    postcode_audit = cached_audit_map('boston_massachusetts.osm', ["postcode"])["postcode"]
 
-print "total number of unique zipcodes: ", len(postcode_audit)
-print "---------------------------------------------------------------------------------"
-pprint.pprint(dict(postcode_audit))
+    print "total number of unique zipcodes: ", len(postcode_audit)
+    print "---------------------------------------------------------------------------------"
+    pprint.pprint(dict(postcode_audit))
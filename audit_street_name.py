@@ -1,9 +1,11 @@
 # imports
-import xml.etree.cElementTree as ET
 import re
 import pprint
 from collections import defaultdict
 
+from compressed_io import open_input
+from osm_stream import iter_tags
+
 # set up re to find street types
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 
@@ -38,17 +40,18 @@ def audit_street(filename):
 
     This is an modification from https://classroom.udacity.com/nanodegrees/nd002/parts/0021345404/modules/316820862075461/lessons/5436095827/concepts/54446302850923"""
 
-    osmfile = open(filename, "r")
+    osmfile = open_input(filename)
     street_types = defaultdict(set)
-    for event, elem in ET.iterparse(osmfile, events = ("start",)):
-        for tag in elem.iter("tag"):
-            if is_street_name(tag):
-                audit_street_type(street_types, tag.attrib["v"])
+    for tag in iter_tags(osmfile):
+        if is_street_name(tag):
+            audit_street_type(street_types, tag.attrib["v"])
     osmfile.close()
     return street_types
 
-street_name_audit = audit_street("boston_massachusetts.osm")
+if __name__ == "__main__":
+    from audit_cache import cached_audit_map
+    street_name_audit = cached_audit_map("boston_massachusetts.osm", ["street"])["street"]
 
-print "number of street names that might need revision: ", len(street_name_audit)
-print "---------------------------------------------------------"
-pprint.pprint(dict(street_name_audit))
+    print "number of street names that might need revision: ", len(street_name_audit)
+    print "---------------------------------------------------------"
+    pprint.pprint(dict(street_name_audit))
@@ -1,9 +1,10 @@
 # check for potential problems in the tags
 
 import re
-import xml.etree.cElementTree as ET
 import pprint
 
+from osm_stream import iter_tags
+
 # use re to categorize tags
 lower = re.compile(r'^([a-z]|_)*$')
 lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
@@ -59,19 +60,21 @@ def process_map(filename):
     https://classroom.udacity.com/nanodegrees/nd002/parts/0021345404/modules/316820862075461/lessons/5436095827/concepts/54456296460923#"""
 
     keys = {"lower": [0, set()], "lower_colon": [0, set()], "problemchars": [0, set()], "other": [0, set()]}
-    for _, elem in ET.iterparse(filename):
-        keys = key_type(elem, keys)
+    for tag in iter_tags(filename):
+        keys = key_type(tag, keys)
 
     return keys
 
-tag_survey = process_map('boston_massachusetts.osm')
+if __name__ == "__main__":
+    from audit_cache import cached_audit_map
+    tag_survey = cached_audit_map('boston_massachusetts.osm', ["tag"])["tag"]
 
-for key in tag_survey:
-    print key, ": ", tag_survey[key][0]
+    for key in tag_survey:
+        print key, ": ", tag_survey[key][0]
 
-print "-------------------------------------------"
-for key in tag_survey:
-    if key not in "problemchars":
-        print key, " examples: "
-        pprint.pprint(tag_survey[key][1])
-        print "--------------------------------------------------------------------------------"
+    print "-------------------------------------------"
+    for key in tag_survey:
+        if key not in "problemchars":
+            print key, " examples: "
+            pprint.pprint(tag_survey[key][1])
+            print "--------------------------------------------------------------------------------"
@@ -1,8 +1,10 @@
 # imports
-import xml.etree.cElementTree as ET
 import pprint
 from collections import defaultdict
 
+from compressed_io import open_input
+from osm_stream import iter_tags
+
 def is_tourism(elem):
     """This function takes an element and returns whether it contains an attrib key
     'tourism'.
@@ -16,18 +18,19 @@ def audit_tourism(filename):
 
     This is an modification from https://classroom.udacity.com/nanodegrees/nd002/parts/0021345404/modules/316820862075461/lessons/5436095827/concepts/54446302850923"""
 
-    osmfile = open(filename, "r")
+    osmfile = open_input(filename)
     tourism_types = defaultdict(int)
-    for event, elem in ET.iterparse(osmfile, events = ("start",)):
-        for tag in elem.iter("tag"):
-            if is_tourism(tag):
-                tourism_types[tag.attrib["v"]] += 1
+    for tag in iter_tags(osmfile):
+        if is_tourism(tag):
+            tourism_types[tag.attrib["v"]] += 1
 
     osmfile.close()
     return tourism_types
 
-tourism_audit = audit_tourism("boston_massachusetts.osm")
+if __name__ == "__main__":
+    from audit_cache import cached_audit_map
+    tourism_audit = cached_audit_map("boston_massachusetts.osm", ["tourism"])["tourism"]
 
-print "types of tourism: ", len(tourism_audit)
-print "---------------------------------------------------------------------------------"
-pprint.pprint(dict(tourism_audit))
+    print "types of tourism: ", len(tourism_audit)
+    print "---------------------------------------------------------------------------------"
+    pprint.pprint(dict(tourism_audit))
@@ -0,0 +1,260 @@
+# benchmark the conversion pipeline on a deterministic synthetic osm file
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import quoteattr
+
+import data
+from instrument import PipelineStats
+from osm_stream import available_parsers, XML_PARSERS
+from rollups import RollupCollector
+from tag_index import TagIndexBuilder
+
+BASELINE_PATH = "benchmark_baseline.json"
+
+# a regression is reported when a rate drops more than this fraction below the baseline
+TOLERANCE = 0.2
+
+STREETS = ["Massachusetts", "Beacon", "Boylston", "Tremont", "Washington", "Cambridge", "Harvard", "Hanover"]
+STREET_TYPES = ["Street", "St", "St.", "Ave", "Avenue", "Rd", "Road", "Pl", "Square", "Sq."]
+POSTCODES = ["02139", "02114", "02116-4021", "MA 02115", "0213", "01125", "02134"]
+TAGS = [("amenity", ["cafe", "restaurant", "bench", "parking"]),
+        ("tourism", ["museum", "hotel", "attraction", "viewpoint"]),
+        ("highway", ["residential", "footway", "service", "primary"]),
+        ("name", ["Boston Common", "Fenway", "Back Bay", "Caf\xc3\xa9 Nero"]),
+        ("building", ["yes", "house", "commercial"]),
+        ("source", ["massgis", "bing"]),
+        ("tiger:county", ["Suffolk, MA", "Middlesex, MA"]),
+        ("gnis:feature_id", ["600123", "601882"])]
+RELATION_TYPES = ["multipolygon", "route", "boundary", "restriction"]
+ROLES = ["outer", "inner", "stop", "platform", ""]
+
+# collectors that can be run along with the conversion, by name
+COLLECTORS = {
+    'rollups': lambda out_dir: RollupCollector(os.path.join(out_dir, 'rollups.json')),
+    'tag_index': lambda out_dir: TagIndexBuilder(os.path.join(out_dir, 'tags.idx'))
+}
+
+
+def generate_tags(rng, tags_per_element, address_share):
+    """This function returns a list of (k, v) pairs for one synthetic element"""
+
+    tags = []
+    if rng.random() < address_share:
+        street = "{0} {1}".format(rng.choice(STREETS), rng.choice(STREET_TYPES))
+        tags.append(("addr:street", street))
+        tags.append(("addr:postcode", rng.choice(POSTCODES)))
+        tags.append(("addr:housenumber", str(rng.randint(1, 400))))
+    while len(tags) < tags_per_element:
+        key, values = rng.choice(TAGS)
+        tags.append((key, rng.choice(values)))
+    return tags
+
+
+def write_tags(osm_file, tags):
+    for key, value in tags:
+        osm_file.write('    <tag k={0} v={1}/>\n'.format(quoteattr(key), quoteattr(value)))
+
+
+def generate_osm(path, nodes=100000, ways=15000, tags_per_element=2, address_share=0.1,
+                 nodes_per_way=8, seed=0, relations=0, members_per_relation=6):
+    """This function writes a synthetic osm file to path. The same parameters always give
+    the same file, so benchmark runs are comparable. The relations are drawn after the
+    nodes and ways, which stay the same for any number of relations."""
+
+    rng = random.Random(seed)
+    users = [(uid, "user{0}".format(uid)) for uid in range(1, 200)]
+
+    with open(path, 'w') as osm_file:
+        osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        osm_file.write('<osm version="0.6" generator="benchmark.py">\n')
+        osm_file.write(' <bounds minlat="42.2" minlon="-71.2" maxlat="42.4" maxlon="-70.9"/>\n')
+
+        for node_id in xrange(1, nodes + 1):
+            uid, user = rng.choice(users)
+            tags = generate_tags(rng, rng.randint(0, tags_per_element * 2), address_share)
+            osm_file.write(' <node id="{0}" lat="{1:.7f}" lon="{2:.7f}" version="{3}" timestamp="2016-{4:02d}-01T12:00:00Z" '
+                           'changeset="{5}" uid="{6}" user="{7}"{8}>\n'.format(
+                               node_id, rng.uniform(42.2, 42.4), rng.uniform(-71.2, -70.9), rng.randint(1, 6),
+                               rng.randint(1, 12), rng.randint(1, 40000000), uid, user, '' if tags else '/'))
+            if tags:
+                write_tags(osm_file, tags)
+                osm_file.write(' </node>\n')
+
+        for way_id in xrange(1, ways + 1):
+            uid, user = rng.choice(users)
+            osm_file.write(' <way id="{0}" version="{1}" timestamp="2016-{2:02d}-01T12:00:00Z" changeset="{3}" '
+                           'uid="{4}" user="{5}">\n'.format(
+                               way_id, rng.randint(1, 6), rng.randint(1, 12), rng.randint(1, 40000000), uid, user))
+            for _ in range(rng.randint(2, nodes_per_way * 2)):
+                osm_file.write('  <nd ref="{0}"/>\n'.format(rng.randint(1, nodes)))
+            write_tags(osm_file, generate_tags(rng, tags_per_element, address_share))
+            osm_file.write(' </way>\n')
+
+        for relation_id in xrange(1, relations + 1):
+            uid, user = rng.choice(users)
+            osm_file.write(' <relation id="{0}" version="{1}" timestamp="2016-{2:02d}-01T12:00:00Z" changeset="{3}" '
+                           'uid="{4}" user="{5}">\n'.format(
+                               relation_id, rng.randint(1, 6), rng.randint(1, 12), rng.randint(1, 40000000), uid, user))
+            for _ in range(rng.randint(1, members_per_relation * 2)):
+                if ways and rng.random() < 0.5:
+                    member_type, ref = 'way', rng.randint(1, ways)
+                else:
+                    member_type, ref = 'node', rng.randint(1, nodes)
+                osm_file.write('  <member type="{0}" ref="{1}" role="{2}"/>\n'.format(member_type, ref, rng.choice(ROLES)))
+            tags = [("type", rng.choice(RELATION_TYPES))] + generate_tags(rng, tags_per_element, 0)
+            write_tags(osm_file, tags)
+            osm_file.write(' </relation>\n')
+
+        osm_file.write('</osm>\n')
+
+
+def run_pipeline(path, out_dir, validate=True, parser=None, collectors=(), **options):
+    """This function converts path with data.process_map, writing every output to out_dir,
+    and returns a dictionary of results from the instrument.PipelineStats of the run.
+
+    collectors are names from COLLECTORS and options are passed on to process_map, so the
+    parallel, staged, sqlite, parquet and geometry conversions are measured by the same
+    code that runs them. Stage times of a parallel run are summed over the processes."""
+
+    stats = PipelineStats(interval=float('inf'))
+    old_cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        data.process_map(path, validate, stats=stats, parser=parser,
+                         collectors=[COLLECTORS[name](out_dir) for name in collectors], **options)
+    finally:
+        os.chdir(old_cwd)
+
+    report = stats.report()
+    elements = sum(report['elements'].itervalues())
+    total = report['seconds']
+    size = os.path.getsize(path)
+    # ru_maxrss is in kilobytes on linux; the children are the shard processes of a parallel run
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results = {
+        'elements': elements,
+        'element_counts': report['elements'],
+        'input_mb': size / 1048576.0,
+        'seconds': total,
+        'elements_per_sec': elements / total,
+        'mb_per_sec': size / 1048576.0 / total,
+        'peak_rss_mb': peak_rss / 1024.0,
+        'stages': {
+            'parse': report['stage_seconds']['iterparse'],
+            'shape': report['stage_seconds']['shape'],
+            'validate': report['stage_seconds']['validate'],
+            'write': sum(report['write_seconds'].itervalues())
+        }
+    }
+    if 'pipeline' in report:
+        results['pipeline'] = report['pipeline']
+    return results
+
+
+def check_regression(results, baseline, tolerance=TOLERANCE):
+    """This function returns a list of messages for every rate that fell more than
+    tolerance below the baseline"""
+
+    failures = []
+    for metric in ('elements_per_sec', 'mb_per_sec'):
+        expected = baseline.get(metric)
+        if expected and results[metric] < expected * (1 - tolerance):
+            failures.append("{0}: {1:.1f} is more than {2:.0%} below the baseline {3:.1f}".format(
+                metric, results[metric], tolerance, expected))
+    return failures
+
+
+def print_results(results):
+    print "elements:        {0} ({1})".format(results['elements'], ", ".join(
+        "{0} {1}s".format(count, tag) for tag, count in sorted(results['element_counts'].iteritems())))
+    print "input:           {0:.1f} MB".format(results['input_mb'])
+    print "total time:      {0:.2f} s".format(results['seconds'])
+    print "elements/sec:    {0:.0f}".format(results['elements_per_sec'])
+    print "MB/sec:          {0:.2f}".format(results['mb_per_sec'])
+    print "peak RSS:        {0:.1f} MB".format(results['peak_rss_mb'])
+    print "---------------------------------------------------------------------------------"
+    for stage in ('parse', 'shape', 'validate', 'write'):
+        seconds = results['stages'][stage]
+        print "{0:<16} {1:.2f} s ({2:.0%})".format(stage + ":", seconds, seconds / results['seconds'])
+    if 'pipeline' in results:
+        print "---------------------------------------------------------------------------------"
+        for name, stage in sorted(results['pipeline']['stages'].iteritems()):
+            print "{0:<24} {1:.0%} busy".format(name + ":", stage['utilization'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the osm to csv conversion")
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--ways', type=int, default=15000)
+    parser.add_argument('--relations', type=int, default=1500)
+    parser.add_argument('--tags-per-element', type=int, default=2)
+    parser.add_argument('--address-share', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-validate', action='store_true')
+    parser.add_argument('--parser', choices=[name for name in available_parsers() if name in XML_PARSERS],
+                        help="XML backend, the fastest installed by default")
+    parser.add_argument('--processes', type=int, default=1, help="convert shards in this many processes")
+    parser.add_argument('--staged', action='store_true', help="run the staged pipeline of threads")
+    parser.add_argument('--workers', type=int, default=1, help="shaping threads of the staged pipeline")
+    parser.add_argument('--output', choices=('csv', 'sqlite', 'parquet'), default='csv')
+    parser.add_argument('--geometry', action='store_true', help="resolve and write the way geometry")
+    parser.add_argument('--collector', action='append', choices=sorted(COLLECTORS), default=[],
+                        help="run a collector along with the conversion, may be repeated")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the results as the new baseline instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='osm_benchmark_')
+    try:
+        osm_path = os.path.join(work_dir, 'synthetic.osm')
+        generate_osm(osm_path, args.nodes, args.ways, args.tags_per_element, args.address_share, seed=args.seed,
+                     relations=args.relations)
+        results = run_pipeline(osm_path, work_dir, validate=not args.no_validate, parser=args.parser,
+                               collectors=args.collector, processes=args.processes, staged=args.staged,
+                               workers=args.workers, output=args.output, geometry=args.geometry)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print_results(results)
+    results['parameters'] = vars(args)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print "saved baseline to", args.baseline
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print "NO BASELINE: {0} does not exist, nothing was checked for regressions".format(args.baseline)
+        print "  record one with --save-baseline"
+        return 2
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    workload = ('nodes', 'ways', 'relations', 'tags_per_element', 'address_share', 'seed', 'no_validate', 'parser',
+                'processes', 'staged', 'workers', 'output', 'geometry', 'collector')
+    if any(baseline.get('parameters', {}).get(key) != results['parameters'][key] for key in workload):
+        print "warning: the baseline was recorded with different parameters"
+    failures = check_regression(results, baseline, args.tolerance)
+    if failures:
+        print "PERFORMANCE REGRESSION"
+        for failure in failures:
+            print "  " + failure
+        return 1
+    print "no regression against", args.baseline
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
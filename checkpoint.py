@@ -0,0 +1,100 @@
+# checkpoints of a csv conversion, so an interrupted run can resume where it stopped
+
+import json
+import os
+
+CHECKPOINT_PATH = "boston_massachusetts.checkpoint"
+
+# input bytes converted between two checkpoints
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+
+def input_fingerprint(path):
+    """This function returns the name, size and mtime of the input file, which must be
+    unchanged for a checkpoint to be resumed"""
+
+    return {'path': os.path.abspath(path), 'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)}
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """This function returns the checkpoint saved at path, or None if there is none"""
+
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(state, path=CHECKPOINT_PATH):
+    """This function writes state to path through a synced temporary file and a rename,
+    so a crash leaves either the previous checkpoint or the new one"""
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as checkpoint_file:
+        json.dump(state, checkpoint_file, indent=2, sort_keys=True)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.rename(temp_path, path)
+
+
+def check_resumable(state, file_in, options):
+    """This function raises ValueError if the checkpoint state was written for another
+    input file, other options or outputs that have since been cut short"""
+
+    if state['input'] != input_fingerprint(file_in):
+        raise ValueError("{0} changed since the checkpoint was written".format(file_in))
+    if state['options'] != options:
+        raise ValueError("the checkpoint was written with other options: {0}".format(state['options']))
+    for key, output in state['outputs'].iteritems():
+        if not os.path.exists(output['path']) or os.path.getsize(output['path']) < output['position']:
+            raise ValueError("{0} is shorter than at the checkpoint".format(output['path']))
+
+
+def open_outputs(paths, positions=None):
+    """This function opens the output files in paths for writing. With positions, the
+    files of a resumed run are cut back to their checkpointed size and appended to."""
+
+    files = {}
+    try:
+        for key, path in paths.iteritems():
+            if positions is None:
+                files[key] = open(path, 'wb')
+            else:
+                files[key] = open(path, 'r+b')
+                files[key].truncate(positions[key])
+                files[key].seek(0, os.SEEK_END)
+    except:
+        for output_file in files.itervalues():
+            output_file.close()
+        raise
+    return files
+
+
+def sync_outputs(files):
+    """This function flushes the output files to disk and returns their positions"""
+
+    positions = {}
+    for key, output_file in files.iteritems():
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        positions[key] = output_file.tell()
+    return positions
+
+
+class CountingWriter(object):
+    """Wrapper around a table writer that counts the rows written"""
+
+    def __init__(self, writer, rows=0):
+        self.writer = writer
+        self.rows = rows
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
@@ -0,0 +1,270 @@
+# transparent decompression of input files and optional compression of output files
+
+import bz2
+import gzip
+import subprocess
+import threading
+from distutils.spawn import find_executable
+from Queue import Queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from backports import lzma
+except ImportError:
+    lzma = None
+
+# leading bytes of each supported compression format
+MAGIC_BYTES = [
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bz2'),
+    ('\x28\xb5\x2f\xfd', 'zstd'),
+    ('\xfd7zXZ\x00', 'xz')
+]
+
+# file extension of each compression format
+EXTENSIONS = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'zstd': '.zst',
+    'xz': '.xz'
+}
+
+# command line tools that stream each format, parallel implementations first
+DECOMPRESS_COMMANDS = {
+    'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+    'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'zstd': [['zstd', '-dcq']],
+    'xz': [['xz', '-dc']]
+}
+COMPRESS_COMMANDS = {
+    'gzip': [['pigz', '-c'], ['gzip', '-c']],
+    'zstd': [['zstd', '-cq']]
+}
+
+# formats that can be written; concatenated gzip members and zstd frames are still one
+# valid file, which the parallel csv output relies on
+OUTPUT_COMPRESSIONS = ('gzip', 'zstd')
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_CHUNKS = 16
+BUFFER_SIZE = 1024 * 1024
+
+
+def detect_compression(path):
+    """This function returns 'gzip', 'bz2', 'zstd' or 'xz' for a compressed file, judged by its
+    leading bytes or else its extension, and None for a plain file"""
+
+    with open(path, 'rb') as raw_file:
+        head = raw_file.read(6)
+    for magic, compression in MAGIC_BYTES:
+        if head.startswith(magic):
+            return compression
+    for compression, extension in EXTENSIONS.iteritems():
+        if path.endswith(extension):
+            return compression
+    return None
+
+
+def find_command(commands):
+    """This function returns the first of commands whose program is installed, or None"""
+
+    for command in commands:
+        if find_executable(command[0]):
+            return command
+    return None
+
+
+def output_path(path, compression=None):
+    """This function returns path with the extension of compression appended"""
+
+    if compression is None:
+        return path
+    return path + EXTENSIONS[compression]
+
+
+# ================================================== #
+#               Input                                #
+# ================================================== #
+class PipeReader(object):
+    """File-like reader of the output of a decompression command, which runs in its own
+    process and so overlaps with parsing"""
+
+    def __init__(self, command, path):
+        self.command = command
+        self.process = subprocess.Popen(command + [path], stdout=subprocess.PIPE, bufsize=CHUNK_SIZE,
+                                        close_fds=True)
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        if not data and self.process.wait() != 0:
+            raise IOError("{0} exited with status {1}".format(self.command[0], self.process.returncode))
+        return data
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class ThreadedReader(object):
+    """File-like reader that reads chunks of a decompressing file object in a background
+    thread, a bounded number of chunks ahead of the consumer. zlib and bz2 release the GIL
+    while they decompress, so this overlaps with parsing."""
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, queue_chunks=QUEUE_CHUNKS):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.queue = Queue(queue_chunks)
+        self.buffer = ''
+        self.done = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.closed:
+                chunk = self.source.read(self.chunk_size)
+                self.queue.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self.queue.put(e)
+
+    def next_chunk(self):
+        chunk = self.queue.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        if not chunk:
+            self.done = True
+        return chunk
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = [self.buffer]
+            while not self.done:
+                chunks.append(self.next_chunk())
+            self.buffer = ''
+            return ''.join(chunks)
+
+        while len(self.buffer) < size and not self.done:
+            self.buffer += self.next_chunk()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.closed = True
+        # unblock the thread if it waits for room in the queue
+        while self.thread.is_alive():
+            while not self.queue.empty():
+                self.queue.get()
+            self.thread.join(0.1)
+        self.source.close()
+
+
+def open_input(path):
+    """This function opens path for reading and returns a file object that yields the
+    decompressed data of a .gz, .bz2, .zst or .xz file, or the plain file otherwise.
+
+    Decompression runs in a separate process when a command line tool for the format is
+    installed, and in a background thread otherwise."""
+
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, 'rb')
+
+    command = find_command(DECOMPRESS_COMMANDS[compression])
+    if command is not None:
+        return PipeReader(command, path)
+
+    if compression == 'gzip':
+        return ThreadedReader(gzip.open(path, 'rb'))
+    if compression == 'bz2':
+        return ThreadedReader(bz2.BZ2File(path, 'rb'))
+    if compression == 'xz':
+        if lzma is not None:
+            return ThreadedReader(lzma.LZMAFile(path, 'rb'))
+        raise IOError("reading {0} requires the xz command or the backports.lzma module".format(path))
+    if zstandard is not None:
+        return ThreadedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')))
+    raise IOError("reading {0} requires the zstd command or the zstandard module".format(path))
+
+
+# ================================================== #
+#               Output                               #
+# ================================================== #
+class BufferedWriter(object):
+    """Collect small writes, such as the rows of a csv writer, and pass them on to the
+    underlying file in blocks of buffer_size bytes"""
+
+    def __init__(self, target, buffer_size=BUFFER_SIZE):
+        self.target = target
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.target.write(''.join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.target.close()
+
+
+class PipeWriter(object):
+    """File-like writer that feeds a compression command running in its own process"""
+
+    def __init__(self, command, path):
+        self.command = command
+        self.out_file = open(path, 'wb')
+        # close_fds keeps the other writers' pipes out of this process, or they would never see EOF
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=self.out_file,
+                                        bufsize=BUFFER_SIZE, close_fds=True)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        status = self.process.wait()
+        self.out_file.close()
+        if status != 0:
+            raise IOError("{0} exited with status {1}".format(self.command[0], status))
+
+
+def open_output(path, compression=None):
+    """This function opens path for writing, compressed with 'gzip' or 'zstd' if given.
+    The caller picks the file name, see output_path.
+
+    Compression runs in a separate process when a command line tool for the format is
+    installed; the in-process fallbacks get their input in large blocks."""
+
+    if compression is None:
+        return open(path, 'wb')
+    if compression not in OUTPUT_COMPRESSIONS:
+        raise ValueError("unknown output compression: {0}".format(compression))
+
+    command = find_command(COMPRESS_COMMANDS[compression])
+    if command is not None:
+        return PipeWriter(command, path)
+
+    if compression == 'gzip':
+        return BufferedWriter(gzip.open(path, 'wb', compresslevel=6))
+    if zstandard is not None:
+        return BufferedWriter(zstandard.ZstdCompressor().stream_writer(open(path, 'wb')))
+    raise IOError("writing {0} requires the zstd command or the zstandard module".format(path))
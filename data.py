@@ -1,9 +1,27 @@
 # imports
-import xml.etree.cElementTree as ET
+import argparse
 import re
 import csv
-import codecs
-import cerberus
+import os
+import shutil
+import multiprocessing
+import pprint
+from collections import namedtuple
+
+import checkpoint
+import parquet_writer
+import sqlite_writer
+from compressed_io import detect_compression, open_output, output_path
+from instrument import PipelineStats
+from memo import lru_cache
+from node_store import open_node_store, StoreFrozen, way_geometry
+from osm_shards import find_document_end, find_element_start, find_shards, ShardReader
+from osm_stream import iter_elements
+from pbf_reader import is_pbf, iter_elements as iter_pbf_elements, PbfElement
+from rollups import ROLLUPS_PATH, RollupCollector
+from schema_validator import SchemaValidator
+from staged_pipeline import DONE, StagedPipeline
+from tag_index import TAG_INDEX_PATH, TagIndexBuilder
 
 # osm file to be processed
 OSM_PATH = "boston_massachusetts.osm"
@@ -14,6 +32,45 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
+
+# csv file for each table of a shaped element
+CSV_PATHS = {
+    'node': NODES_PATH,
+    'node_tags': NODE_TAGS_PATH,
+    'way': WAYS_PATH,
+    'way_nodes': WAY_NODES_PATH,
+    'way_tags': WAY_TAGS_PATH,
+    'relation': RELATIONS_PATH,
+    'relation_members': RELATION_MEMBERS_PATH,
+    'relation_tags': RELATION_TAGS_PATH,
+    'way_geometry': WAY_GEOMETRY_PATH
+}
+
+# parquet file for each table of a shaped element
+PARQUET_PATHS = {
+    'node': "nodes.parquet",
+    'node_tags': "nodes_tags.parquet",
+    'way': "ways.parquet",
+    'way_nodes': "ways_nodes.parquet",
+    'way_tags': "ways_tags.parquet",
+    'relation': "relations.parquet",
+    'relation_members': "relations_members.parquet",
+    'relation_tags': "relations_tags.parquet",
+    'way_geometry': "ways_geometry.parquet"
+}
+
+# json report of counts and stage timings
+STATS_PATH = "process_map_stats.json"
+
+# set up sqlite database for direct loading
+SQLITE_PATH = "boston_massachusetts.db"
+
+# top level elements that are shaped and exported
+ELEMENT_TAGS = ('node', 'way', 'relation')
 
 # set up re for matching problem characters
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
@@ -78,6 +135,42 @@ SCHEMA = {
                 'type': {'required': True, 'type': 'string'}
             }
         }
+    },
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'type': {'required': True, 'type': 'string'},
+                'ref': {'required': True, 'type': 'integer', 'coerce': int},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
     }
 }
 
@@ -88,10 +181,61 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'type', 'ref', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_GEOMETRY_FIELDS = ['id', 'missing_nodes', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'length',
+                       'centroid_lat', 'centroid_lon', 'coordinates']
+
+# values of the metadata attributes that files without user data leave out, as osmium
+# reads them: uid 0 and an empty user name stand for an anonymous user
+METADATA_DEFAULTS = {'user': '', 'uid': '0', 'version': '0', 'changeset': '0', 'timestamp': ''}
+
+# fields of each table of a shaped element
+TABLE_FIELDS = {
+    'node': NODE_FIELDS,
+    'node_tags': NODE_TAGS_FIELDS,
+    'way': WAY_FIELDS,
+    'way_nodes': WAY_NODES_FIELDS,
+    'way_tags': WAY_TAGS_FIELDS,
+    'relation': RELATION_FIELDS,
+    'relation_members': RELATION_MEMBERS_FIELDS,
+    'relation_tags': RELATION_TAGS_FIELDS
+}
+
+# compact records for the rows of each table, with the fields in the order of the csv columns
+NodeRecord = namedtuple('NodeRecord', NODE_FIELDS)
+WayRecord = namedtuple('WayRecord', WAY_FIELDS)
+RelationRecord = namedtuple('RelationRecord', RELATION_FIELDS)
+TagRecord = namedtuple('TagRecord', NODE_TAGS_FIELDS)
+WayNodeRecord = namedtuple('WayNodeRecord', WAY_NODES_FIELDS)
+MemberRecord = namedtuple('MemberRecord', RELATION_MEMBERS_FIELDS)
+WayGeometryRecord = namedtuple('WayGeometryRecord', WAY_GEOMETRY_FIELDS)
+
+# sqlite tables as (element key, table name, fields, primary key, indexed fields)
+SQLITE_TABLES = [
+    ('node', 'nodes', NODE_FIELDS, 'id', []),
+    ('node_tags', 'nodes_tags', NODE_TAGS_FIELDS, None, ['id', 'key']),
+    ('way', 'ways', WAY_FIELDS, 'id', []),
+    ('way_nodes', 'ways_nodes', WAY_NODES_FIELDS, None, ['id', 'node_id']),
+    ('way_tags', 'ways_tags', WAY_TAGS_FIELDS, None, ['id', 'key']),
+    ('relation', 'relations', RELATION_FIELDS, 'id', []),
+    ('relation_members', 'relations_members', RELATION_MEMBERS_FIELDS, None, ['id', 'ref']),
+    ('relation_tags', 'relations_tags', RELATION_TAGS_FIELDS, None, ['id', 'key'])
+]
+
+# optional table of way geometry resolved from the node locations
+WAY_GEOMETRY_SQLITE_TABLE = ('way_geometry', 'ways_geometry', WAY_GEOMETRY_FIELDS, 'id', [])
 
 # assemble a mappinng dictionary for cleaning street names
 mapping = {"Ave": "Avenue", "Ave.": "Avenue", "Ct": "Court", "Dr": "Drive",    "HIghway": "Highway", "Hwy": "Highway", "Pkwy": "Parkway", "Pl": "Place", "place": "Place","Rd": "Road", "rd.": "Road", "Sq.": "Square", "ST": "Street", "St": "Street", "St,": "Street", "St.": "Street", "Street.": "Street", "st": "Street", "street": "Street"}
 
+# postcodes that are outside the area
+EXCLUDED_POSTCODES = frozenset(["01125", "20052", "01238", "01240", "01250"])
+
+# number of raw values remembered by each cleaning function
+CLEAN_CACHE_SIZE = 16384
+
 # helper functions for audit/cleaning tag elements
 def is_street_name(elem):
     """This function takes an element and returns whether it contains an attrib key
@@ -122,14 +266,19 @@ def clean_street_name(name, mapping):
 
     # map all street names in question to standard street names
     else:
-        name_as_list = name.split(" ")
-        if name_as_list[-1] in mapping.keys():
-            name_as_list[-1] = mapping[name_as_list[-1]]
-            name = " ".join(name_as_list)
-            return name
+        head, space, street_type = name.rpartition(" ")
+        if street_type in mapping:
+            return head + space + mapping[street_type]
         else:
             return name
 
+@lru_cache(CLEAN_CACHE_SIZE)
+def clean_street(name):
+    """This function cleans a street name with the module mapping, memoized by the raw value
+    since the same street names repeat throughout the map"""
+
+    return clean_street_name(name, mapping)
+
 def is_postcode(elem):
     """This function takes an element and returns whether it contains an attrib key
     'addr:street'.
@@ -138,6 +287,7 @@ def is_postcode(elem):
 
     return (elem.attrib["k"] == "addr:postcode")
 
+@lru_cache(CLEAN_CACHE_SIZE)
 def clean_postcode(postcode):
     """This function takes an string and returns a string of 5 digit postcode in the boston_massachusetts.osm"""
 
@@ -158,135 +308,138 @@ def clean_postcode(postcode):
         return "00000"
 
     # return "00000" for postcodes that are outside the area
-    elif postcode == "01125" or postcode == "20052" or postcode == "01238" or postcode == "01240" or postcode == "01250":
+    elif postcode in EXCLUDED_POSTCODES:
         return "00000"
     else:
         return postcode
 
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
+def cleaning_stats():
+    """This function returns the cache hits and misses of the cleaning functions"""
+
+    return {'street': dict(clean_street.cache_info()._asdict()),
+            'postcode': dict(clean_postcode.cache_info()._asdict())}
+
+def shape_tag_records(element, element_id, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape the secondary tags of a node, way or relation XML element to a list
+    of TagRecord"""
+
+    tags = []
+    for secondary_tag in element.iter("tag"):
+        key = secondary_tag.attrib["k"]
+
+        # skip tags with problem characters
+        if problem_chars.match(key):
+            continue
+
+        # assign tag type, tag key and tag value
+        value = secondary_tag.attrib["v"]
+        tag_as_list = key.split(":")
+        if len(tag_as_list) == 2:
+
+            # clean postcode
+            if is_postcode(secondary_tag):
+                value = clean_postcode(value)
+
+            # clean street names
+            elif is_street_name(secondary_tag):
+                value = clean_street(value)
+            tags.append(TagRecord(element_id, tag_as_list[-1], value, tag_as_list[0]))
+        elif len(tag_as_list) == 1:
+            tags.append(TagRecord(element_id, key, value, default_tag_type))
+        else:
+            tags.append(TagRecord(element_id, ":".join(tag_as_list[-2:]), value, tag_as_list[0]))
+    return tags
 
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
+def attribute_values(attrib, fields):
+    """Return the values of fields in attrib, with METADATA_DEFAULTS for the metadata
+    attributes it leaves out"""
+
+    return [attrib[field] if field in attrib or field not in METADATA_DEFAULTS else METADATA_DEFAULTS[field]
+            for field in fields]
+
+def shape_records(element, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape node, way or relation XML element to a dict of records by table,
+    a single record for the element itself and a list of records for each child table.
+    Missing user, uid, version, changeset or timestamp attributes are filled in from
+    METADATA_DEFAULTS."""
+
+    attrib = element.attrib
 
     # process node elements
     if element.tag == 'node':
+        try:
+            node = NodeRecord._make([attrib[field] for field in NODE_FIELDS])
+        except KeyError:
+            node = NodeRecord._make(attribute_values(attrib, NODE_FIELDS))
+        return {'node': node,
+                'node_tags': shape_tag_records(element, node.id, problem_chars, default_tag_type)}
 
-        # first assemble node_attribs
-        for field in node_attr_fields:
-            node_attribs[field] = element.attrib[field]
+    # process way elements, keeping the position of each node in the way
+    elif element.tag == 'way':
+        try:
+            way = WayRecord._make([attrib[field] for field in WAY_FIELDS])
+        except KeyError:
+            way = WayRecord._make(attribute_values(attrib, WAY_FIELDS))
+        way_nodes = [WayNodeRecord(way.id, nd.attrib["ref"], position)
+                     for position, nd in enumerate(element.iter("nd"))]
+        return {'way': way, 'way_nodes': way_nodes,
+                'way_tags': shape_tag_records(element, way.id, problem_chars, default_tag_type)}
 
-        # next process tags associated with the node
-        for secondary_tag in element.iter("tag"):
+    # process relation elements, keeping the members in their order in the relation
+    elif element.tag == 'relation':
+        try:
+            relation = RelationRecord._make([attrib[field] for field in RELATION_FIELDS])
+        except KeyError:
+            relation = RelationRecord._make(attribute_values(attrib, RELATION_FIELDS))
+        relation_members = [MemberRecord(relation.id, member.attrib["type"], member.attrib["ref"],
+                                         member.attrib.get("role", ""), position)
+                            for position, member in enumerate(element.iter("member"))]
+        return {'relation': relation, 'relation_members': relation_members,
+                'relation_tags': shape_tag_records(element, relation.id, problem_chars, default_tag_type)}
 
-            # skip tags with problem characters
-            if problem_chars.match(secondary_tag.attrib["k"]):
-                continue
-            else:
-                tag = {}
-                tag_as_list = secondary_tag.attrib["k"].split(":")
+def record_dict(record):
+    """Return a record as a dict of its fields"""
 
-                # assign tag type, tag key and tag value
-                if len(tag_as_list) == 2:
-                    tag["type"] = tag_as_list[0]
-                    tag["key"] = tag_as_list[-1]
+    return dict(zip(record._fields, record))
 
-                    # clean postcode
-                    if is_postcode(secondary_tag):
-                        tag["value"] = clean_postcode(secondary_tag.attrib["v"])
+def shape_tags(element, element_id, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape the secondary tags of a node, way or relation XML element to a list
+    of Python dicts"""
 
-                    # clean street names
-                    elif is_street_name(secondary_tag):
-                        tag["value"] = clean_street_name(secondary_tag.attrib["v"], mapping)
-                    else:
-                        tag["value"] = secondary_tag.attrib["v"]
-                elif len(tag_as_list) == 1:
-                    tag["type"] = default_tag_type
-                    tag["key"] = secondary_tag.attrib["k"]
-                    tag["value"] = secondary_tag.attrib["v"]
-                else:
-                    tag["type"] = tag_as_list[0]
-                    tag["key"] = ":".join(tag_as_list[-2:])
-                    tag["value"] = secondary_tag.attrib["v"]
-
-                # add tag id to processed tags
-                tag["id"] = node_attribs["id"]
-                tags.append(tag)
-        return {'node': node_attribs, 'node_tags': tags}
-
-    # process way elements
-    elif element.tag == 'way':
+    return [record_dict(tag) for tag in shape_tag_records(element, element_id, problem_chars, default_tag_type)]
 
-        # first assemble way attributes
-        for field in WAY_FIELDS:
-            way_attribs[field] = element.attrib[field]
-
-        # next assign way_nodes relationships
-        nd_index = 0
-        way_node = {}
-        for nd in element.iter("nd"):
-            way_node = {"id": None, "node_id": None, "position": None}
-            way_node["id"] = way_attribs["id"]
-            way_node["node_id"] = nd.attrib["ref"]
-            way_node["position"] = nd_index
-            nd_index += 1
-            way_nodes.append(way_node)
-
-        # next process tags associated with the way
-        for secondary_tag in element.iter("tag"):
-
-            # skip tags with problem characters
-            if PROBLEMCHARS.match(secondary_tag.attrib["k"]):
-                continue
-            else:
-                tag = {}
-                tag_as_list = secondary_tag.attrib["k"].split(":")
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular',
+                  relation_attr_fields=RELATION_FIELDS):
+    """Clean and shape node, way or relation XML element to Python dict
 
-                # assign tag type, tag key, tag value
-                if len(tag_as_list) == 2:
-                    tag["type"] = tag_as_list[0]
-                    tag["key"] = tag_as_list[-1]
+    This is a dict view of shape_records for code that works with dicts; the conversion
+    itself writes the records."""
 
-                    # clean postcode
-                    if is_postcode(secondary_tag):
-                        tag["value"] = clean_postcode(secondary_tag.attrib["v"])
+    records = shape_records(element, problem_chars, default_tag_type)
+    if records is None:
+        return None
 
-                    # clean street names
-                    elif is_street_name(secondary_tag):
-                        tag["value"] = clean_street_name(secondary_tag.attrib["v"], mapping)
-                    else:
-                        tag["value"] = secondary_tag.attrib["v"]
-                elif len(tag_as_list) == 1:
-                    tag["type"] = default_tag_type
-                    tag["key"] = secondary_tag.attrib["k"]
-                    tag["value"] = secondary_tag.attrib["v"]
-                else:
-                    tag["type"] = tag_as_list[0]
-                    tag["key"] = ":".join(tag_as_list[-2:])
-                    tag["value"] = secondary_tag.attrib["v"]
-
-                # add tag id to processed tags
-                tag["id"] = way_attribs["id"]
-                tags.append(tag)
-        print tags
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+    attr_fields = {'node': node_attr_fields, 'way': way_attr_fields, 'relation': relation_attr_fields}
+    shaped = {}
+    for key, value in records.iteritems():
+        if key == element.tag:
+            shaped[key] = dict(zip(attr_fields[key], attribute_values(element.attrib, attr_fields[key])))
+        else:
+            shaped[key] = [record_dict(record) for record in value]
+    return shaped
 
 
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), parser=None):
+    """Yield element if it is the right type of tag
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    parser picks the backend of osm_stream.iter_elements, lxml if it is installed and
+    cElementTree otherwise."""
+
+    return iter_elements(osm_file, tags, parser)
 
 
 def validate_element(element, validator, schema=SCHEMA):
@@ -299,6 +452,36 @@ def validate_element(element, validator, schema=SCHEMA):
         raise Exception(message_string.format(field, error_string))
 
 
+def valid_check(validator, timed=False):
+    """Return a function that only answers whether a shaped element is valid. Calling it
+    before validate_element lets a valid element skip the layers of validate_element and
+    SchemaValidator.validate, which then only run to report the errors. When timed, it
+    answers False, so that every element is timed in validate_element."""
+
+    if timed or validator.fast is None:
+        return lambda el: False
+    return validator.fast
+
+
+class UnicodeRecordWriter(object):
+    """Write records to csv in field order, encoding unicode values as utf-8. Has the
+    writeheader/writerow/writerows interface of csv.DictWriter."""
+
+    def __init__(self, f, fieldnames):
+        self.fieldnames = fieldnames
+        self.writer = csv.writer(f)
+
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+
+    def writerow(self, row):
+        self.writer.writerow([v.encode('utf-8') if isinstance(v, unicode) else v for v in row])
+
+    def writerows(self, rows):
+        self.writer.writerows([[v.encode('utf-8') if isinstance(v, unicode) else v for v in row]
+                               for row in rows])
+
+
 class UnicodeDictWriter(csv.DictWriter, object):
     """Extend csv.DictWriter to handle Unicode input"""
 
@@ -312,47 +495,552 @@ class UnicodeDictWriter(csv.DictWriter, object):
             self.writerow(row)
 
 
+def table_fields(node_store=None):
+    """Return the fields of every output table, including way geometry if a node store
+    is used to resolve it"""
+
+    if node_store is None:
+        return TABLE_FIELDS
+    return dict(TABLE_FIELDS, way_geometry=WAY_GEOMETRY_FIELDS)
+
+
+def add_node_location(node_store, node):
+    """Record the location of a node in node_store, which only takes nodes until the
+    first way has been resolved"""
+
+    try:
+        node_store.add(node.id, node.lat, node.lon)
+    except StoreFrozen:
+        raise ValueError("way geometry needs the input sorted with every node before the ways, "
+                         "but node {0} follows a way".format(node.id))
+
+
+def write_elements(elements, writers, validate, stats=None, node_store=None, collectors=()):
+    """Shape each XML element and write its parts with the writer for each table
+
+    With a node_store the node locations are recorded as they pass and every way gets
+    its geometry resolved and written to the way_geometry table. Every shaped element is
+    also handed to the add(kind, el) method of each of the collectors.
+
+    Elements are shaped to records (see shape_records), so the writers get tuples in
+    field order and each child table is written with one writerows call."""
+
+    validator = SchemaValidator(SCHEMA)
+    shape = shape_records
+    check = validate_element
+    is_valid = valid_check(validator, timed=stats is not None)
+
+    # only route through the instrumentation when it was asked for
+    if stats is not None:
+        elements = stats.iter_elements(elements)
+        writers = stats.wrap_writers(writers)
+        shape = stats.timed('shape', shape)
+        check = stats.timed('validate', check)
+
+    for element in elements:
+        el = shape(element)
+        if el:
+            if validate is True and not is_valid(el):
+                check(el, validator)
+
+            if element.tag == 'node':
+                node = el['node']
+                writers['node'].writerow(node)
+                writers['node_tags'].writerows(el['node_tags'])
+                if node_store is not None:
+                    add_node_location(node_store, node)
+            elif element.tag == 'way':
+                writers['way'].writerow(el['way'])
+                writers['way_nodes'].writerows(el['way_nodes'])
+                writers['way_tags'].writerows(el['way_tags'])
+                if node_store is not None:
+                    node_ids = [way_node.node_id for way_node in el['way_nodes']]
+                    geometry = way_geometry(el['way'].id, node_ids, node_store)
+                    writers['way_geometry'].writerow(WayGeometryRecord(**geometry))
+            elif element.tag == 'relation':
+                writers['relation'].writerow(el['relation'])
+                writers['relation_members'].writerows(el['relation_members'])
+                writers['relation_tags'].writerows(el['relation_tags'])
+
+            for collector in collectors:
+                collector.add(element.tag, el)
+
+
 # ================================================== #
-#               Main Function                        #
+#               Staged Pipeline                      #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-         codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-         codecs.open(WAYS_PATH, 'w') as ways_file, \
-         codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-         codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+# elements per batch passed between the stages
+STAGE_BATCH_SIZE = 256
+
+# batches each queue between the stages holds before it blocks the stage feeding it
+STAGE_QUEUE_BATCHES = 8
+
+
+def detach_element(element):
+    """Copy an XML element into a PbfElement, which stays valid after the parser clears
+    the element and can be shaped in another thread"""
+
+    if isinstance(element, PbfElement):
+        return element
+    return PbfElement(element.tag, dict(element.attrib), [(child.tag, dict(child.attrib)) for child in element])
+
+
+def parse_stage(stage, pipeline, elements, out_queue, workers, batch_size):
+    """Read the elements into batches of detached elements numbered in file order"""
+
+    batch = []
+    sequence = 0
+    for element in elements:
+        batch.append(detach_element(element))
+        stage.items += 1
+        if len(batch) >= batch_size:
+            pipeline.put(stage, out_queue, (sequence, batch))
+            sequence += 1
+            batch = []
+    if batch:
+        pipeline.put(stage, out_queue, (sequence, batch))
+    for _ in xrange(workers):
+        pipeline.put(stage, out_queue, DONE)
+
+
+def shape_stage(stage, pipeline, in_queue, out_queue, validate, shape, check, timed):
+    """Shape, and validate if asked, each batch of elements into (tag, el) pairs"""
+
+    validator = SchemaValidator(SCHEMA)
+    is_valid = valid_check(validator, timed)
+    for sequence, batch in pipeline.iter_queue(stage, in_queue):
+        shaped = []
+        for element in batch:
+            el = shape(element)
             if el:
-                if validate is True:
-                    validate_element(el, validator)
+                if validate is True and not is_valid(el):
+                    check(el, validator)
+                shaped.append((element.tag, el))
+        pipeline.put(stage, out_queue, (sequence, shaped))
+    pipeline.put(stage, out_queue, DONE)
+
+
+def route_stage(stage, pipeline, in_queue, table_queues, workers, node_store, collectors):
+    """Put the shaped batches back in file order and split their rows by table, one list
+    of rows per table and batch. Node locations, way geometry and the collectors are
+    handled here, since they depend on that order."""
+
+    pending = {}
+    next_sequence = 0
+    for sequence, shaped in pipeline.iter_queue(stage, in_queue, workers):
+        pending[sequence] = shaped
+        while next_sequence in pending:
+            rows = dict((key, []) for key in table_queues)
+            for tag, el in pending.pop(next_sequence):
+                if tag == 'node':
+                    node = el['node']
+                    rows['node'].append(node)
+                    rows['node_tags'].extend(el['node_tags'])
+                    if node_store is not None:
+                        add_node_location(node_store, node)
+                elif tag == 'way':
+                    rows['way'].append(el['way'])
+                    rows['way_nodes'].extend(el['way_nodes'])
+                    rows['way_tags'].extend(el['way_tags'])
+                    if node_store is not None:
+                        node_ids = [way_node.node_id for way_node in el['way_nodes']]
+                        geometry = way_geometry(el['way'].id, node_ids, node_store)
+                        rows['way_geometry'].append(WayGeometryRecord(**geometry))
+                elif tag == 'relation':
+                    rows['relation'].append(el['relation'])
+                    rows['relation_members'].extend(el['relation_members'])
+                    rows['relation_tags'].extend(el['relation_tags'])
+
+                for collector in collectors:
+                    collector.add(tag, el)
+
+            for key, table_rows in rows.iteritems():
+                if table_rows:
+                    pipeline.put(stage, table_queues[key], table_rows)
+            next_sequence += 1
+
+    for table_queue in table_queues.itervalues():
+        pipeline.put(stage, table_queue, DONE)
+
+
+def write_stage(stage, pipeline, in_queue, writer):
+    """Write each list of rows of one table"""
+
+    for rows in pipeline.iter_queue(stage, in_queue):
+        writer.writerows(rows)
+
+
+def write_elements_staged(elements, writers, validate, stats=None, node_store=None, collectors=(),
+                          workers=1, batch_size=STAGE_BATCH_SIZE, queue_batches=STAGE_QUEUE_BATCHES):
+    """Shape each XML element and write its parts like write_elements, but in a pipeline of
+    threads: a parser, workers shaping and validating batches of elements, a router that
+    restores file order and one writer per table, connected by bounded queues.
+
+    The writers get the same rows in the same order as with write_elements, so the output
+    is identical. Parsing, shaping and writing overlap, and a stage that falls behind holds
+    back the ones feeding it, which caps the memory at the queue sizes. The threads share
+    the interpreter lock, so the gain comes from disk and decompression waits overlapping
+    with the parsing and shaping rather than from more workers.
+
+    With stats, the queue depths and the utilization of each stage are added to its report
+    under 'pipeline'. The pipeline report is also returned."""
+
+    shape = shape_records
+    check = validate_element
+    if stats is not None:
+        elements = stats.iter_elements(elements)
+        writers = stats.wrap_writers(writers)
+        shape = stats.timed('shape', shape)
+        check = stats.timed('validate', check)
+
+    pipeline = StagedPipeline()
+    element_queue = pipeline.queue('elements', queue_batches)
+    shaped_queue = pipeline.queue('shaped', queue_batches)
+    table_queues = dict((key, pipeline.queue(key, queue_batches)) for key in writers)
+
+    pipeline.stage('parse', parse_stage, pipeline, elements, element_queue, workers, batch_size)
+    for index in xrange(workers):
+        pipeline.stage('shape{0}'.format(index), shape_stage, pipeline, element_queue, shaped_queue,
+                       validate, shape, check, stats is not None)
+    pipeline.stage('route', route_stage, pipeline, shaped_queue, table_queues, workers, node_store, collectors)
+    for key, writer in writers.iteritems():
+        pipeline.stage('write_' + key, write_stage, pipeline, table_queues[key], writer)
+
+    pipeline.start()
+    pipeline.join()
+
+    report = pipeline.report()
+    if stats is not None:
+        stats.pipeline = report
+    return report
+
+
+def write_csvs(elements, paths, validate, header=True, stats=None, node_store=None, collectors=(),
+               compression=None, staged=False, workers=1):
+    """Shape each XML element and write it to the csv files in paths, compressed with
+    'gzip' or 'zstd' if compression is given (the extension is added to each path).
+    staged=True writes them through write_elements_staged with workers shaping threads."""
+
+    files = {}
+    try:
+        writers = {}
+        for key, fields in table_fields(node_store).iteritems():
+            files[key] = open_output(output_path(paths[key], compression), compression)
+            writers[key] = UnicodeRecordWriter(files[key], fields)
+            if header:
+                writers[key].writeheader()
+
+        if staged:
+            write_elements_staged(elements, writers, validate, stats, node_store, collectors, workers)
+        else:
+            write_elements(elements, writers, validate, stats, node_store, collectors)
+    finally:
+        for csv_file in files.itervalues():
+            csv_file.close()
+
+
+def write_sqlite(elements, db_path, validate, stats=None, node_store=None, collectors=()):
+    """Shape each XML element and bulk load it into the sqlite database at db_path"""
+
+    tables = SQLITE_TABLES if node_store is None else SQLITE_TABLES + [WAY_GEOMETRY_SQLITE_TABLE]
+    connection, writers = sqlite_writer.open_database(db_path, tables)
+    try:
+        write_elements(elements, writers, validate, stats, node_store, collectors)
+    except:
+        connection.close()
+        raise
+    sqlite_writer.close_database(connection, writers, tables)
+
+
+def write_parquet(elements, paths, validate, stats=None, node_store=None, collectors=()):
+    """Shape each XML element and write it to the typed parquet tables in paths"""
+
+    fields = table_fields(node_store)
+    writers = parquet_writer.open_writers(dict((key, paths[key]) for key in fields), fields)
+    try:
+        write_elements(elements, writers, validate, stats, node_store, collectors)
+    finally:
+        parquet_writer.close_writers(writers)
+
+
+def process_shard(task):
+    """Shape one byte range of the osm file into its own partial csv files"""
+
+    file_in, start, end, paths, validate, collect_stats, parser, compression = task
+    shard = ShardReader(file_in, start, end)
+    stats = None
+    if collect_stats:
+        stats = PipelineStats(interval=float('inf'))
+        shard = stats.open_input(shard)
+    try:
+        write_csvs(get_element(shard, tags=ELEMENT_TAGS, parser=parser), paths, validate, header=False, stats=stats,
+                   compression=compression)
+    finally:
+        shard.close()
+    return paths, stats.report() if stats else None
+
+
+def process_map_parallel(file_in, validate, processes, stats=None, parser=None, compression=None):
+    """Shape shards of the osm file in a process pool and concatenate the partial csvs
+    in file order, so the output matches the serial process_map byte for byte. Compressed
+    parts are concatenated the same way, as gzip members or zstd frames."""
+
+    # use a few shards per process so slow shards do not leave the pool idle
+    shards = find_shards(file_in, processes * 4)
+    tasks = []
+    for index, (start, end) in enumerate(shards):
+        paths = dict((key, '{0}.part{1}'.format(CSV_PATHS[key], index)) for key in TABLE_FIELDS)
+        tasks.append((file_in, start, end, paths, validate, stats is not None, parser, compression))
+
+    if stats is not None:
+        stats.total_bytes = os.path.getsize(file_in)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        part_paths = []
+        for paths, report in pool.imap(process_shard, tasks, chunksize=1):
+            part_paths.append(paths)
+            if stats is not None:
+                stats.merge(report)
+                stats.print_progress()
+    finally:
+        pool.close()
+        pool.join()
+
+    # write an empty csv with just the header for each table, then append the parts
+    write_csvs([], CSV_PATHS, validate=False, compression=compression)
+    for key in TABLE_FIELDS:
+        with open(output_path(CSV_PATHS[key], compression), 'ab') as out_file:
+            for paths in part_paths:
+                part_path = output_path(paths[key], compression)
+                with open(part_path, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, out_file)
+                os.remove(part_path)
+
+
+def process_map_checkpointed(file_in, validate, checkpoint_path=checkpoint.CHECKPOINT_PATH, resume=False,
+                             stats=None, parser=None, staged=False, workers=1,
+                             checkpoint_bytes=checkpoint.CHECKPOINT_BYTES):
+    """Convert the osm file to the csvs in chunks of about checkpoint_bytes that end on
+    element boundaries, and after each chunk sync the csvs and save the input offset, the
+    csv positions and the row counts to checkpoint_path.
+
+    With resume=True a run continues from the saved checkpoint: the csvs are cut back to
+    the checkpointed positions and the input is read from the checkpointed offset, so the
+    csvs end up the same as those of an uninterrupted run. Without a checkpoint the run
+    starts from the beginning, and a finished run is not repeated."""
+
+    paths = dict((key, CSV_PATHS[key]) for key in TABLE_FIELDS)
+    options = {'paths': paths}
+    state = checkpoint.load_checkpoint(checkpoint_path) if resume else None
+    if state is not None:
+        checkpoint.check_resumable(state, file_in, options)
+        if state['complete']:
+            return
+
+    with open(file_in, 'rb') as osm_file:
+        end = find_document_end(osm_file)
+        if state is None:
+            offset = find_element_start(osm_file, 0, end)
+            positions = None
+            rows = {}
+        else:
+            offset = state['offset']
+            positions = dict((key, output['position']) for key, output in state['outputs'].iteritems())
+            rows = dict((key, output['rows']) for key, output in state['outputs'].iteritems())
+
+        if stats is not None:
+            stats.total_bytes = os.path.getsize(file_in)
+            stats.bytes_read = offset
+
+        files = checkpoint.open_outputs(paths, positions)
+        try:
+            writers = dict((key, checkpoint.CountingWriter(UnicodeRecordWriter(files[key], fields), rows.get(key, 0)))
+                           for key, fields in TABLE_FIELDS.iteritems())
+            if state is None:
+                for writer in writers.itervalues():
+                    writer.writeheader()
+
+            def save(complete=False):
+                positions = checkpoint.sync_outputs(files)
+                outputs = dict((key, {'path': paths[key], 'position': positions[key], 'rows': writer.rows})
+                               for key, writer in writers.iteritems())
+                checkpoint.save_checkpoint({'input': checkpoint.input_fingerprint(file_in), 'options': options,
+                                            'offset': offset, 'end': end, 'outputs': outputs,
+                                            'complete': complete}, checkpoint_path)
+
+            save()
+            while offset < end:
+                chunk_end = find_element_start(osm_file, offset + checkpoint_bytes, end)
+                shard = ShardReader(file_in, offset, chunk_end)
+                if stats is not None:
+                    shard = stats.open_input(shard)
+                try:
+                    elements = get_element(shard, tags=ELEMENT_TAGS, parser=parser)
+                    if staged:
+                        write_elements_staged(elements, writers, validate, stats, workers=workers)
+                    else:
+                        write_elements(elements, writers, validate, stats)
+                finally:
+                    shard.close()
+                offset = chunk_end
+                save()
+            save(complete=True)
+        finally:
+            for csv_file in files.itervalues():
+                csv_file.close()
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, processes=1, output='csv', db_path=SQLITE_PATH, stats=None,
+                geometry=False, node_store_path=None, collectors=(), parser=None, compression=None,
+                staged=False, workers=1, checkpoint_path=None, resume=False,
+                checkpoint_bytes=checkpoint.CHECKPOINT_BYTES):
+    """Iteratively process each XML element and write to csv(s)
+
+    With processes > 1 the file is split at element boundaries and the shards are
+    shaped in parallel. With output='sqlite' the elements are loaded straight into
+    the database at db_path instead of the csvs, and output='parquet' writes typed
+    columnar tables to PARQUET_PATHS. Passing an instrument.PipelineStats as stats
+    collects counts and stage timings and prints progress while the map is processed.
+
+    With geometry=True node locations are kept in a packed node store (memory-mapped at
+    node_store_path if given) and the bounding box, length, centroid and coordinates of
+    every way are written to the way_geometry table.
+
+    collectors are objects with add(kind, el) and close() methods that see every shaped
+    element, for example a tag_index.TagIndexBuilder or a rollups.RollupCollector; they
+    are closed once the map is done.
+
+    parser names the XML backend (see osm_stream.available_parsers), by default the
+    fastest one installed. file_in may be a .gz, .bz2 or .zst file, which is decompressed
+    in a separate process or thread while it is parsed, and compression='gzip' or 'zstd'
+    compresses the csvs.
+
+    file_in may also be an .osm.pbf file. Its blocks are decoded in a pool of processes
+    worker processes, or one per cpu if processes is 1, while the shaping stays in this
+    process, so every output and option is available.
+
+    staged=True runs the csv conversion as a pipeline of threads with workers shaping
+    threads, see write_elements_staged.
+
+    With a checkpoint_path the csvs are written in chunks with a checkpoint after each,
+    and resume=True continues an interrupted run from its last checkpoint, see
+    process_map_checkpointed."""
+
+    pbf_processes = None
+    if is_pbf(file_in):
+        parser = 'pbf'
+        if processes > 1:
+            pbf_processes = processes
+        processes = 1
+
+    if output not in ('csv', 'sqlite', 'parquet'):
+        raise ValueError("unknown output: {0}".format(output))
+    if output in ('sqlite', 'parquet') and processes > 1:
+        raise ValueError("parallel processing is only supported for csv output")
+    if geometry and processes > 1:
+        raise ValueError("way geometry needs every node before the ways, use processes=1")
+    if collectors and processes > 1:
+        raise ValueError("collectors are only supported with processes=1")
+    if compression is not None and output != 'csv':
+        raise ValueError("compression only applies to csv output")
+    if staged and (output != 'csv' or processes > 1):
+        raise ValueError("the staged pipeline is only supported for csv output with processes=1")
+    if processes > 1 and detect_compression(file_in) is not None:
+        raise ValueError("parallel processing needs an uncompressed input file")
+    if checkpoint_path is not None:
+        if output != 'csv' or processes > 1 or geometry or collectors or compression is not None:
+            raise ValueError("checkpoints are only supported for plain csv output with processes=1 "
+                             "and without geometry or collectors")
+        if parser == 'pbf' or not can_checkpoint(file_in):
+            raise ValueError("checkpoints need an uncompressed osm XML input file")
+
+    if checkpoint_path is not None:
+        process_map_checkpointed(file_in, validate, checkpoint_path, resume, stats, parser, staged, workers,
+                                 checkpoint_bytes)
+    elif output == 'csv' and processes > 1:
+        process_map_parallel(file_in, validate, processes, stats, parser, compression)
+    else:
+        osm_file = stats.open_input(file_in) if stats is not None else file_in
+        if parser == 'pbf':
+            elements = iter_pbf_elements(osm_file, ELEMENT_TAGS, pbf_processes)
+        else:
+            elements = get_element(osm_file, tags=ELEMENT_TAGS, parser=parser)
+        node_store = open_node_store(node_store_path) if geometry else None
+        try:
+            if output == 'sqlite':
+                write_sqlite(elements, db_path, validate, stats, node_store, collectors)
+            elif output == 'parquet':
+                write_parquet(elements, PARQUET_PATHS, validate, stats, node_store, collectors)
+            else:
+                write_csvs(elements, CSV_PATHS, validate, stats=stats, node_store=node_store,
+                           collectors=collectors, compression=compression, staged=staged, workers=workers)
+        finally:
+            if node_store is not None:
+                node_store.close()
+            if osm_file is not file_in:
+                osm_file.close()
+
+    for collector in collectors:
+        collector.close()
+
+    if stats is not None:
+        stats.finish()
+
+def can_checkpoint(file_in):
+    """This function returns whether the input can be checkpointed, which needs a plain
+    osm XML file whose offsets can be sought"""
+
+    return not is_pbf(file_in) and detect_compression(file_in) is None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an osm file to csvs")
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH)
+    parser.add_argument('--no-validate', action='store_true')
+    parser.add_argument('--checkpoint', default=checkpoint.CHECKPOINT_PATH,
+                        help="file that records the progress of the conversion")
+    parser.add_argument('--checkpoint-mb', type=int, default=checkpoint.CHECKPOINT_BYTES // (1024 * 1024),
+                        help="input megabytes converted between checkpoints")
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help="convert in one pass without checkpoints, as for compressed or pbf input")
+    parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint")
+    parser.add_argument('--rollups', nargs='?', const=ROLLUPS_PATH, metavar='PATH',
+                        help="write the overview rollups while converting, without checkpoints")
+    parser.add_argument('--tag-index', nargs='?', const=TAG_INDEX_PATH, metavar='PATH',
+                        help="build the inverted tag index while converting, without checkpoints")
+    parser.add_argument('--geometry', action='store_true',
+                        help="write the way geometry table while converting, without checkpoints")
+    args = parser.parse_args(argv)
+
+    collectors = []
+    if args.rollups:
+        collectors.append(RollupCollector(args.rollups))
+    if args.tag_index:
+        collectors.append(TagIndexBuilder(args.tag_index))
+
+    checkpoint_path = args.checkpoint
+    if args.no_checkpoint or not can_checkpoint(args.osm_file):
+        if args.resume:
+            parser.error("--resume needs checkpoints, which need an uncompressed osm XML input file")
+        if not args.no_checkpoint:
+            print "{0} is compressed or pbf, converting it without checkpoints".format(args.osm_file)
+        checkpoint_path = None
+    elif collectors or args.geometry:
+        if args.resume:
+            parser.error("--resume needs checkpoints, which --rollups, --tag-index and --geometry turn off")
+        print "converting without checkpoints for --rollups, --tag-index or --geometry"
+        checkpoint_path = None
 
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+    stats = PipelineStats()
+    process_map(args.osm_file, validate=not args.no_validate, stats=stats, geometry=args.geometry,
+                collectors=collectors, checkpoint_path=checkpoint_path, resume=args.resume,
+                checkpoint_bytes=args.checkpoint_mb * 1024 * 1024)
+    stats.dump(STATS_PATH)
 
 
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-process_map(OSM_PATH, validate=False)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# optional counters, stage timing and progress reporting for process_map
+
+import json
+import os
+import sys
+import time
+
+from compressed_io import detect_compression, open_input
+
+STAGES = ('iterparse', 'shape', 'validate')
+
+
+class CountingReader(object):
+    """File-like wrapper that counts the bytes read from the input file"""
+
+    def __init__(self, osm_file, stats):
+        self.file = osm_file
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class TimedWriter(object):
+    """Wrapper around a table writer that counts rows and accumulates the time spent
+    writing them"""
+
+    def __init__(self, writer, name, stats):
+        self.writer = writer
+        self.name = name
+        self.stats = stats
+
+    def writerow(self, row):
+        start = time.time()
+        self.writer.writerow(row)
+        self.stats.add_write(self.name, 1, time.time() - start)
+
+    def writerows(self, rows):
+        start = time.time()
+        self.writer.writerows(rows)
+        self.stats.add_write(self.name, len(rows), time.time() - start)
+
+
+class PipelineStats(object):
+    """Collects element and row counts, bytes read and per stage timing while process_map
+    runs, and prints progress with an ETA every interval seconds.
+
+    process_map only touches these hooks when a PipelineStats is passed in, so the default
+    conversion runs without any instrumentation."""
+
+    def __init__(self, interval=30.0, out=sys.stderr):
+        self.interval = interval
+        self.out = out
+        self.total_bytes = None
+        self.bytes_read = 0
+        self.elements = {}
+        self.rows = {}
+        self.stage_seconds = dict((stage, 0.0) for stage in STAGES)
+        self.write_seconds = {}
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.end_time = None
+        # queue and stage report of a staged pipeline, see data.write_elements_staged
+        self.pipeline = None
+
+    # ---------------------------------------------- input
+    def open_input(self, file_in):
+        """This function opens the input for reading and returns a reader that counts the
+        bytes consumed. The file size is used for the ETA, which is left out for compressed
+        input since the decompressed size is unknown."""
+
+        if isinstance(file_in, basestring):
+            if detect_compression(file_in) is None:
+                self.total_bytes = os.path.getsize(file_in)
+            file_in = open_input(file_in)
+        return CountingReader(file_in, self)
+
+    def iter_elements(self, elements):
+        """This function yields from the element stream, timing how long each element
+        takes to parse and counting elements by tag"""
+
+        elements = iter(elements)
+        counts = self.elements
+        while True:
+            start = time.time()
+            try:
+                element = next(elements)
+            except StopIteration:
+                self.stage_seconds['iterparse'] += time.time() - start
+                return
+            self.stage_seconds['iterparse'] += time.time() - start
+            counts[element.tag] = counts.get(element.tag, 0) + 1
+            yield element
+            if time.time() - self.last_report >= self.interval:
+                self.print_progress()
+
+    # ---------------------------------------------- stages
+    def timed(self, stage, function):
+        """This function returns function wrapped so that its run time is added to stage"""
+
+        stage_seconds = self.stage_seconds
+
+        def timed_function(*args):
+            start = time.time()
+            result = function(*args)
+            stage_seconds[stage] += time.time() - start
+            return result
+
+        return timed_function
+
+    def wrap_writers(self, writers):
+        """This function returns the writers wrapped in TimedWriter"""
+
+        return dict((key, TimedWriter(writer, key, self)) for key, writer in writers.iteritems())
+
+    def add_write(self, name, rows, seconds):
+        self.rows[name] = self.rows.get(name, 0) + rows
+        self.write_seconds[name] = self.write_seconds.get(name, 0.0) + seconds
+
+    def merge(self, report):
+        """This function adds the counts and timings of a report from another process"""
+
+        self.bytes_read += report['bytes_read']
+        for tag, count in report['elements'].iteritems():
+            self.elements[tag] = self.elements.get(tag, 0) + count
+        for name, count in report['rows'].iteritems():
+            self.rows[name] = self.rows.get(name, 0) + count
+        for stage, seconds in report['stage_seconds'].iteritems():
+            self.stage_seconds[stage] += seconds
+        for name, seconds in report['write_seconds'].iteritems():
+            self.write_seconds[name] = self.write_seconds.get(name, 0.0) + seconds
+
+    # ---------------------------------------------- reporting
+    def print_progress(self):
+        now = time.time()
+        self.last_report = now
+        elapsed = now - self.start_time
+        elements = sum(self.elements.itervalues())
+        line = "{0:,} elements, {1:.1f} MB in {2:.0f} s ({3:,.0f} elements/s)".format(
+            elements, self.bytes_read / 1048576.0, elapsed, elements / elapsed if elapsed else 0)
+        if self.total_bytes and self.bytes_read:
+            fraction = min(1.0, float(self.bytes_read) / self.total_bytes)
+            remaining = elapsed * (1 - fraction) / fraction
+            line += ", {0:.1%} done, ETA {1:.0f} s".format(fraction, remaining)
+        self.out.write(line + "\n")
+        self.out.flush()
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def report(self):
+        """This function returns all counters and timings as a dictionary"""
+
+        elapsed = (self.end_time or time.time()) - self.start_time
+        report = {
+            'seconds': elapsed,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'elements': dict(self.elements),
+            'tags': sum(count for name, count in self.rows.iteritems() if name.endswith('_tags')),
+            'rows': dict(self.rows),
+            'stage_seconds': dict(self.stage_seconds),
+            'write_seconds': dict(self.write_seconds)
+        }
+        if self.pipeline is not None:
+            report['pipeline'] = self.pipeline
+        return report
+
+    def dump(self, path):
+        """This function writes the final report as json to path"""
+
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2, sort_keys=True)
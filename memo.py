@@ -0,0 +1,76 @@
+# bounded memoization for single argument cleaning functions
+
+from collections import namedtuple
+from functools import wraps
+from threading import Lock
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# positions in the links of the circular list that tracks recency
+PREV, NEXT, KEY, RESULT = 0, 1, 2, 3
+
+
+def lru_cache(maxsize=4096):
+    """This function returns a decorator that memoizes a function of one hashable argument,
+    keeping at most maxsize results and evicting the least recently used one.
+
+    Like functools.lru_cache in python 3, the decorated function gets cache_info() with the
+    hit and miss counts and cache_clear(), and the cache may be shared between threads:
+    its dict and list are only touched under a lock, while the function itself runs
+    outside of it."""
+
+    def decorator(function):
+        cache = {}
+        stats = [0, 0]  # hits, misses
+        root = []  # sentinel of the circular doubly linked list, newest entry at root[PREV]
+        root[:] = [root, root, None, None]
+        lock = Lock()
+
+        @wraps(function)
+        def wrapper(key):
+            with lock:
+                link = cache.get(key)
+                if link is not None:
+                    # move the link to the front of the list
+                    link_prev, link_next = link[PREV], link[NEXT]
+                    link_prev[NEXT] = link_next
+                    link_next[PREV] = link_prev
+                    last = root[PREV]
+                    last[NEXT] = root[PREV] = link
+                    link[PREV] = last
+                    link[NEXT] = root
+                    stats[0] += 1
+                    return link[RESULT]
+
+            result = function(key)
+            with lock:
+                stats[1] += 1
+                if key in cache:
+                    # another thread computed the same key in the meantime
+                    return result
+                if len(cache) >= maxsize:
+                    # drop the least recently used entry
+                    oldest = root[NEXT]
+                    del cache[oldest[KEY]]
+                    root[NEXT] = oldest[NEXT]
+                    oldest[NEXT][PREV] = root
+                last = root[PREV]
+                link = [last, root, key, result]
+                last[NEXT] = root[PREV] = cache[key] = link
+            return result
+
+        def cache_info():
+            with lock:
+                return CacheInfo(stats[0], stats[1], maxsize, len(cache))
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                root[:] = [root, root, None, None]
+                stats[:] = [0, 0]
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,413 @@
+# packed node locations by node id for resolving way geometry
+
+import heapq
+import math
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+# coordinates are stored as unsigned 32 bit fixed point with 7 decimals, the precision of
+# osm, shifted so that 0 never encodes a real location and can mark a missing node
+SCALE = 10000000
+LAT_OFFSET = 90 * SCALE + 1
+LON_OFFSET = 180 * SCALE + 1
+
+# stores switch to the dense layout when at least this share of the id range is used
+DENSE_FILL = 0.5
+
+EARTH_RADIUS = 6371008.8
+
+
+def pack(lat, lon):
+    return int(round(float(lat) * SCALE)) + LAT_OFFSET, int(round(float(lon) * SCALE)) + LON_OFFSET
+
+
+def unpack(packed_lat, packed_lon):
+    return float(packed_lat - LAT_OFFSET) / SCALE, float(packed_lon - LON_OFFSET) / SCALE
+
+
+class StoreFrozen(ValueError):
+    """Raised when a node is added to a store that has already been read"""
+
+
+class NodeLocationStore(object):
+    """In memory store of node locations.
+
+    Nodes that arrive in id order are appended to blocks of ids that lie within 65536 of
+    the first id of their block: the first id and start of every block take 12 bytes, and
+    every node 2 bytes for its offset in the block and 8 bytes for its packed coordinates,
+    so a node costs 10 bytes plus its share of a block. That is about 10 bytes per node for
+    the ids of an extract, which mostly come in runs of close ids, and 22 bytes for ids
+    more than 65536 apart. Lookups bisect the blocks, then the offsets of one block.
+
+    The first node that arrives out of order turns the ids into a plain array of 8 bytes
+    per id, 16 bytes per node with the coordinates. The first lookup then sorts the ids
+    and coordinates in place in runs of SORT_RUN nodes and merges the runs into blocks,
+    so the plain arrays and the blocks are held together once, 26 bytes per node.
+
+    The first lookup freezes the store. If one array of coordinates indexed by id - first
+    id, 8 bytes per id of the range, is no larger than the blocks, it replaces them."""
+
+    # nodes sorted at a time when the ids arrive out of order
+    SORT_RUN = 1 << 16
+
+    def __init__(self):
+        self.count = 0
+        # sorted layout: first id and first node of every block, offsets from the first id
+        self.bases = array('l')
+        self.starts = array('I')
+        self.offsets = array('H')
+        self.coordinates = array('I')
+        self.last_id = None
+        # plain ids in arrival order, once an id arrived out of order
+        self.ids = None
+        self.dense = None
+        self.first_id = None
+        self.frozen = False
+
+    def __len__(self):
+        return self.count
+
+    def add(self, node_id, lat, lon):
+        if self.frozen:
+            raise StoreFrozen("cannot add nodes after the store has been read")
+        node_id = int(node_id)
+        if self.ids is not None:
+            self.ids.append(node_id)
+            self.coordinates.extend(pack(lat, lon))
+        elif self.last_id is not None and node_id <= self.last_id:
+            self.ids = array('l', self.iter_ids())
+            self.bases = self.starts = self.offsets = None
+            self.ids.append(node_id)
+            self.coordinates.extend(pack(lat, lon))
+        else:
+            self.append_sorted(node_id, *pack(lat, lon))
+        self.count += 1
+
+    def append_sorted(self, node_id, packed_lat, packed_lon):
+        """This function appends a node whose id is not below any id before it to the blocks"""
+
+        offset = node_id - self.bases[-1] if self.bases else 0x10000
+        if offset > 0xffff:
+            self.bases.append(node_id)
+            self.starts.append(len(self.offsets))
+            offset = 0
+        self.offsets.append(offset)
+        self.coordinates.append(packed_lat)
+        self.coordinates.append(packed_lon)
+        self.last_id = node_id
+
+    def iter_ids(self):
+        """This function yields the ids of the blocks in order"""
+
+        offsets = self.offsets
+        ends = list(self.starts[1:]) + [len(offsets)]
+        for base, start, end in zip(self.bases, self.starts, ends):
+            for index in xrange(start, end):
+                yield base + offsets[index]
+
+    def sort_ids(self):
+        """This function sorts the plain ids and coordinates into the blocks: runs of
+        SORT_RUN nodes are sorted in place, then the runs are merged"""
+
+        ids, coordinates = self.ids, self.coordinates
+        runs = []
+        for start in xrange(0, len(ids), self.SORT_RUN):
+            end = min(start + self.SORT_RUN, len(ids))
+            run = sorted(zip(ids[start:end], coordinates[2 * start:2 * end:2], coordinates[2 * start + 1:2 * end:2]))
+            for index, (node_id, packed_lat, packed_lon) in enumerate(run, start):
+                ids[index] = node_id
+                coordinates[2 * index] = packed_lat
+                coordinates[2 * index + 1] = packed_lon
+            runs.append((start, end))
+
+        self.bases, self.starts, self.offsets, self.coordinates = array('l'), array('I'), array('H'), array('I')
+        merged = heapq.merge(*[self.iter_run(ids, coordinates, start, end) for start, end in runs])
+        for node_id, packed_lat, packed_lon in merged:
+            self.append_sorted(node_id, packed_lat, packed_lon)
+        self.ids = None
+
+    @staticmethod
+    def iter_run(ids, coordinates, start, end):
+        for index in xrange(start, end):
+            yield ids[index], coordinates[2 * index], coordinates[2 * index + 1]
+
+    def nbytes(self):
+        """This function returns the bytes taken by the arrays of the sorted layout"""
+
+        return sum(values.itemsize * len(values) for values in (self.bases, self.starts, self.offsets,
+                                                                self.coordinates))
+
+    def freeze(self):
+        """This function sorts the nodes if needed and picks the layout once all nodes
+        are added"""
+
+        if self.frozen:
+            return
+        self.frozen = True
+        if self.ids is not None:
+            self.sort_ids()
+        if not self.count:
+            return
+
+        first_id, last_id = self.bases[0], self.last_id
+        span = last_id - first_id + 1
+        if span * 8 <= self.nbytes():
+            dense = array('I', [0]) * (2 * span)
+            for index, node_id in enumerate(self.iter_ids()):
+                slot = 2 * (node_id - first_id)
+                dense[slot] = self.coordinates[2 * index]
+                dense[slot + 1] = self.coordinates[2 * index + 1]
+            self.dense = dense
+            self.first_id = first_id
+            self.bases = self.starts = self.offsets = self.coordinates = None
+
+    def get(self, node_id):
+        """This function returns (lat, lon) for node_id, or None if the node is unknown"""
+
+        if not self.frozen:
+            self.freeze()
+        node_id = int(node_id)
+
+        if self.dense is not None:
+            slot = 2 * (node_id - self.first_id)
+            if slot < 0 or slot >= len(self.dense) or self.dense[slot] == 0:
+                return None
+            return unpack(self.dense[slot], self.dense[slot + 1])
+
+        block = bisect_right(self.bases, node_id) - 1
+        if block < 0:
+            return None
+        offset = node_id - self.bases[block]
+        if offset > 0xffff:
+            return None
+        end = self.starts[block + 1] if block + 1 < len(self.starts) else len(self.offsets)
+        index = bisect_left(self.offsets, offset, self.starts[block], end)
+        if index == end or self.offsets[index] != offset:
+            return None
+        return unpack(self.coordinates[2 * index], self.coordinates[2 * index + 1])
+
+    def close(self):
+        pass
+
+
+class MappedNodeLocationStore(object):
+    """Node locations in memory-mapped files, the on disk counterpart of NodeLocationStore.
+
+    While the nodes stream past, (id, lat, lon) records of 16 bytes are appended to a file
+    next to path. The first lookup freezes the store and picks a layout the same way: if
+    the ids cover their range densely enough, the coordinates are copied into a file at
+    path indexed by id - first id, 8 bytes per id of the range; otherwise the records,
+    sorted by id if they did not arrive in order, become the file at path and lookups
+    bisect it. Either way the files grow with the number of nodes rather than with the
+    largest id, and the process memory stays small. The file is removed on close unless
+    keep is set."""
+
+    RECORD = struct.Struct('<qII')
+    LOCATION = struct.Struct('<II')
+    # records sorted in memory at a time when the ids arrive out of order
+    SORT_RUN = 1 << 20
+
+    def __init__(self, path, keep=False):
+        self.path = path
+        self.keep = keep
+        self.records_path = path + '.records'
+        self.records = open(self.records_path, 'wb')
+        self.count = 0
+        self.first_id = None
+        self.last_id = None
+        self.is_sorted = True
+        self.dense = False
+        self.file = None
+        self.map = None
+        self.frozen = False
+
+    def __len__(self):
+        return self.count
+
+    def add(self, node_id, lat, lon):
+        if self.frozen:
+            raise StoreFrozen("cannot add nodes after the store has been read")
+        node_id = int(node_id)
+        if self.count == 0:
+            self.first_id = self.last_id = node_id
+        elif node_id > self.last_id:
+            self.last_id = node_id
+        else:
+            self.is_sorted = False
+            self.first_id = min(self.first_id, node_id)
+        self.records.write(self.RECORD.pack(node_id, *pack(lat, lon)))
+        self.count += 1
+
+    def freeze(self):
+        """This function picks the dense or sparse layout once all nodes are added"""
+
+        if self.frozen:
+            return
+        self.frozen = True
+        self.records.close()
+        if not self.count:
+            os.remove(self.records_path)
+            return
+
+        span = self.last_id - self.first_id + 1
+        if float(self.count) / span >= DENSE_FILL:
+            self.dense = True
+            self.file = open(self.path, 'w+b')
+            self.file.truncate(span * self.LOCATION.size)
+            self.map = mmap.mmap(self.file.fileno(), span * self.LOCATION.size)
+            for node_id, packed_lat, packed_lon in self.iter_records(self.records_path):
+                self.LOCATION.pack_into(self.map, (node_id - self.first_id) * self.LOCATION.size,
+                                        packed_lat, packed_lon)
+            os.remove(self.records_path)
+        else:
+            if self.is_sorted:
+                os.rename(self.records_path, self.path)
+            else:
+                self.sort_records()
+            self.file = open(self.path, 'r+b')
+            self.map = mmap.mmap(self.file.fileno(), self.count * self.RECORD.size)
+
+    def iter_records(self, path):
+        """This function yields the (id, packed lat, packed lon) records of a file"""
+
+        size = self.RECORD.size
+        with open(path, 'rb') as records_file:
+            while True:
+                block = records_file.read(size * 4096)
+                if not block:
+                    break
+                for offset in xrange(0, len(block), size):
+                    yield self.RECORD.unpack_from(block, offset)
+
+    def sort_records(self):
+        """This function sorts the records file into path by id, in runs of SORT_RUN
+        records that are merged, so the memory used does not grow with the file"""
+
+        run_paths = []
+        try:
+            records = self.iter_records(self.records_path)
+            while True:
+                run = list(islice(records, self.SORT_RUN))
+                if not run:
+                    break
+                run.sort()
+                run_paths.append('{0}.run{1}'.format(self.path, len(run_paths)))
+                with open(run_paths[-1], 'wb') as run_file:
+                    for record in run:
+                        run_file.write(self.RECORD.pack(*record))
+            with open(self.path, 'wb') as sorted_file:
+                for record in heapq.merge(*[self.iter_records(run_path) for run_path in run_paths]):
+                    sorted_file.write(self.RECORD.pack(*record))
+        finally:
+            for run_path in run_paths:
+                os.remove(run_path)
+        os.remove(self.records_path)
+
+    def get(self, node_id):
+        """This function returns (lat, lon) for node_id, or None if the node is unknown"""
+
+        if not self.frozen:
+            self.freeze()
+        if self.map is None:
+            return None
+        node_id = int(node_id)
+
+        if self.dense:
+            slot = node_id - self.first_id
+            if slot < 0 or node_id > self.last_id:
+                return None
+            packed_lat, packed_lon = self.LOCATION.unpack_from(self.map, slot * self.LOCATION.size)
+            if packed_lat == 0:
+                return None
+            return unpack(packed_lat, packed_lon)
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_id, packed_lat, packed_lon = self.RECORD.unpack_from(self.map, middle * self.RECORD.size)
+            if record_id < node_id:
+                low = middle + 1
+            elif record_id > node_id:
+                high = middle
+            else:
+                return unpack(packed_lat, packed_lon)
+        return None
+
+    def close(self):
+        if not self.frozen:
+            self.records.close()
+            os.remove(self.records_path)
+            return
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            if not self.keep:
+                os.remove(self.path)
+
+
+def open_node_store(path=None, keep=False):
+    """This function returns a memory-mapped store at path, or an in memory store if no
+    path is given"""
+
+    if path is not None:
+        return MappedNodeLocationStore(path, keep)
+    return NodeLocationStore()
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """This function returns the great circle distance in meters between two points"""
+
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def way_geometry(way_id, node_ids, store):
+    """This function resolves the node ids of a way in store and returns a dict with its
+    bounding box, length in meters, centroid and the coordinates as a WKT linestring.
+    Nodes missing from the store (for example outside a clipped extract) are skipped
+    and counted."""
+
+    points = []
+    missing = 0
+    for node_id in node_ids:
+        location = store.get(node_id)
+        if location is None:
+            missing += 1
+        else:
+            points.append(location)
+
+    geometry = {'id': way_id, 'missing_nodes': missing, 'min_lat': None, 'min_lon': None,
+                'max_lat': None, 'max_lon': None, 'length': 0.0,
+                'centroid_lat': None, 'centroid_lon': None, 'coordinates': ''}
+    if not points:
+        return geometry
+
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    geometry['min_lat'], geometry['max_lat'] = min(lats), max(lats)
+    geometry['min_lon'], geometry['max_lon'] = min(lons), max(lons)
+
+    # the centroid of a line is the length weighted mean of its segment midpoints
+    length = 0.0
+    weighted_lat = weighted_lon = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        segment = distance(lat1, lon1, lat2, lon2)
+        length += segment
+        weighted_lat += segment * (lat1 + lat2) / 2
+        weighted_lon += segment * (lon1 + lon2) / 2
+    if length > 0:
+        geometry['centroid_lat'], geometry['centroid_lon'] = weighted_lat / length, weighted_lon / length
+    else:
+        geometry['centroid_lat'], geometry['centroid_lon'] = sum(lats) / len(lats), sum(lons) / len(lons)
+
+    geometry['length'] = length
+    geometry['coordinates'] = 'LINESTRING ({0})'.format(
+        ', '.join('{0:.7f} {1:.7f}'.format(lon, lat) for lat, lon in points))
+    return geometry
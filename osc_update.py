@@ -0,0 +1,281 @@
+# apply osmChange (.osc) files to a database built with process_map(output='sqlite')
+
+import os
+import re
+import sqlite3
+import xml.etree.cElementTree as ET
+
+import sqlite_writer
+from compressed_io import open_input
+from data import (shape_records, validate_element, SCHEMA, SQLITE_TABLES, SQLITE_PATH, ELEMENT_TAGS,
+                  WAY_GEOMETRY_SQLITE_TABLE, WayGeometryRecord)
+from node_store import way_geometry
+from schema_validator import SchemaValidator
+
+ACTIONS = ('create', 'modify', 'delete')
+
+# tables that hold the secondary rows of each element type
+CHILD_TABLES = {
+    'node': ['node_tags'],
+    'way': ['way_nodes', 'way_tags'],
+    'relation': ['relation_members', 'relation_tags']
+}
+
+STATE_TABLE = 'replication_state'
+
+# (type, id, version, changeset) of deleted elements, so an older change cannot bring
+# them back
+TOMBSTONE_TABLE = 'deleted_elements'
+
+# replication diffs are stored as .../AAA/BBB/CCC.osc.gz for sequence number AAABBBCCC
+SEQUENCE_RE = re.compile(r'(\d{3})[/\\](\d{3})[/\\](\d{3})\.osc(?:\.gz|\.bz2|\.zst)?$')
+
+
+def iter_changes(osc_file, tags=ELEMENT_TAGS):
+    """This function takes an osmChange file name or file object and yields (action, element)
+    for every complete element whose tag is in tags, clearing elements as it goes.
+    Compressed files are read through compressed_io.open_input."""
+
+    if isinstance(osc_file, basestring):
+        osc_file = open_input(osc_file)
+        try:
+            for change in iter_changes(osc_file, tags):
+                yield change
+        finally:
+            osc_file.close()
+        return
+
+    action = None
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start':
+            if elem.tag in ACTIONS:
+                action = elem
+        elif elem.tag in tags:
+            yield action.tag, elem
+            action.clear()
+        elif elem.tag in ACTIONS:
+            root.clear()
+
+
+def sequence_from_path(path):
+    """This function returns the replication sequence number encoded in the path of a
+    diff file, or None if the path does not follow the replication layout."""
+
+    match = SEQUENCE_RE.search(path.replace(os.sep, '/'))
+    if match:
+        return int(''.join(match.groups()))
+    return None
+
+
+def read_state(connection):
+    """This function returns the stored replication state, (sequence, timestamp), creating
+    the state table on first use. The sequence number of the last diff applied is the
+    high-water mark; the timestamp is that of the newest element applied so far, which
+    tells how current the database is."""
+
+    connection.execute('CREATE TABLE IF NOT EXISTS {0} (sequence INTEGER, timestamp TEXT)'.format(STATE_TABLE))
+    connection.execute('CREATE TABLE IF NOT EXISTS {0} (type TEXT, id INTEGER, version INTEGER, changeset INTEGER, '
+                       'PRIMARY KEY (type, id))'.format(TOMBSTONE_TABLE))
+    row = connection.execute('SELECT sequence, timestamp FROM {0}'.format(STATE_TABLE)).fetchone()
+    if row is None:
+        return None, None
+    return row
+
+
+def write_state(connection, sequence, timestamp):
+    """This function replaces the stored replication state"""
+
+    connection.execute('DELETE FROM {0}'.format(STATE_TABLE))
+    connection.execute('INSERT INTO {0} (sequence, timestamp) VALUES (?, ?)'.format(STATE_TABLE),
+                       (sequence, timestamp))
+
+
+def is_stale(connection, table, element):
+    """This function returns whether the stored copy of element, or the tombstone left when
+    it was deleted, is at the same or a newer version (and changeset) than the change, in
+    which case the change is skipped."""
+
+    row = connection.execute('SELECT version, changeset FROM {0} WHERE id = ?'.format(table),
+                             (element.attrib['id'],)).fetchone()
+    if row is None:
+        row = connection.execute('SELECT version, changeset FROM {0} WHERE type = ? AND id = ?'.format(TOMBSTONE_TABLE),
+                                 (element.tag, element.attrib['id'])).fetchone()
+    if row is None:
+        return False
+    stored = (int(row[0]), int(row[1]))
+    change = (int(element.attrib.get('version', 0)), int(element.attrib.get('changeset', 0)))
+    return change <= stored
+
+
+def delete_element(connection, tables, tag, element_id):
+    """This function removes an element and its secondary rows"""
+
+    for key in [tag] + CHILD_TABLES[tag]:
+        connection.execute('DELETE FROM {0} WHERE id = ?'.format(tables[key]), (element_id,))
+
+
+def write_tombstone(connection, element):
+    """This function records the version of a deleted element"""
+
+    connection.execute('INSERT OR REPLACE INTO {0} (type, id, version, changeset) VALUES (?, ?, ?, ?)'.format(TOMBSTONE_TABLE),
+                       (element.tag, int(element.attrib['id']), int(element.attrib.get('version', 0)),
+                        int(element.attrib.get('changeset', 0))))
+
+
+def drop_tombstone(connection, element):
+    connection.execute('DELETE FROM {0} WHERE type = ? AND id = ?'.format(TOMBSTONE_TABLE),
+                       (element.tag, int(element.attrib['id'])))
+
+
+class SqliteNodeLocations(object):
+    """Node store over the nodes table, for resolving way geometry in the database"""
+
+    def __init__(self, connection, table):
+        self.connection = connection
+        self.sql = 'SELECT lat, lon FROM {0} WHERE id = ?'.format(table)
+
+    def get(self, node_id):
+        row = self.connection.execute(self.sql, (node_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1]
+
+
+def has_table(connection, table):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone() is not None
+
+
+def open_database(db_path, table):
+    """This function connects to the database at db_path, which has to exist and hold
+    table already; sqlite3.connect would otherwise create an empty database there"""
+
+    if not os.path.isfile(db_path):
+        raise IOError("{0} does not exist, build it with process_map(output='sqlite') first".format(db_path))
+    connection = sqlite3.connect(db_path)
+    try:
+        found = has_table(connection, table)
+    except sqlite3.DatabaseError:
+        found = False
+    if not found:
+        connection.close()
+        raise ValueError("{0} has no {1} table, build it with process_map(output='sqlite') first".format(
+            db_path, table))
+    return connection
+
+
+def ways_of_node(connection, tables, node_id):
+    """This function returns the ids of the ways that refer to a node"""
+
+    rows = connection.execute('SELECT DISTINCT id FROM {0} WHERE node_id = ?'.format(tables['way_nodes']),
+                              (node_id,))
+    return [row[0] for row in rows]
+
+
+def refresh_geometry(connection, tables, way_ids):
+    """This function rewrites the ways_geometry rows of the ways in way_ids from their
+    current nodes, and drops the rows of the ways that no longer exist"""
+
+    geometry_table = WAY_GEOMETRY_SQLITE_TABLE[1]
+    writer = sqlite_writer.SqliteTableWriter(connection, geometry_table, WAY_GEOMETRY_SQLITE_TABLE[2])
+    locations = SqliteNodeLocations(connection, tables['node'])
+    for way_id in way_ids:
+        connection.execute('DELETE FROM {0} WHERE id = ?'.format(geometry_table), (way_id,))
+        if connection.execute('SELECT 1 FROM {0} WHERE id = ?'.format(tables['way']), (way_id,)).fetchone() is None:
+            continue
+        rows = connection.execute('SELECT node_id FROM {0} WHERE id = ? ORDER BY position'.format(
+            tables['way_nodes']), (way_id,))
+        node_ids = [row[0] for row in rows]
+        writer.writerow(WayGeometryRecord(**way_geometry(way_id, node_ids, locations)))
+    writer.flush()
+
+
+def apply_changes(osc_file, db_path=SQLITE_PATH, sequence=None, validate=False):
+    """This function takes an osmChange file and applies its creates, modifies and deletes
+    to the sqlite database at db_path, shaping elements with the same cleaning as
+    process_map. Changes older than the stored version of an element, or than the version
+    at which it was deleted, are skipped, so applying a diff again or out of order never
+    brings back an older copy.
+
+    A database built with geometry=True keeps its ways_geometry table up to date: the
+    geometry of every changed way and of every way of a changed node is rebuilt from the
+    nodes in the database, and the rows of deleted ways are dropped.
+
+    If a sequence number is given and it is not newer than the sequence number of the last
+    diff applied the file is skipped entirely. The timestamp of the newest element applied
+    is stored along with it, see read_state. The database has to exist, see open_database.
+    It returns a dictionary with the number of elements per outcome."""
+
+    tables = dict((key, table) for key, table, _, _, _ in SQLITE_TABLES)
+    fields = dict((key, field_list) for key, _, field_list, _, _ in SQLITE_TABLES)
+    counts = dict((outcome, 0) for outcome in ('created', 'modified', 'deleted', 'stale', 'skipped_file'))
+
+    connection = open_database(db_path, tables['node'])
+    try:
+        last_sequence, last_timestamp = read_state(connection)
+        if sequence is not None and last_sequence is not None and sequence <= last_sequence:
+            counts['skipped_file'] = 1
+            return counts
+
+        writers = dict((key, sqlite_writer.SqliteTableWriter(connection, tables[key], fields[key]))
+                       for key in tables)
+        validator = SchemaValidator(SCHEMA)
+        newest_timestamp = last_timestamp
+        # ways whose geometry has to be rebuilt, if the database has geometry
+        geometry_ways = set() if has_table(connection, WAY_GEOMETRY_SQLITE_TABLE[1]) else None
+
+        for action, element in iter_changes(osc_file):
+            if is_stale(connection, tables[element.tag], element):
+                counts['stale'] += 1
+                continue
+
+            timestamp = element.attrib.get('timestamp')
+            if timestamp and (newest_timestamp is None or timestamp > newest_timestamp):
+                newest_timestamp = timestamp
+
+            if geometry_ways is not None:
+                if element.tag == 'way':
+                    geometry_ways.add(int(element.attrib['id']))
+                elif element.tag == 'node':
+                    geometry_ways.update(ways_of_node(connection, tables, element.attrib['id']))
+
+            delete_element(connection, tables, element.tag, element.attrib['id'])
+            if action == 'delete':
+                write_tombstone(connection, element)
+                counts['deleted'] += 1
+                continue
+            drop_tombstone(connection, element)
+
+            el = shape_records(element)
+            if validate is True:
+                validate_element(el, validator)
+            for key, rows in el.iteritems():
+                if not isinstance(rows, list):
+                    rows = [rows]
+                writers[key].writerows(rows)
+                writers[key].flush()
+            counts['created' if action == 'create' else 'modified'] += 1
+
+        if geometry_ways:
+            refresh_geometry(connection, tables, sorted(geometry_ways))
+        write_state(connection, sequence if sequence is not None else last_sequence, newest_timestamp)
+        connection.commit()
+    finally:
+        connection.close()
+
+    return counts
+
+
+def apply_change_files(filenames, db_path=SQLITE_PATH, validate=False):
+    """This function applies a list of replication diff files in sequence order, so only
+    the diffs newer than the last one applied change the database.
+
+    It returns a list of (filename, counts) for every file."""
+
+    results = []
+    for filename in sorted(filenames, key=sequence_from_path):
+        counts = apply_changes(filename, db_path, sequence_from_path(filename), validate)
+        results.append((filename, counts))
+    return results
@@ -0,0 +1,240 @@
+# build small, referentially complete samples of an osm file
+
+import argparse
+import random
+import re
+
+from compressed_io import open_input
+from osm_shards import ELEMENT_START, OSM_END, READ_SIZE
+from osm_stream import iter_elements
+from pbf_reader import is_pbf
+
+SAMPLE_PATH = "small_sample.osm"
+
+ELEMENT_TAG = re.compile(r'<(node|way|relation)')
+ELEMENT_ID = re.compile(r'\sid="(-?\d+)"')
+
+# node ids per page of the bitmap
+PAGE_BITS = 16
+PAGE_MASK = (1 << PAGE_BITS) - 1
+
+
+class NodeBitmap(object):
+    """Set of node ids kept as one bit per id, in pages of 2 ** PAGE_BITS ids that are only
+    allocated once an id in their range is added, so the memory follows the spread of the
+    ids rather than the largest id"""
+
+    def __init__(self):
+        self.pages = {}
+        self.count = 0
+
+    def add(self, node_id):
+        page = self.pages.get(node_id >> PAGE_BITS)
+        if page is None:
+            page = self.pages[node_id >> PAGE_BITS] = bytearray(1 << (PAGE_BITS - 3))
+        offset = node_id & PAGE_MASK
+        bit = 1 << (offset & 7)
+        if not page[offset >> 3] & bit:
+            page[offset >> 3] |= bit
+            self.count += 1
+
+    def __contains__(self, node_id):
+        page = self.pages.get(node_id >> PAGE_BITS)
+        if page is None:
+            return False
+        offset = node_id & PAGE_MASK
+        return bool(page[offset >> 3] & (1 << (offset & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+# ================================================== #
+#               Selection                            #
+# ================================================== #
+def select_sample(osm_file, bbox=None, every=None, size=None, seed=0, parser=None):
+    """This function streams the osm file once and chooses the elements of the sample. It
+    returns the node ids as a NodeBitmap and the way and relation ids as sets.
+
+    Exactly one way of choosing must be given:
+    bbox      (min_lat, min_lon, max_lat, max_lon): the nodes inside the box and the ways
+              with at least one of them
+    every     every k-th node or way
+    size      a uniform reservoir sample of size nodes and ways, drawn with seed
+
+    Every chosen way brings all of its nodes, even those outside the box; those nodes do
+    not count as inside the box when the following ways are chosen. A relation is
+    kept when all of its members are in the sample, so the sample never refers to an
+    element it does not contain."""
+
+    if sum(option is not None for option in (bbox, every, size)) != 1:
+        raise ValueError("choose the sample by exactly one of bbox, every or size")
+
+    nodes = NodeBitmap()
+    # nodes inside the box, which decide the ways, apart from the nodes the ways bring
+    inside = NodeBitmap()
+    ways = set()
+    relations = []
+    reservoir = []
+    rng = random.Random(seed)
+    seen = 0
+
+    for elem in iter_elements(osm_file, ('node', 'way', 'relation'), parser):
+        if elem.tag == 'relation':
+            members = [(member.attrib['type'], int(member.attrib['ref'])) for member in elem.iter('member')]
+            relations.append((int(elem.attrib['id']), members))
+            continue
+
+        element_id = int(elem.attrib['id'])
+        refs = None if elem.tag == 'node' else [int(nd.attrib['ref']) for nd in elem.iter('nd')]
+        seen += 1
+        if bbox is not None:
+            if refs is None:
+                chosen = (bbox[0] <= float(elem.attrib['lat']) <= bbox[2] and
+                          bbox[1] <= float(elem.attrib['lon']) <= bbox[3])
+                if chosen:
+                    inside.add(element_id)
+            else:
+                chosen = any(ref in inside for ref in refs)
+        elif every is not None:
+            chosen = seen % every == 0
+        else:
+            # algorithm R: the element replaces a random entry with probability size / seen
+            chosen = False
+            if len(reservoir) < size:
+                reservoir.append((element_id, refs))
+            else:
+                index = rng.randrange(seen)
+                if index < size:
+                    reservoir[index] = (element_id, refs)
+
+        if chosen:
+            add_element(element_id, refs, nodes, ways)
+
+    for element_id, refs in reservoir:
+        add_element(element_id, refs, nodes, ways)
+
+    kept = set()
+    for relation_id, members in relations:
+        if members and all(member_in_sample(member_type, ref, nodes, ways, kept)
+                           for member_type, ref in members):
+            kept.add(relation_id)
+
+    return nodes, ways, kept
+
+
+def add_element(element_id, refs, nodes, ways):
+    """This function adds a node, or a way (refs is its node ids) and all of its nodes"""
+
+    if refs is None:
+        nodes.add(element_id)
+    else:
+        ways.add(element_id)
+        for ref in refs:
+            nodes.add(ref)
+
+
+def member_in_sample(member_type, ref, nodes, ways, relations):
+    if member_type == 'node':
+        return ref in nodes
+    if member_type == 'way':
+        return ref in ways
+    return ref in relations
+
+
+# ================================================== #
+#               Copying                              #
+# ================================================== #
+def iter_raw_elements(osm_file):
+    """This function yields (tag, id, text) for every node, way and relation of the osm file
+    object, where text is the raw XML of the element up to the next one, and yields
+    (None, None, text) for the text before the first and after the last element.
+
+    Element starts are found the same way as by osm_shards, so the elements are copied
+    without being parsed."""
+
+    buffer = ''
+    in_header = True
+    while True:
+        chunk = osm_file.read(READ_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        if in_header:
+            match = ELEMENT_START.search(buffer)
+            if match is None:
+                continue
+            yield None, None, buffer[:match.start()]
+            buffer = buffer[match.start():]
+            in_header = False
+
+        # the buffer starts with an element; the last one may continue in the next chunk
+        starts = [match.start() for match in ELEMENT_START.finditer(buffer)]
+        for start, end in zip(starts, starts[1:]):
+            yield raw_element(buffer[start:end])
+        buffer = buffer[starts[-1]:]
+
+    if in_header:
+        yield None, None, buffer
+        return
+    end = buffer.rfind(OSM_END)
+    if end < 0:
+        end = len(buffer)
+    yield raw_element(buffer[:end])
+    yield None, None, buffer[end:]
+
+
+def raw_element(text):
+    return ELEMENT_TAG.match(text).group(1), int(ELEMENT_ID.search(text).group(1)), text
+
+
+def write_sample(osm_path, sample_path, nodes, ways, relations):
+    """This function copies the header, the chosen elements and the closing tag of the
+    osm file at osm_path to sample_path and returns the number of elements written"""
+
+    chosen = {'node': nodes, 'way': ways, 'relation': relations}
+    written = 0
+    osm_file = open_input(osm_path)
+    try:
+        with open(sample_path, 'wb') as sample_file:
+            for tag, element_id, text in iter_raw_elements(osm_file):
+                if tag is None:
+                    sample_file.write(text)
+                elif element_id in chosen[tag]:
+                    sample_file.write(text)
+                    written += 1
+    finally:
+        osm_file.close()
+    return written
+
+
+def sample_map(osm_path, sample_path=SAMPLE_PATH, bbox=None, every=None, size=None, seed=0, parser=None):
+    """This function writes a referentially complete sample of the osm file to
+    sample_path, see select_sample, and returns (nodes, ways, relations) counts"""
+
+    if is_pbf(osm_path):
+        raise ValueError("samples are copied from the XML, convert {0} to .osm first".format(osm_path))
+
+    nodes, ways, relations = select_sample(osm_path, bbox, every, size, seed, parser)
+    write_sample(osm_path, sample_path, nodes, ways, relations)
+    return len(nodes), len(ways), len(relations)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a referentially complete sample of an osm file")
+    parser.add_argument('osm_file', nargs='?', default="boston_massachusetts.osm")
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_PATH)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                      help="keep the nodes inside the box and the ways that touch it")
+    mode.add_argument('--every', type=int, metavar='K', help="keep every k-th node and way")
+    mode.add_argument('--size', type=int, help="keep a random sample of this many nodes and ways")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    counts = sample_map(args.osm_file, args.sample_file, args.bbox, args.every, args.size, args.seed)
+    print "{0}: {1} nodes, {2} ways, {3} relations".format(args.sample_file, *counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# split an osm file into byte ranges that start and end on element boundaries
+
+import os
+import re
+
+# top level osm elements start with one of these tags; "<" is always escaped inside
+# attribute values, so any match in the raw bytes is the start of a real element
+ELEMENT_START = re.compile(r'<(?:node|way|relation)[\s/>]')
+OSM_END = '</osm>'
+
+READ_SIZE = 64 * 1024
+
+
+def find_element_start(osm_file, offset, limit):
+    """This function takes an osm file object opened in binary mode and returns the byte
+    offset of the first element that starts at or after offset, or limit if there is none."""
+
+    osm_file.seek(offset)
+    position = offset
+    carry = ''
+    while position < limit:
+        chunk = osm_file.read(READ_SIZE)
+        if not chunk:
+            break
+        buffer = carry + chunk
+        match = ELEMENT_START.search(buffer)
+        if match:
+            return min(position - len(carry) + match.start(), limit)
+        # keep the tail in case a tag name is split across two reads
+        carry = buffer[-16:]
+        position += len(chunk)
+    return limit
+
+
+def find_document_end(osm_file):
+    """This function takes an osm file object opened in binary mode and returns the byte
+    offset of the closing </osm> tag."""
+
+    osm_file.seek(0, os.SEEK_END)
+    size = osm_file.tell()
+    osm_file.seek(max(0, size - READ_SIZE))
+    tail = osm_file.read()
+    index = tail.rfind(OSM_END)
+    if index < 0:
+        raise ValueError("no closing %s tag found" % OSM_END)
+    return size - len(tail) + index
+
+
+def find_shards(filename, count):
+    """This function takes an osm file name and a number of shards and returns a list of
+    (start, end) byte ranges that each cover whole node, way and relation elements.
+
+    The file is cut at evenly spaced offsets which are then moved forward to the next
+    element start, so fewer shards may be returned for very small files."""
+
+    with open(filename, 'rb') as osm_file:
+        end = find_document_end(osm_file)
+        start = find_element_start(osm_file, 0, end)
+        step = max(1, (end - start) // count)
+
+        boundaries = [start]
+        for i in range(1, count):
+            boundary = find_element_start(osm_file, start + i * step, end)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        if end > boundaries[-1]:
+            boundaries.append(end)
+
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+class ShardReader(object):
+    """File-like object that reads one byte range of an osm file wrapped in its own
+    <osm> root, so it can be handed to iterparse like a complete document"""
+
+    def __init__(self, filename, start, end):
+        self.file = open(filename, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+        self.prefix = '<osm>'
+        self.suffix = '</osm>'
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining + len(self.prefix) + len(self.suffix)
+
+        data = ''
+        if self.prefix:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+
+        if self.remaining and len(data) < size:
+            chunk = self.file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(chunk)
+            if not chunk:
+                self.remaining = 0
+            data += chunk
+
+        if not self.remaining and len(data) < size:
+            wanted = size - len(data)
+            data, self.suffix = data + self.suffix[:wanted], self.suffix[wanted:]
+
+        return data
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,107 @@
+# stream complete elements out of an osm file with bounded memory
+
+import xml.etree.cElementTree as ET
+
+import pbf_reader
+from compressed_io import open_input
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+def iter_elements_etree(osm_file, tags=('node', 'way', 'relation')):
+    """This function yields the complete elements whose tag is in tags using
+    cElementTree.
+
+    Events are only handled once an element has been fully parsed, so elem.iter("tag")
+    always sees all of its children. After each yielded element the root is cleared, which
+    drops the element together with any siblings parsed before it and keeps memory flat
+    regardless of the size of the file. The start events are only needed to get hold of
+    the root, since cElementTree has no way to reach the parent of an element."""
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def iter_elements_lxml(osm_file, tags=('node', 'way', 'relation')):
+    """This function yields the complete elements whose tag is in tags using lxml.
+
+    lxml filters the end events by tag in C, so the loop only runs once per element, and
+    each element can be cleared and unlinked from its parent right after it was used."""
+
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',), tag=tags):
+        yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+# parser backends by name; 'pbf' reads .osm.pbf files instead of XML
+PARSERS = {
+    'lxml': iter_elements_lxml,
+    'etree': iter_elements_etree,
+    'pbf': pbf_reader.iter_elements
+}
+
+# XML backends, fastest first
+XML_PARSERS = ('lxml', 'etree')
+
+DEFAULT_PARSER = 'lxml' if lxml_etree is not None else 'etree'
+
+
+def available_parsers():
+    """This function returns the names of the parser backends that can be used here"""
+
+    return [name for name in XML_PARSERS if name != 'lxml' or lxml_etree is not None] + ['pbf']
+
+
+def detect_parser(path):
+    """This function returns 'pbf' for an osm pbf file and the default XML backend otherwise"""
+
+    return 'pbf' if pbf_reader.is_pbf(path) else DEFAULT_PARSER
+
+
+def iter_elements(osm_file, tags=('node', 'way', 'relation'), parser=None):
+    """This function takes an osm file name or file object and yields every complete
+    element whose tag is in tags. A file name may point to a .gz, .bz2 or .zst file, which
+    is decompressed alongside the parsing (see compressed_io.open_input).
+
+    parser names the backend; by default a file name is checked for the pbf format, and
+    XML is read with lxml if it is installed and cElementTree otherwise. All of them yield
+    elements with the same tag, attrib and iter() and give the same attribute values, except
+    that pbf coordinates are written without trailing zeros. A file object holding pbf data
+    needs parser='pbf'."""
+
+    if parser is None:
+        parser = detect_parser(osm_file) if isinstance(osm_file, basestring) else DEFAULT_PARSER
+    if parser not in available_parsers():
+        raise ValueError("parser {0} is not available, use one of {1}".format(parser, available_parsers()))
+    if isinstance(osm_file, basestring):
+        return iter_path_elements(osm_file, tags, PARSERS[parser])
+    return PARSERS[parser](osm_file, tags)
+
+
+def iter_path_elements(path, tags, iterate):
+    """This function opens path with open_input and closes it once iterate is done"""
+
+    osm_file = open_input(path)
+    try:
+        for elem in iterate(osm_file, tags):
+            yield elem
+    finally:
+        osm_file.close()
+
+
+def iter_tags(osm_file, tags=('node', 'way', 'relation'), parser=None):
+    """This function takes an osm file name or file object and yields the <tag>
+    subelements of every complete element from iter_elements."""
+
+    for elem in iter_elements(osm_file, tags, parser):
+        for tag in elem.iter("tag"):
+            yield tag
@@ -0,0 +1,110 @@
+# write shaped elements to typed, compressed parquet tables
+
+# pyarrow 0.16.0 is the last release with python 2 wheels: pip install pyarrow==0.16.0
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# python conversion and arrow type name for each field of the shaped elements
+COLUMN_TYPES = {
+    'id': (int, 'int64'),
+    'lat': (float, 'float64'),
+    'lon': (float, 'float64'),
+    'user': (None, 'string'),
+    'uid': (int, 'int64'),
+    'version': (None, 'string'),
+    'changeset': (int, 'int64'),
+    'timestamp': (None, 'string'),
+    'key': (None, 'string'),
+    'value': (None, 'string'),
+    'type': (None, 'string'),
+    'node_id': (int, 'int64'),
+    'position': (int, 'int32'),
+    'ref': (int, 'int64'),
+    'role': (None, 'string'),
+    'missing_nodes': (int, 'int32'),
+    'min_lat': (float, 'float64'),
+    'min_lon': (float, 'float64'),
+    'max_lat': (float, 'float64'),
+    'max_lon': (float, 'float64'),
+    'length': (float, 'float64'),
+    'centroid_lat': (float, 'float64'),
+    'centroid_lon': (float, 'float64'),
+    'coordinates': (None, 'string')
+}
+
+# columns that are empty for ways whose nodes are all outside the extract
+NULLABLE_FIELDS = ['min_lat', 'min_lon', 'max_lat', 'max_lon', 'centroid_lat', 'centroid_lon']
+
+# low cardinality columns stored with dictionary encoding
+DICTIONARY_FIELDS = ['user', 'key', 'type', 'version', 'role']
+
+ROW_GROUP_SIZE = 128 * 1024
+COMPRESSION = 'zstd'
+
+
+def arrow_schema(fields):
+    """This function returns the arrow schema for a table of shaped rows"""
+
+    return pa.schema([pa.field(field, getattr(pa, COLUMN_TYPES[field][1])(), nullable=field in NULLABLE_FIELDS)
+                      for field in fields])
+
+
+class ParquetTableWriter(object):
+    """Collect shaped rows for one table column by column and write them to a parquet
+    file one row group at a time. Mirrors the writerow/writerows interface of
+    csv.DictWriter. Rows are records in field order or dicts by field."""
+
+    def __init__(self, path, fields, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+        if pa is None:
+            raise ImportError("parquet output requires pyarrow, pip install pyarrow==0.16.0")
+
+        self.fields = fields
+        self.converters = [COLUMN_TYPES[field][0] for field in fields]
+        self.row_group_size = row_group_size
+        self.schema = arrow_schema(fields)
+        self.columns = [[] for _ in fields]
+        self.size = 0
+        self.writer = pq.ParquetWriter(
+            path, self.schema, compression=compression,
+            use_dictionary=[field for field in fields if field in DICTIONARY_FIELDS])
+
+    def writerow(self, row):
+        values = row if isinstance(row, tuple) else [row[field] for field in self.fields]
+        for value, convert, column in zip(values, self.converters, self.columns):
+            column.append(convert(value) if convert is not None and value is not None else value)
+        self.size += 1
+        if self.size >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.size:
+            arrays = [pa.array(column, type=field.type) for column, field in zip(self.columns, self.schema)]
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+            self.columns = [[] for _ in self.fields]
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_writers(paths, fields):
+    """This function returns a dictionary of ParquetTableWriter per shaped element key,
+    given dictionaries of file names and field lists by key."""
+
+    return dict((key, ParquetTableWriter(path, fields[key])) for key, path in paths.iteritems())
+
+
+def close_writers(writers):
+    """This function writes the last row group of each table and closes the files"""
+
+    for writer in writers.itervalues():
+        writer.close()
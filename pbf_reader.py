@@ -0,0 +1,494 @@
+# read .osm.pbf files into the same element stream as the XML parsers
+
+import multiprocessing
+import struct
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# features of the OSMHeader block this reader understands
+SUPPORTED_FEATURES = frozenset(['OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation'])
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# blocks decoded ahead of the consumer per worker process
+BLOCKS_AHEAD = 2
+
+# protobuf wire types
+VARINT, FIXED64, LENGTH_DELIMITED, FIXED32 = 0, 1, 2, 5
+
+
+def is_pbf(path):
+    """This function returns whether path is an osm pbf file, judged by the type of its
+    first blob header"""
+
+    with open(path, 'rb') as pbf_file:
+        head = pbf_file.read(32)
+    return len(head) > 4 and 'OSMHeader' in head[4:]
+
+
+# ================================================== #
+#               Protobuf Decoding                    #
+# ================================================== #
+def read_varint(buf, pos):
+    """This function decodes the varint at pos of the bytearray buf and returns it with
+    the position after it"""
+
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(data):
+    """This function yields (field number, value) for every field of a protobuf message.
+    Varints are returned as unsigned integers, length delimited fields as strings."""
+
+    buf = bytearray(data)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        # field keys and short lengths nearly always fit in one byte
+        key = buf[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = read_varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length = buf[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = read_varint(buf, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == FIXED64:
+            value = struct.unpack('<Q', data[pos:pos + 8])[0]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = struct.unpack('<I', data[pos:pos + 4])[0]
+            pos += 4
+        else:
+            raise ValueError("unsupported protobuf wire type {0}".format(wire_type))
+        yield key >> 3, value
+
+
+def decode_packed(data):
+    """This function decodes a packed field of unsigned varints"""
+
+    values = []
+    append = values.append
+    value = 0
+    shift = 0
+    for byte in bytearray(data):
+        if byte < 0x80:
+            append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value):
+    """This function reinterprets an unsigned varint of an int32/int64 field as signed"""
+
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def decode_delta(data):
+    """This function decodes a packed field of delta coded sint64 values"""
+
+    values = []
+    total = 0
+    for value in decode_packed(data):
+        total += (value >> 1) ^ -(value & 1)
+        values.append(total)
+    return values
+
+
+# ================================================== #
+#               Elements                             #
+# ================================================== #
+# the decoders build plain (tag, attrib, children) tuples with children as (tag, attrib)
+# tuples, which are cheap to pass back from the worker processes, and wrap them in
+# PbfElement only when they are handed out
+class PbfChild(object):
+    """<tag>, <nd> or <member> subelement"""
+
+    __slots__ = ('tag', 'attrib')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+
+
+class PbfElement(object):
+    """Node, way or relation with the tag, attrib and iter() of an XML element, so the
+    shaping code cannot tell it apart from one parsed from XML"""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib, children):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = children
+
+    def iter(self, tag=None):
+        if tag is None or tag == self.tag:
+            yield self
+        for child_tag, attrib in self.children:
+            if tag is None or child_tag == tag:
+                yield PbfChild(child_tag, attrib)
+
+
+def decode_string(value):
+    """This function returns a string table entry the way the XML parsers return
+    attribute values: str if it is ascii, unicode otherwise"""
+
+    try:
+        value.decode('ascii')
+        return value
+    except UnicodeDecodeError:
+        return value.decode('utf-8')
+
+
+def format_coordinate(nanodegrees):
+    """This function formats a coordinate given in units of 1e-9 degrees with up to seven
+    decimals, like the XML written by osmosis and osmium"""
+
+    text = ('%.7f' % (nanodegrees * 1e-9)).rstrip('0')
+    return text + '0' if text[-1] == '.' else text
+
+
+def format_timestamp(milliseconds, days={}):
+    """This function formats a timestamp in milliseconds since the epoch like the XML
+    timestamps. The date part is formatted once per day and remembered in days."""
+
+    seconds = milliseconds // 1000
+    day, second = divmod(seconds, 86400)
+    date = days.get(day)
+    if date is None:
+        date = days[day] = time.strftime('%Y-%m-%dT', time.gmtime(day * 86400))
+    hour, second = divmod(second, 3600)
+    minute, second = divmod(second, 60)
+    return '%s%02d:%02d:%02dZ' % (date, hour, minute, second)
+
+
+class BlockContext(object):
+    """String table and coordinate and date scaling of one primitive block"""
+
+    def __init__(self, strings, granularity, lat_offset, lon_offset, date_granularity):
+        self.strings = strings
+        self.granularity = granularity
+        self.lat_offset = lat_offset
+        self.lon_offset = lon_offset
+        self.date_granularity = date_granularity
+
+    def lat(self, value):
+        return format_coordinate(self.lat_offset + self.granularity * value)
+
+    def lon(self, value):
+        return format_coordinate(self.lon_offset + self.granularity * value)
+
+
+def info_attrib(attrib, data, context):
+    """This function adds the version, timestamp, changeset, uid and user of an Info
+    message to attrib"""
+
+    for field, value in iter_fields(data):
+        if field == 1:
+            attrib['version'] = str(value)
+        elif field == 2:
+            attrib['timestamp'] = format_timestamp(signed(value) * context.date_granularity)
+        elif field == 3:
+            attrib['changeset'] = str(signed(value))
+        elif field == 4:
+            attrib['uid'] = str(signed(value))
+        elif field == 5:
+            attrib['user'] = context.strings[value]
+
+
+def tag_children(keys, values, strings):
+    return [('tag', {'k': strings[key], 'v': strings[value]}) for key, value in zip(keys, values)]
+
+
+def decode_dense(data, context, elements):
+    """This function appends the nodes of a DenseNodes message to elements"""
+
+    ids = lats = lons = keys_vals = ()
+    info = None
+    for field, value in iter_fields(data):
+        if field == 1:
+            ids = decode_delta(value)
+        elif field == 5:
+            info = value
+        elif field == 8:
+            lats = decode_delta(value)
+        elif field == 9:
+            lons = decode_delta(value)
+        elif field == 10:
+            keys_vals = decode_packed(value)
+
+    versions = timestamps = changesets = uids = user_sids = None
+    if info is not None:
+        for field, value in iter_fields(info):
+            if field == 1:
+                versions = decode_packed(value)
+            elif field == 2:
+                timestamps = decode_delta(value)
+            elif field == 3:
+                changesets = decode_delta(value)
+            elif field == 4:
+                uids = decode_delta(value)
+            elif field == 5:
+                user_sids = decode_delta(value)
+
+    strings = context.strings
+    date_granularity = context.date_granularity
+    position = 0
+    for index, node_id in enumerate(ids):
+        attrib = {'id': str(node_id), 'lat': context.lat(lats[index]), 'lon': context.lon(lons[index])}
+        # extracts stripped of user data leave out some of the DenseInfo arrays
+        if versions is not None:
+            attrib['version'] = str(versions[index])
+        if timestamps is not None:
+            attrib['timestamp'] = format_timestamp(timestamps[index] * date_granularity)
+        if changesets is not None:
+            attrib['changeset'] = str(changesets[index])
+        if uids is not None:
+            attrib['uid'] = str(uids[index])
+        if user_sids is not None:
+            attrib['user'] = strings[user_sids[index]]
+
+        # keys_vals holds key, value string ids for each node, each node ended by a 0
+        tags = []
+        if keys_vals:
+            while keys_vals[position] != 0:
+                tags.append(('tag', {'k': strings[keys_vals[position]], 'v': strings[keys_vals[position + 1]]}))
+                position += 2
+            position += 1
+        elements.append(('node', attrib, tags))
+
+
+def decode_node(data, context, elements):
+    attrib = {}
+    keys = values = ()
+    lat = lon = 0
+    for field, value in iter_fields(data):
+        if field == 1:
+            attrib['id'] = str(zigzag(value))
+        elif field == 2:
+            keys = decode_packed(value)
+        elif field == 3:
+            values = decode_packed(value)
+        elif field == 4:
+            info_attrib(attrib, value, context)
+        elif field == 8:
+            lat = zigzag(value)
+        elif field == 9:
+            lon = zigzag(value)
+    attrib['lat'] = context.lat(lat)
+    attrib['lon'] = context.lon(lon)
+    elements.append(('node', attrib, tag_children(keys, values, context.strings)))
+
+
+def decode_way(data, context, elements):
+    attrib = {}
+    keys = values = refs = ()
+    for field, value in iter_fields(data):
+        if field == 1:
+            attrib['id'] = str(signed(value))
+        elif field == 2:
+            keys = decode_packed(value)
+        elif field == 3:
+            values = decode_packed(value)
+        elif field == 4:
+            info_attrib(attrib, value, context)
+        elif field == 8:
+            refs = decode_delta(value)
+    children = [('nd', {'ref': str(ref)}) for ref in refs]
+    children.extend(tag_children(keys, values, context.strings))
+    elements.append(('way', attrib, children))
+
+
+def decode_relation(data, context, elements):
+    attrib = {}
+    keys = values = roles = member_ids = types = ()
+    for field, value in iter_fields(data):
+        if field == 1:
+            attrib['id'] = str(signed(value))
+        elif field == 2:
+            keys = decode_packed(value)
+        elif field == 3:
+            values = decode_packed(value)
+        elif field == 4:
+            info_attrib(attrib, value, context)
+        elif field == 8:
+            roles = decode_packed(value)
+        elif field == 9:
+            member_ids = decode_delta(value)
+        elif field == 10:
+            types = decode_packed(value)
+    strings = context.strings
+    children = [('member', {'type': MEMBER_TYPES[member_type], 'ref': str(member_id), 'role': strings[role]})
+                for role, member_id, member_type in zip(roles, member_ids, types)]
+    children.extend(tag_children(keys, values, strings))
+    elements.append(('relation', attrib, children))
+
+
+GROUP_DECODERS = {
+    1: decode_node,
+    2: decode_dense,
+    3: decode_way,
+    4: decode_relation
+}
+
+
+def decode_primitive_block(data, tags=('node', 'way', 'relation')):
+    """This function decodes a PrimitiveBlock into a list of elements whose tag is in tags"""
+
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset, date_granularity = 100, 0, 0, 1000
+    for field, value in iter_fields(data):
+        if field == 1:
+            strings = [decode_string(entry) for _, entry in iter_fields(value)]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 18:
+            date_granularity = value
+        elif field == 19:
+            lat_offset = signed(value)
+        elif field == 20:
+            lon_offset = signed(value)
+
+    context = BlockContext(strings, granularity, lat_offset, lon_offset, date_granularity)
+    elements = []
+    for group in groups:
+        for field, value in iter_fields(group):
+            decoder = GROUP_DECODERS.get(field)
+            if decoder is not None:
+                decoder(value, context, elements)
+    if len(tags) < 3:
+        elements = [element for element in elements if element[0] in tags]
+    return elements
+
+
+# ================================================== #
+#               Blobs                                #
+# ================================================== #
+def blob_data(blob):
+    """This function returns the uncompressed content of a Blob message"""
+
+    for field, value in iter_fields(blob):
+        if field == 1:
+            return value
+        elif field == 3:
+            return zlib.decompress(value)
+        elif field == 7 and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompress(value)
+        elif field in (4, 5, 6, 7):
+            raise ValueError("unsupported pbf blob compression (field {0})".format(field))
+    return ''
+
+
+def iter_blobs(pbf_file):
+    """This function yields (type, blob) for every blob of a pbf file object"""
+
+    while True:
+        size = pbf_file.read(4)
+        if not size:
+            return
+        header = pbf_file.read(struct.unpack('>I', size)[0])
+        blob_type = None
+        data_size = 0
+        for field, value in iter_fields(header):
+            if field == 1:
+                blob_type = value
+            elif field == 3:
+                data_size = value
+        yield blob_type, pbf_file.read(data_size)
+
+
+def check_header(blob):
+    """This function raises ValueError if the OSMHeader block requires a feature this
+    reader does not support"""
+
+    for field, value in iter_fields(blob_data(blob)):
+        if field == 4 and value not in SUPPORTED_FEATURES:
+            raise ValueError("unsupported pbf feature: {0}".format(value))
+
+
+def decode_blob(task):
+    """This function decompresses and decodes one OSMData blob in a worker process"""
+
+    blob, tags = task
+    return decode_primitive_block(blob_data(blob), tags)
+
+
+def iter_data_blobs(pbf_file):
+    for blob_type, blob in iter_blobs(pbf_file):
+        if blob_type == 'OSMHeader':
+            check_header(blob)
+        elif blob_type == 'OSMData':
+            yield blob
+
+
+def iter_elements(pbf_file, tags=('node', 'way', 'relation'), processes=None):
+    """This function takes a pbf file name or file object and yields every node, way and
+    relation whose tag is in tags, in file order, as elements that shape_element handles
+    like parsed XML elements.
+
+    The blocks of a pbf file are independent, so with processes > 1 (by default one per
+    cpu) they are decoded in a process pool, a bounded number of blocks ahead."""
+
+    if isinstance(pbf_file, basestring):
+        with open(pbf_file, 'rb') as opened_file:
+            for element in iter_elements(opened_file, tags, processes):
+                yield element
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    tags = tuple(tags)
+
+    if processes <= 1:
+        for blob in iter_data_blobs(pbf_file):
+            for tag, attrib, children in decode_primitive_block(blob_data(blob), tags):
+                yield PbfElement(tag, attrib, children)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = []
+        for blob in iter_data_blobs(pbf_file):
+            pending.append(pool.apply_async(decode_blob, ((blob, tags),)))
+            if len(pending) >= processes * BLOCKS_AHEAD:
+                for tag, attrib, children in pending.pop(0).get():
+                    yield PbfElement(tag, attrib, children)
+        for result in pending:
+            for tag, attrib, children in result.get():
+                yield PbfElement(tag, attrib, children)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,250 @@
+# overview statistics of the map maintained while process_map converts it
+
+import argparse
+import hashlib
+import json
+import math
+import struct
+from array import array
+from collections import defaultdict
+
+ROLLUPS_PATH = "boston_massachusetts_rollups.json"
+
+TOP_K = 10
+
+# tag keys whose values are counted per user for the top contributor
+CURATED_KEYS = ('leisure', 'tourism')
+
+# users whose sketch positions are remembered before the memo is cleared
+USER_CACHE_SIZE = 65536
+
+
+def hash_pair(value):
+    """This function returns two independent 64 bit hashes of a string"""
+
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(value).digest())
+
+
+# ================================================== #
+#               Sketches                             #
+# ================================================== #
+class HyperLogLog(object):
+    """Distinct count estimate in 2 ** precision one byte registers, with a standard error
+    of about 1.04 / sqrt(2 ** precision), 0.8% for the default 16 KB"""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, value_hash):
+        index = value_hash >> (64 - self.precision)
+        rest = value_hash & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * size and zeros:
+            # linear counting is more accurate while many registers are still empty
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch(object):
+    """Frequency estimates in depth rows of width counters. An estimate never falls below
+    the true count and exceeds it by at most e / width of the total with probability
+    1 - exp(-depth)."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('l', [0]) * width for _ in xrange(depth)]
+        self.total = 0
+
+    def positions(self, first, second):
+        """This function returns the counter of each row for an item given by its two
+        hashes, first + i * second"""
+
+        return tuple((first + index * second) % self.width for index in xrange(self.depth))
+
+    def add(self, positions, count=1):
+        """This function counts an item given by its positions and returns its new estimate"""
+
+        self.total += count
+        estimate = None
+        for row, position in zip(self.rows, positions):
+            row[position] += count
+            if estimate is None or row[position] < estimate:
+                estimate = row[position]
+        return estimate
+
+
+class TopK(object):
+    """The k most frequent items of a stream, ranked by their count-min estimates. A few
+    more candidates than k are kept, so an item that climbs slowly is not pushed out by
+    the noise around the k-th place."""
+
+    def __init__(self, k=TOP_K, width=2048, depth=4, spare=4):
+        self.k = k
+        self.capacity = k * spare
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.floor = 0
+
+    def add(self, item, positions):
+        """This function counts an item given by its positions and returns the candidate
+        it pushed out, or None"""
+
+        estimate = self.sketch.add(positions)
+        candidates = self.candidates
+        if item in candidates or len(candidates) < self.capacity:
+            candidates[item] = estimate
+        elif estimate > self.floor:
+            # floor is the smallest candidate estimate when it was last looked up; the
+            # estimates only grow, so it is a lower bound and the scan is rarely needed
+            lowest = min(candidates, key=candidates.get)
+            dropped = None
+            if estimate > candidates[lowest]:
+                del candidates[lowest]
+                candidates[item] = estimate
+                dropped = lowest
+            self.floor = min(candidates.itervalues())
+            return dropped
+        return None
+
+    def top(self):
+        return sorted(self.candidates.iteritems(), key=lambda pair: (-pair[1], pair[0]))[:self.k]
+
+
+# ================================================== #
+#               Collector                            #
+# ================================================== #
+class RollupCollector(object):
+    """Collector for process_map that maintains the overview statistics of the README as
+    the elements are converted and writes them as json to path on close:
+
+    counts              nodes, ways and relations, exact
+    unique_users        distinct users of nodes and ways, HyperLogLog estimate
+    top_users           top 10 contributing users, count-min estimates
+    top_tourism         top 10 tourism values, exact
+    top_user_curated    leisure and tourism values tagged by the top contributor, counted
+                        from when the user became a top users candidate
+    tourism_max_nodes   largest node count of a way per top 10 tourism value, exact
+
+    The leisure and tourism values are only counted per user for the candidates of the
+    top users, and dropped with a candidate, so the top contributor's counts are exact
+    unless they only became a candidate after some of their edits. The exact counters by
+    tourism value grow with the distinct values, which are few, and the sketches, the
+    candidates and the memo of user hashes have a fixed size, so the memory does not grow
+    with the number of elements or users."""
+
+    def __init__(self, path=ROLLUPS_PATH, precision=14, width=2048, depth=4):
+        self.path = path
+        self.counts = defaultdict(int)
+        self.users = HyperLogLog(precision)
+        self.top_users = TopK(TOP_K, width, depth)
+        self.tourism = defaultdict(int)
+        self.tourism_max_nodes = defaultdict(int)
+        # leisure and tourism value counts per candidate of the top users
+        self.curated = {}
+        # sketch positions per user; a user seen before is already in the HyperLogLog
+        self.user_positions = {}
+
+    def add(self, kind, el):
+        record = el[kind]
+        self.counts[kind] += 1
+        if kind == 'relation':
+            return
+
+        user = record.user
+        positions = self.user_positions.get(user)
+        if positions is None:
+            if len(self.user_positions) >= USER_CACHE_SIZE:
+                self.user_positions.clear()
+            first, second = hash_pair(user)
+            self.users.add_hash(first)
+            positions = self.user_positions[user] = self.top_users.sketch.positions(first, second)
+        dropped = self.top_users.add(user, positions)
+        if dropped is not None:
+            self.curated.pop(dropped, None)
+        curated = None
+        if user in self.top_users.candidates:
+            curated = self.curated.get(user)
+            if curated is None:
+                curated = self.curated[user] = defaultdict(int)
+
+        for tag in el[kind + '_tags']:
+            if tag.type == 'regular' and tag.key in CURATED_KEYS:
+                if curated is not None:
+                    curated[(tag.key, tag.value)] += 1
+                if tag.key == 'tourism':
+                    self.tourism[tag.value] += 1
+                    if kind == 'way' and len(el['way_nodes']) > self.tourism_max_nodes[tag.value]:
+                        self.tourism_max_nodes[tag.value] = len(el['way_nodes'])
+
+    def report(self):
+        """This function returns the rollups as a dictionary"""
+
+        top_users = self.top_users.top()
+        top_user = top_users[0][0] if top_users else None
+        top_tourism = sorted(self.tourism.iteritems(), key=lambda pair: (-pair[1], pair[0]))[:TOP_K]
+
+        curated = dict((key, []) for key in CURATED_KEYS)
+        for (key, value), count in self.curated.get(top_user, {}).iteritems():
+            curated[key].append((value, count))
+        for key in curated:
+            curated[key] = sorted(curated[key], key=lambda pair: (-pair[1], pair[0]))[:TOP_K]
+
+        sketch = self.top_users.sketch
+        return {
+            'counts': dict(self.counts),
+            'unique_users': self.users.count(),
+            'top_users': top_users,
+            'top_users_error': int(math.ceil(math.e / sketch.width * sketch.total)),
+            'top_tourism': top_tourism,
+            'top_user': top_user,
+            'top_user_curated': curated,
+            'tourism_max_nodes': [(value, self.tourism_max_nodes.get(value, 0)) for value, _ in top_tourism]
+        }
+
+    def close(self):
+        with open(self.path, 'wb') as rollups_file:
+            json.dump(self.report(), rollups_file, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the rollups written by process_map")
+    parser.add_argument('--rollups', default=ROLLUPS_PATH)
+    args = parser.parse_args(argv)
+
+    with open(args.rollups, 'rb') as rollups_file:
+        report = json.load(rollups_file)
+
+    counts = report['counts']
+    print "number of nodes: ", counts.get('node', 0)
+    print "number of ways: ", counts.get('way', 0)
+    print "number of unique users (estimate): ", report['unique_users']
+    print "---------------------------------------------------------------------------------"
+    print "top contributing users (count-min estimates, +{0} at most):".format(report['top_users_error'])
+    for user, count in report['top_users']:
+        print u"  {0}\t{1}".format(count, user).encode('utf-8')
+    print "top tourism types:"
+    for value, count in report['top_tourism']:
+        print u"  {0}\t{1}".format(count, value).encode('utf-8')
+    for key, values in sorted(report['top_user_curated'].iteritems()):
+        print u"{0} values curated by {1}:".format(key, report['top_user']).encode('utf-8')
+        for value, count in values:
+            print u"  {0}\t{1}".format(count, value).encode('utf-8')
+    print "maximum nodes of a way per top tourism type:"
+    for value, nodes in report['tourism_max_nodes']:
+        print u"  {0}\t{1}".format(nodes, value).encode('utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+# validate shaped elements against a cerberus style schema compiled into checker functions
+
+import collections
+from operator import itemgetter
+
+# python types accepted for each schema type
+TYPES = {
+    'integer': (int, long),
+    'float': (float,),
+    'number': (int, long, float),
+    'string': (basestring,),
+    'boolean': (bool,),
+    'dict': (collections.Mapping,),
+    'list': (collections.Sequence,)
+}
+
+
+# ================================================== #
+#               Fast Path                            #
+# ================================================== #
+class NotCompilable(Exception):
+    """Raised when a rule has no fast check"""
+
+
+def is_integer_rule(rules):
+    return rules.get('coerce') is int and rules.get('type') == 'integer'
+
+
+def is_float_rule(rules):
+    return rules.get('coerce') is float and rules.get('type') == 'float'
+
+
+def is_string_rule(rules):
+    return rules.get('coerce') is None and rules.get('type') == 'string'
+
+
+def is_record_schema(rules):
+    """This function returns whether rules describe a dict whose fields are all required,
+    which a record (namedtuple) with the same fields can stand in for"""
+
+    return (rules.get('type') == 'dict' and rules.get('coerce') is None and 'schema' in rules and
+            all(field_rules.get('required') for field_rules in rules['schema'].itervalues()))
+
+
+def fast_value_check(rules):
+    """This function returns a function that takes a value and answers whether it matches
+    rules. The checks return False on the first problem instead of collecting errors, and
+    may raise on a value of the wrong type, which the enclosing mapping check takes as
+    False."""
+
+    coerce = rules.get('coerce')
+    type_name = rules.get('type')
+
+    # int() and float() always return the schema type, so coercion replaces the type check;
+    # a plain string of ascii digits or an int always converts, which is much cheaper to test
+    if is_integer_rule(rules):
+        def check(value, int=int, str=str):
+            if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                int(value)
+            return True
+
+    elif is_float_rule(rules):
+        def check(value, float=float):
+            float(value)
+            return True
+
+    elif is_string_rule(rules):
+        # most values are plain strings, which a class test accepts without isinstance
+        def check(value, str=str, isinstance=isinstance, basestring=basestring):
+            return value.__class__ is str or isinstance(value, basestring)
+
+    elif coerce is None and type_name == 'dict' and 'schema' in rules:
+        check = fast_mapping_check(rules['schema'])
+
+    elif coerce is None and type_name == 'list' and 'schema' in rules:
+        check_item = fast_value_check(rules['schema'])
+
+        def check(value, list=list):
+            if value.__class__ is not list:
+                return False
+            for item in value:
+                if not check_item(item):
+                    return False
+            return True
+
+    elif coerce is None and type_name in TYPES:
+        types = TYPES[type_name]
+
+        def check(value, isinstance=isinstance):
+            return isinstance(value, types)
+
+    else:
+        raise NotCompilable(rules)
+
+    return check
+
+
+def fast_mapping_check(schema):
+    """This function returns a function that answers whether a dict matches schema. The
+    checkers of every field are looked up by name and then by the class of the value, or
+    of the first value of a list of records, see RecordCheckers and FieldCheckers. An
+    exception raised by a check means the dict does not match."""
+
+    fields = {}
+    for name, rules in schema.iteritems():
+        if is_record_schema(rules):
+            fields[name] = RecordCheckers(rules['schema'])
+        elif (rules.get('coerce') is None and rules.get('type') == 'list' and 'schema' in rules and
+              is_record_schema(rules['schema'])):
+            fields[name] = RecordCheckers(rules['schema']['schema'], many=True)
+        else:
+            fields[name] = FieldCheckers(fast_value_check(rules))
+    required = [name for name, rules in schema.iteritems() if rules.get('required')]
+
+    def check(document, dict=dict, list=list):
+        try:
+            if document.__class__ is not dict:
+                return False
+            for key, value in document.iteritems():
+                checkers = fields[key]
+                if checkers.many:
+                    if value.__class__ is not list:
+                        return False
+                    if value and not checkers[value[0].__class__](value):
+                        return False
+                elif not checkers[value.__class__](value):
+                    return False
+            for name in required:
+                if name not in document:
+                    return False
+            return True
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+
+    return check
+
+
+def values_getter(keys):
+    """This function returns a function that takes a record or dict and returns a tuple of
+    its values at keys, or None if there are no keys"""
+
+    if not keys:
+        return None
+    if len(keys) > 1:
+        return itemgetter(*keys)
+    if isinstance(keys[0], int):
+        # a slice keeps a single value of a record in a tuple
+        return itemgetter(slice(keys[0], keys[0] + 1))
+    key = keys[0]
+    return lambda record: (record[key],)
+
+
+def record_check(keys, rules, size=None, record_class=None):
+    """This function returns a function that checks the values of a dict or record at keys
+    against rules, the rules of each key. The values of the integer, float and string
+    fields are taken out with one itemgetter each; the strings are checked by joining
+    them, which raises TypeError for anything else. Other rules get a function from
+    fast_value_check. With size, a value of another length is rejected.
+
+    With a record_class the function checks a list of records of that class instead, with
+    the loop over the records inside the one function. Records of the shapes in SCHEMA
+    get a function without the tests for the fields they do not have: integers only, and
+    integers and strings with or without floats, with a single integer read directly."""
+
+    integers = values_getter([key for key, key_rules in zip(keys, rules) if is_integer_rule(key_rules)])
+    floats = values_getter([key for key, key_rules in zip(keys, rules) if is_float_rule(key_rules)])
+    strings = values_getter([key for key, key_rules in zip(keys, rules) if is_string_rule(key_rules)])
+    others = [(key, fast_value_check(key_rules)) for key, key_rules in zip(keys, rules)
+              if not (is_integer_rule(key_rules) or is_float_rule(key_rules) or is_string_rule(key_rules))]
+
+    if size is None and not others and integers and not floats and not strings:
+        def check_integer_record(record, int=int, str=str):
+            for value in record:
+                if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                    int(value)
+            return True
+
+        def check_integer_records(records, int=int, str=str):
+            for record in records:
+                if record.__class__ is not record_class:
+                    return False
+                for value in record:
+                    if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                        int(value)
+            return True
+
+        return check_integer_record if record_class is None else check_integer_records
+
+    if size is None and not others and integers and strings:
+        integer_keys = [key for key, key_rules in zip(keys, rules) if is_integer_rule(key_rules)]
+        if len(integer_keys) == 1:
+            integer = integer_keys[0]
+
+            def check_record(record, int=int, float=float, str=str, join=''.join):
+                value = record[integer]
+                if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                    int(value)
+                if floats:
+                    for value in floats(record):
+                        float(value)
+                join(strings(record))
+                return True
+
+            def check_records(records, int=int, float=float, str=str, join=''.join):
+                for record in records:
+                    if record.__class__ is not record_class:
+                        return False
+                    value = record[integer]
+                    if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                        int(value)
+                    if floats:
+                        for value in floats(record):
+                            float(value)
+                    join(strings(record))
+                return True
+
+        else:
+            def check_record(record, int=int, float=float, str=str, join=''.join):
+                for value in integers(record):
+                    if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                        int(value)
+                if floats:
+                    for value in floats(record):
+                        float(value)
+                join(strings(record))
+                return True
+
+            def check_records(records, int=int, float=float, str=str, join=''.join):
+                for record in records:
+                    if record.__class__ is not record_class:
+                        return False
+                    for value in integers(record):
+                        if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                            int(value)
+                    if floats:
+                        for value in floats(record):
+                            float(value)
+                    join(strings(record))
+                return True
+
+        return check_record if record_class is None else check_records
+
+    def check(record, int=int, float=float, str=str, len=len, join=''.join):
+        if size is not None and len(record) != size:
+            return False
+        if integers:
+            for value in integers(record):
+                if not (value.__class__ is str and value.isdigit()) and value.__class__ is not int:
+                    int(value)
+        if floats:
+            for value in floats(record):
+                float(value)
+        if strings:
+            join(strings(record))
+        for key, check_value in others:
+            if not check_value(record[key]):
+                return False
+        return True
+
+    if record_class is None:
+        return check
+
+    def check_records(records):
+        for record in records:
+            if record.__class__ is not record_class or not check(record):
+                return False
+        return True
+
+    return check_records
+
+
+def reject(record):
+    return False
+
+
+class RecordCheckers(dict):
+    """Checkers by class for a schema whose fields are all required, for dicts and for
+    records (namedtuples) with the same fields.
+
+    The checker of a class is made by __missing__ the first time it is looked up. A dict is
+    checked by size and field names. The field order of a record class is fixed, so a
+    record is checked by position without looking up the name of a field. Records of a
+    class without exactly the fields of the schema get a checker that rejects them. With
+    many=True the checkers take a list and check every value in it, rejecting the list
+    if a value is of another class."""
+
+    def __init__(self, schema, many=False):
+        dict.__init__(self)
+        self.schema = schema
+        self.many = many
+        # making the dict checker up front raises NotCompilable while the schema is
+        # compiled rather than in the middle of a check
+        self[dict]
+
+    def __missing__(self, record_class):
+        if record_class is dict:
+            fields = sorted(self.schema)
+            check_one = record_check(fields, [self.schema[field] for field in fields], len(fields))
+            if self.many:
+                def check(records):
+                    for record in records:
+                        if record.__class__ is not dict or not check_one(record):
+                            return False
+                    return True
+            else:
+                check = check_one
+        else:
+            fields = getattr(record_class, '_fields', None)
+            if fields is None or len(fields) != len(self.schema) or set(fields) != set(self.schema):
+                self[record_class] = reject
+                return reject
+            check = record_check(range(len(fields)), [self.schema[field] for field in fields],
+                                 record_class=record_class if self.many else None)
+
+        self[record_class] = check
+        return check
+
+
+class FieldCheckers(dict):
+    """The counterpart of RecordCheckers for a field with other rules, which has the same
+    check for a value of any class"""
+
+    many = False
+
+    def __init__(self, check):
+        dict.__init__(self)
+        self.check = check
+
+    def __missing__(self, value_class):
+        self[value_class] = self.check
+        return self.check
+
+
+def compile_fast(schema):
+    """This function takes the schema of a document and returns a function that only
+    answers whether a document is valid, or None if some rule has no fast check"""
+
+    try:
+        return fast_mapping_check(schema)
+    except NotCompilable:
+        return None
+
+
+# ================================================== #
+#               Error Reporting                      #
+# ================================================== #
+def compile_field(name, rules):
+    """This function takes a field name and its rules and returns a function that checks
+    one value and returns a list of errors, or None if the value is valid.
+
+    Coercion follows cerberus: the coerced value is type checked, but the document itself
+    is left untouched."""
+
+    coerce = rules.get('coerce')
+    type_name = rules.get('type')
+    types = TYPES[type_name] if type_name else None
+    message = 'must be of {0} type'.format(type_name)
+
+    if type_name in ('dict', 'list') and 'schema' in rules:
+        check_nested = compile_rules(rules)
+
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            return check_nested(value)
+
+    else:
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except (TypeError, ValueError) as e:
+                    return ["field '{0}' cannot be coerced: {1}".format(name, e)]
+            if types and not isinstance(value, types):
+                return [message]
+            return None
+
+    return check
+
+
+def compile_mapping(schema):
+    """This function takes the schema of a dict and returns a function that checks a
+    dict and returns a dictionary of errors by field, or None if it is valid."""
+
+    checks = [(name, compile_field(name, rules)) for name, rules in schema.iteritems()]
+    required = [name for name, rules in schema.iteritems() if rules.get('required')]
+
+    def check(document):
+        errors = {}
+        for name, check_field in checks:
+            if name in document:
+                field_errors = check_field(document[name])
+                if field_errors:
+                    errors[name] = field_errors
+        for name in required:
+            if name not in document:
+                errors[name] = ['required field']
+        for name in document:
+            if name not in schema:
+                errors[name] = ['unknown field']
+        return errors or None
+
+    return check
+
+
+def compile_rules(rules):
+    """This function takes the rules of a dict or list field with a nested schema and
+    returns a function that checks the nested value."""
+
+    if rules['type'] == 'dict':
+        check_mapping = compile_mapping(rules['schema'])
+
+        def check(value):
+            if not isinstance(value, collections.Mapping):
+                return ['must be of dict type']
+            errors = check_mapping(value)
+            return [errors] if errors else None
+
+    else:
+        check_item = compile_field(None, rules['schema'])
+
+        def check(value):
+            if isinstance(value, basestring) or not isinstance(value, collections.Sequence):
+                return ['must be of list type']
+            errors = {}
+            for index, item in enumerate(value):
+                item_errors = check_item(item)
+                if item_errors:
+                    errors[index] = item_errors
+            return [errors] if errors else None
+
+    return check
+
+
+def as_mapping(value):
+    """This function returns value with every record (namedtuple) nested in it replaced by
+    a dict, so that invalid records are reported like the equivalent dicts"""
+
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        return dict(zip(value._fields, (as_mapping(item) for item in value)))
+    if isinstance(value, dict):
+        return dict((key, as_mapping(item)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return [as_mapping(item) for item in value]
+    return value
+
+
+class SchemaValidator(object):
+    """Drop-in replacement for cerberus.Validator that compiles the schema once.
+
+    validate() returns True or False and leaves the errors in the errors attribute,
+    nested the same way as cerberus reports them. Valid documents only go through the
+    fast path, see compile_fast; the slower checks that collect errors run when it fails."""
+
+    def __init__(self, schema=None):
+        self.schema = None
+        self.fast = None
+        self.check = None
+        self.errors = {}
+        if schema is not None:
+            self.compile(schema)
+
+    def compile(self, schema):
+        self.schema = schema
+        self.fast = compile_fast(schema)
+        self.check = compile_mapping(schema)
+
+    def validate(self, document, schema=None):
+        if schema is not None and schema is not self.schema:
+            self.compile(schema)
+        if self.fast is not None and self.fast(document):
+            if self.errors:
+                self.errors = {}
+            return True
+        self.errors = self.check(as_mapping(document)) or {}
+        return not self.errors
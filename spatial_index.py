@@ -0,0 +1,411 @@
+# persistent spatial index over the converted csvs for bounding box and nearest neighbour queries
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import time
+from array import array
+from bisect import bisect_left
+
+from data import CSV_PATHS
+from node_store import NodeLocationStore, distance
+from tag_index import decode_ids, encode_ids
+
+INDEX_PATH = "boston_massachusetts.idx"
+
+# number of children per tree node
+NODE_SIZE = 16
+
+# the hilbert curve is laid over a 2 ** HILBERT_ORDER grid spanning the data
+HILBERT_ORDER = 16
+
+KINDS = ('node', 'way')
+NODE, WAY = 0, 1
+
+
+def hilbert(x, y, order=HILBERT_ORDER):
+    """This function returns the distance along the hilbert curve of the grid cell x, y"""
+
+    n = 1 << order
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def full_key(key, tag_type):
+    """This function rebuilds the osm key from the key and type columns of a tags csv"""
+
+    if tag_type == 'regular':
+        return key
+    return '{0}:{1}'.format(tag_type, key)
+
+
+class ItemPositions(object):
+    """Positions of the items of one kind in the sorted arrays of build_index, looked up
+    by id with a binary search over the ids sorted in two flat arrays"""
+
+    def __init__(self, ids, kinds, kind):
+        positions = sorted((i for i in xrange(len(ids)) if kinds[i] == kind), key=ids.__getitem__)
+        self.positions = array('l', positions)
+        self.ids = array('l', (ids[i] for i in positions))
+
+    def get(self, element_id):
+        index = bisect_left(self.ids, element_id)
+        if index < len(self.ids) and self.ids[index] == element_id:
+            return self.positions[index]
+        return None
+
+
+def read_tags(path, positions, postings):
+    """This function streams a tags csv into postings, {(key, value): array of item
+    positions}. Like the posting lists of tag_index.TagIndexBuilder, an array is only
+    created for the first item carrying a tag. Tags of elements that are not in the
+    index, such as ways without any located node, are left out."""
+
+    with open(path, 'rb') as tags_file:
+        for row in csv.DictReader(tags_file):
+            position = positions.get(int(row['id']))
+            if position is None:
+                continue
+            tag = (full_key(row['key'], row['type']), row['value'])
+            items = postings.get(tag)
+            if items is None:
+                items = postings[tag] = array('l')
+            items.append(position)
+
+
+# ================================================== #
+#               Bulk Loading                         #
+# ================================================== #
+def build_index(index_path=INDEX_PATH, paths=CSV_PATHS, node_size=NODE_SIZE):
+    """This function builds a packed hilbert R-tree over every node point and way bounding
+    box in the csvs in paths and writes it to index_path.
+
+    The csvs are streamed once into flat arrays; the items are then sorted by the hilbert
+    value of their centers and the tree is packed bottom up, node_size items per node, so no
+    item is ever inserted one at a time. Way boxes come from the way_geometry csv if it was
+    written, otherwise they are resolved from the way_nodes csv."""
+
+    min_lats, min_lons, max_lats, max_lons = array('d'), array('d'), array('d'), array('d')
+    ids, kinds = array('l'), array('b')
+
+    store = NodeLocationStore()
+    with open(paths['node'], 'rb') as nodes_file:
+        for row in csv.DictReader(nodes_file):
+            lat, lon = float(row['lat']), float(row['lon'])
+            min_lats.append(lat)
+            min_lons.append(lon)
+            max_lats.append(lat)
+            max_lons.append(lon)
+            ids.append(int(row['id']))
+            kinds.append(NODE)
+            store.add(row['id'], lat, lon)
+
+    geometry_path = paths.get('way_geometry')
+    if geometry_path and os.path.exists(geometry_path):
+        with open(geometry_path, 'rb') as geometry_file:
+            for row in csv.DictReader(geometry_file):
+                if not row['min_lat']:
+                    continue
+                min_lats.append(float(row['min_lat']))
+                min_lons.append(float(row['min_lon']))
+                max_lats.append(float(row['max_lat']))
+                max_lons.append(float(row['max_lon']))
+                ids.append(int(row['id']))
+                kinds.append(WAY)
+    else:
+        # way_nodes rows of a way are consecutive, so each box is finished when the id changes
+        box = None
+        with open(paths['way_nodes'], 'rb') as way_nodes_file:
+            for row in csv.DictReader(way_nodes_file):
+                way_id = int(row['id'])
+                if box is None or box[0] != way_id:
+                    if box is not None and box[1] is not None:
+                        add_box(box, min_lats, min_lons, max_lats, max_lons, ids, kinds)
+                    box = [way_id, None, None, None, None]
+                location = store.get(row['node_id'])
+                if location is None:
+                    continue
+                lat, lon = location
+                if box[1] is None:
+                    box[1:] = [lat, lon, lat, lon]
+                else:
+                    box[1:] = [min(box[1], lat), min(box[2], lon), max(box[3], lat), max(box[4], lon)]
+        if box is not None and box[1] is not None:
+            add_box(box, min_lats, min_lons, max_lats, max_lons, ids, kinds)
+    store.close()
+
+    count = len(ids)
+    if count:
+        extent = [min(min_lats), min(min_lons), max(max_lats), max(max_lons)]
+    else:
+        extent = [0.0, 0.0, 0.0, 0.0]
+
+    # sort the items along the hilbert curve so that neighbouring items share tree nodes
+    cells = (1 << HILBERT_ORDER) - 1
+    lat_scale = cells / (extent[2] - extent[0]) if extent[2] > extent[0] else 0
+    lon_scale = cells / (extent[3] - extent[1]) if extent[3] > extent[1] else 0
+    values = [hilbert(int(((min_lons[i] + max_lons[i]) / 2 - extent[1]) * lon_scale),
+                      int(((min_lats[i] + max_lats[i]) / 2 - extent[0]) * lat_scale))
+              for i in xrange(count)]
+    order = sorted(xrange(count), key=values.__getitem__)
+    del values
+
+    # boxes holds min_lat, min_lon, max_lat, max_lon for the items followed by each tree level
+    boxes = array('d')
+    for i in order:
+        boxes.extend((min_lats[i], min_lons[i], max_lats[i], max_lons[i]))
+    ids = array('l', (ids[i] for i in order))
+    kinds = array('b', (kinds[i] for i in order))
+    del min_lats, min_lons, max_lats, max_lons
+
+    level_bounds = [count]
+    start, end = 0, count
+    while end - start > 1:
+        for first in xrange(start, end, node_size):
+            last = min(first + node_size, end)
+            boxes.extend((min(boxes[4 * i] for i in xrange(first, last)),
+                          min(boxes[4 * i + 1] for i in xrange(first, last)),
+                          max(boxes[4 * i + 2] for i in xrange(first, last)),
+                          max(boxes[4 * i + 3] for i in xrange(first, last))))
+        start, end = end, len(boxes) // 4
+        level_bounds.append(end)
+
+    # tag postings point at item positions in the sorted arrays and are stored after them
+    # as varint blocks, like those of tag_index; the header only has their directory,
+    # key -> value -> [offset, length, count]. The tags csvs are streamed once the order
+    # is known, so every posting goes straight into an array of positions.
+    postings = {}
+    read_tags(paths['node_tags'], ItemPositions(ids, kinds, NODE), postings)
+    read_tags(paths['way_tags'], ItemPositions(ids, kinds, WAY), postings)
+
+    directory = {}
+    blocks = []
+    offset = 0
+    for (key, value), items in sorted(postings.iteritems()):
+        positions = sorted(set(items))
+        block = encode_ids(positions)
+        directory.setdefault(key, {})[value] = [offset, len(block), len(positions)]
+        blocks.append(block)
+        offset += len(block)
+    del postings
+
+    header = {'count': count, 'node_size': node_size, 'level_bounds': level_bounds,
+              'extent': extent, 'tags': directory}
+    with open(index_path, 'wb') as index_file:
+        index_file.write(json.dumps(header) + '\n')
+        boxes.tofile(index_file)
+        ids.tofile(index_file)
+        kinds.tofile(index_file)
+        for block in blocks:
+            index_file.write(block)
+
+
+def add_box(box, min_lats, min_lons, max_lats, max_lons, ids, kinds):
+    min_lats.append(box[1])
+    min_lons.append(box[2])
+    max_lats.append(box[3])
+    max_lons.append(box[4])
+    ids.append(box[0])
+    kinds.append(WAY)
+
+
+# ================================================== #
+#               Queries                              #
+# ================================================== #
+def box_distance(lat, lon, min_lat, min_lon, max_lat, max_lon):
+    """This function returns the distance in meters from a point to the closest point of
+    a bounding box, 0 if the point lies inside it"""
+
+    return distance(lat, lon, min(max(lat, min_lat), max_lat), min(max(lon, min_lon), max_lon))
+
+
+class SpatialIndex(object):
+    """Read only packed R-tree written by build_index.
+
+    Results are (kind, id) pairs where kind is 'node' or 'way'. tags filters the results on
+    osm tags, {key: value} with a value of None matching any value of the key. Only the
+    directory of the tag postings is loaded; a posting list is read from the file when a
+    filter needs it."""
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.file = open(index_path, 'rb')
+        header = json.loads(self.file.readline())
+        self.count = header['count']
+        self.node_size = header['node_size']
+        self.level_bounds = header['level_bounds']
+        self.extent = header['extent']
+        self.tags = header['tags']
+        self.boxes = array('d')
+        self.boxes.fromfile(self.file, 4 * self.level_bounds[-1])
+        self.ids = array('l')
+        self.ids.fromfile(self.file, self.count)
+        self.kinds = array('b')
+        self.kinds.fromfile(self.file, self.count)
+        self.start = self.file.tell()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.file.close()
+
+    def positions(self, posting):
+        """This function reads the item positions of a posting, [offset, length, count]"""
+
+        offset, length, _ = posting
+        self.file.seek(self.start + offset)
+        return decode_ids(self.file.read(length))
+
+    def matching(self, tags):
+        """This function returns the set of item positions carrying all tags, or None if
+        there is no filter"""
+
+        if not tags:
+            return None
+        result = None
+        for key, value in tags.iteritems():
+            values = self.tags.get(key, {})
+            if value is None:
+                positions = set()
+                for posting in values.itervalues():
+                    positions.update(self.positions(posting))
+            else:
+                positions = set(self.positions(values[value])) if value in values else set()
+            result = positions if result is None else result & positions
+            if not result:
+                break
+        return result
+
+    def children(self, node):
+        """This function returns the range of positions of the children of the tree node"""
+
+        for level, bound in enumerate(self.level_bounds):
+            if node < bound:
+                break
+        first = self.level_bounds[level - 2] if level > 1 else 0
+        first += (node - self.level_bounds[level - 1]) * self.node_size
+        return first, min(first + self.node_size, self.level_bounds[level - 1])
+
+    def result(self, position):
+        return KINDS[self.kinds[position]], self.ids[position]
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, tags=None):
+        """This function returns every item whose box intersects the bounding box"""
+
+        if not self.count:
+            return []
+        allowed = self.matching(tags)
+        if allowed is not None and not allowed:
+            return []
+
+        boxes = self.boxes
+        results = []
+        stack = [self.level_bounds[-1] - 1]
+        while stack:
+            node = stack.pop()
+            if node < self.count:
+                if allowed is None or node in allowed:
+                    results.append(self.result(node))
+                continue
+            first, last = self.children(node)
+            for child in xrange(first, last):
+                if (boxes[4 * child] <= max_lat and boxes[4 * child + 1] <= max_lon and
+                        boxes[4 * child + 2] >= min_lat and boxes[4 * child + 3] >= min_lon):
+                    stack.append(child)
+        return results
+
+    def nearest(self, lat, lon, k=10, max_distance=None, tags=None):
+        """This function returns up to k (distance in meters, kind, id) tuples for the items
+        closest to the point, nearest first. With k=None every item within max_distance is
+        returned."""
+
+        if not self.count:
+            return []
+        allowed = self.matching(tags)
+        if allowed is not None and not allowed:
+            return []
+
+        boxes = self.boxes
+        results = []
+        queue = [(0.0, self.level_bounds[-1] - 1)]
+        while queue and (k is None or len(results) < k):
+            dist, node = heapq.heappop(queue)
+            if max_distance is not None and dist > max_distance:
+                break
+            if node < self.count:
+                kind, element_id = self.result(node)
+                results.append((dist, kind, element_id))
+                continue
+            first, last = self.children(node)
+            for child in xrange(first, last):
+                if child < self.count and allowed is not None and child not in allowed:
+                    continue
+                heapq.heappush(queue, (box_distance(lat, lon, *boxes[4 * child:4 * child + 4]), child))
+        return results
+
+    def within(self, lat, lon, radius, tags=None):
+        """This function returns every item within radius meters of the point, nearest first"""
+
+        return self.nearest(lat, lon, k=None, max_distance=radius, tags=tags)
+
+
+def parse_tags(filters):
+    """This function turns a list of key=value or key strings into a tags filter"""
+
+    tags = {}
+    for tag_filter in filters or []:
+        key, _, value = tag_filter.partition('=')
+        tags[key] = value if value else None
+    return tags
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the spatial index of the converted data")
+    parser.add_argument('--index', default=INDEX_PATH)
+    parser.add_argument('--build', action='store_true', help="build the index from the csvs")
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    parser.add_argument('--near', type=float, nargs=2, metavar=('LAT', 'LON'))
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--radius', type=float, help="meters around --near")
+    parser.add_argument('--tag', action='append', help="key=value or key, may be repeated")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        start = time.time()
+        build_index(args.index)
+        print "built {0} in {1:.1f} s".format(args.index, time.time() - start)
+
+    if args.bbox or args.near:
+        index = SpatialIndex(args.index)
+        tags = parse_tags(args.tag)
+        start = time.time()
+        try:
+            if args.bbox:
+                results = index.bbox(*args.bbox, tags=tags)
+            elif args.radius is not None:
+                results = index.within(args.near[0], args.near[1], args.radius, tags=tags)
+            else:
+                results = index.nearest(args.near[0], args.near[1], args.k, tags=tags)
+        finally:
+            index.close()
+        elapsed = time.time() - start
+        for result in results:
+            print result
+        print "{0} results in {1:.1f} ms".format(len(results), elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# bulk load shaped elements straight into sqlite
+
+import sqlite3
+
+# sqlite column type for each field of the shaped elements
+COLUMN_TYPES = {
+    'id': 'INTEGER',
+    'lat': 'REAL',
+    'lon': 'REAL',
+    'user': 'TEXT',
+    'uid': 'INTEGER',
+    'version': 'TEXT',
+    'changeset': 'INTEGER',
+    'timestamp': 'TEXT',
+    'key': 'TEXT',
+    'value': 'TEXT',
+    'type': 'TEXT',
+    'node_id': 'INTEGER',
+    'position': 'INTEGER',
+    'ref': 'INTEGER',
+    'role': 'TEXT',
+    'missing_nodes': 'INTEGER',
+    'min_lat': 'REAL',
+    'min_lon': 'REAL',
+    'max_lat': 'REAL',
+    'max_lon': 'REAL',
+    'length': 'REAL',
+    'centroid_lat': 'REAL',
+    'centroid_lon': 'REAL',
+    'coordinates': 'TEXT'
+}
+
+# pragmas for the bulk load; the database is rebuilt from scratch if the load fails,
+# so there is no need for a rollback journal or fsyncs
+LOAD_PRAGMAS = [
+    'PRAGMA journal_mode=OFF',
+    'PRAGMA synchronous=OFF',
+    'PRAGMA locking_mode=EXCLUSIVE',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-262144'
+]
+
+# pragmas restored once the load is done
+FINISH_PRAGMAS = [
+    'PRAGMA journal_mode=DELETE',
+    'PRAGMA synchronous=FULL',
+    'PRAGMA locking_mode=NORMAL'
+]
+
+BATCH_SIZE = 10000
+
+
+class SqliteTableWriter(object):
+    """Buffer shaped rows for one table and insert them in batches with executemany.
+    Mirrors the writerow/writerows interface of csv.DictWriter. Rows are records in
+    field order or dicts by field."""
+
+    def __init__(self, connection, table, fields, batch_size=BATCH_SIZE):
+        self.connection = connection
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = []
+        self.sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            table, ', '.join(quote(field) for field in fields), ', '.join('?' * len(fields)))
+
+    def writerow(self, row):
+        if isinstance(row, tuple):
+            self.rows.append(row)
+        else:
+            self.rows.append(tuple(row[field] for field in self.fields))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.rows:
+            self.connection.executemany(self.sql, self.rows)
+            self.rows = []
+
+
+def quote(name):
+    """This function quotes a column name, since 'user', 'key' and 'type' are sql keywords"""
+
+    return '"{0}"'.format(name)
+
+
+def create_table_sql(table, fields, primary_key=None):
+    """This function returns the CREATE TABLE statement for a table of shaped rows"""
+
+    columns = []
+    for field in fields:
+        column = '{0} {1}'.format(quote(field), COLUMN_TYPES[field])
+        if field == primary_key:
+            column += ' PRIMARY KEY NOT NULL'
+        columns.append(column)
+    return 'CREATE TABLE {0} ({1})'.format(table, ', '.join(columns))
+
+
+def open_database(db_path, tables):
+    """This function creates empty tables in the database at db_path and returns the
+    connection together with a dictionary of SqliteTableWriter per shaped element key.
+
+    tables is a list of (element key, table name, fields, primary key, indexed fields)."""
+
+    connection = sqlite3.connect(db_path, isolation_level='DEFERRED')
+    for pragma in LOAD_PRAGMAS:
+        connection.execute(pragma)
+
+    writers = {}
+    for key, table, fields, primary_key, _ in tables:
+        connection.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        connection.execute(create_table_sql(table, fields, primary_key))
+        writers[key] = SqliteTableWriter(connection, table, fields)
+
+    return connection, writers
+
+
+def create_indexes(connection, tables):
+    """This function indexes the fields listed for each table"""
+
+    for _, table, _, _, indexed_fields in tables:
+        for field in indexed_fields:
+            connection.execute('CREATE INDEX IF NOT EXISTS {0}_{1}_idx ON {0} ({2})'.format(
+                table, field, quote(field)))
+
+
+def close_database(connection, writers, tables):
+    """This function flushes the remaining rows, commits the load, builds the indexes
+    and restores the default pragmas before closing the connection"""
+
+    for writer in writers.itervalues():
+        writer.flush()
+    connection.commit()
+
+    # building the indexes once after the load is much cheaper than keeping them
+    # up to date row by row
+    create_indexes(connection, tables)
+    connection.commit()
+
+    for pragma in FINISH_PRAGMAS:
+        connection.execute(pragma)
+    connection.close()
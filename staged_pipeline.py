@@ -0,0 +1,183 @@
+# threads connected by bounded queues, with queue depth and stage utilization counters
+
+import sys
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+# how often a blocked put or get checks whether another stage failed
+POLL_SECONDS = 0.1
+
+# marks the end of the items on a queue
+DONE = object()
+
+
+class Aborted(Exception):
+    """Raised inside a stage when another stage has failed"""
+
+
+class StageQueue(object):
+    """Bounded queue that records how full it was at every put"""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.queue = Queue(maxsize)
+        self.puts = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def record_depth(self):
+        depth = self.queue.qsize()
+        self.puts += 1
+        self.depth_total += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def report(self):
+        return {
+            'capacity': self.maxsize,
+            'puts': self.puts,
+            'max_depth': self.max_depth,
+            'mean_depth': float(self.depth_total) / self.puts if self.puts else 0.0
+        }
+
+
+class Stage(object):
+    """Thread running target(stage, *args), which tells busy time from time spent blocked
+    on the queues of the pipeline"""
+
+    def __init__(self, pipeline, name, target, args):
+        self.pipeline = pipeline
+        self.name = name
+        self.items = 0
+        self.wait_seconds = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.thread = threading.Thread(target=self.run, args=(target, args), name=name)
+        self.thread.daemon = True
+
+    def run(self, target, args):
+        self.start_time = time.time()
+        try:
+            target(self, *args)
+        except Aborted:
+            pass
+        except BaseException:
+            self.pipeline.fail(sys.exc_info())
+        finally:
+            self.end_time = time.time()
+
+    def report(self):
+        seconds = (self.end_time or time.time()) - (self.start_time or time.time())
+        busy = max(seconds - self.wait_seconds, 0.0)
+        return {
+            'items': self.items,
+            'seconds': seconds,
+            'busy_seconds': busy,
+            'wait_seconds': self.wait_seconds,
+            'utilization': busy / seconds if seconds else 0.0
+        }
+
+
+class StagedPipeline(object):
+    """Set of stages, each a thread, passing items through bounded queues.
+
+    A full queue blocks the stage putting into it, which holds back every stage upstream,
+    so memory stays capped at the queue sizes. The first exception in a stage aborts the
+    others and is raised again by join. report() gives the depth of every queue and the
+    share of its time every stage spent working rather than waiting."""
+
+    def __init__(self):
+        self.queues = []
+        self.stages = []
+        self.error = None
+        self.aborted = threading.Event()
+
+    def queue(self, name, maxsize):
+        stage_queue = StageQueue(name, maxsize)
+        self.queues.append(stage_queue)
+        return stage_queue
+
+    def stage(self, name, target, *args):
+        """This function adds a stage that runs target(stage, *args) once start is called"""
+
+        stage = Stage(self, name, target, args)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.thread.start()
+
+    def fail(self, exc_info):
+        if self.error is None:
+            self.error = exc_info
+        self.aborted.set()
+
+    def put(self, stage, stage_queue, item):
+        """This function puts item on stage_queue, blocking while it is full"""
+
+        stage_queue.record_depth()
+        try:
+            stage_queue.queue.put_nowait(item)
+            return
+        except Full:
+            pass
+        # timed waits, so a stage blocked here notices when another one failed
+        start = time.time()
+        while True:
+            if self.aborted.is_set():
+                raise Aborted()
+            try:
+                stage_queue.queue.put(item, timeout=POLL_SECONDS)
+                break
+            except Full:
+                pass
+        stage.wait_seconds += time.time() - start
+
+    def get(self, stage, stage_queue):
+        """This function takes the next item off stage_queue, blocking while it is empty"""
+
+        try:
+            return stage_queue.queue.get_nowait()
+        except Empty:
+            pass
+        start = time.time()
+        while True:
+            if self.aborted.is_set():
+                raise Aborted()
+            try:
+                item = stage_queue.queue.get(timeout=POLL_SECONDS)
+                break
+            except Empty:
+                pass
+        stage.wait_seconds += time.time() - start
+        return item
+
+    def iter_queue(self, stage, stage_queue, producers=1):
+        """This function yields the items of stage_queue until producers DONE markers
+        have arrived, counting them as items of stage"""
+
+        while producers:
+            item = self.get(stage, stage_queue)
+            if item is DONE:
+                producers -= 1
+            else:
+                stage.items += 1
+                yield item
+
+    def join(self):
+        """This function waits for every stage and raises the first error of any of them"""
+
+        for stage in self.stages:
+            while stage.thread.is_alive():
+                stage.thread.join(POLL_SECONDS)
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def report(self):
+        return {
+            'stages': dict((stage.name, stage.report()) for stage in self.stages),
+            'queues': dict((stage_queue.name, stage_queue.report()) for stage_queue in self.queues)
+        }
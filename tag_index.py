@@ -0,0 +1,183 @@
+# inverted index of the tag tables with compressed posting lists and value counts
+
+import argparse
+import json
+from array import array
+
+TAG_INDEX_PATH = "boston_massachusetts.tags"
+
+KINDS = ('node', 'way', 'relation')
+
+
+def encode_ids(ids):
+    """This function delta encodes a sorted list of ids as varints"""
+
+    out = bytearray()
+    previous = 0
+    for element_id in ids:
+        delta = element_id - previous
+        previous = element_id
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_ids(data):
+    """This function reverses encode_ids"""
+
+    ids = []
+    previous = 0
+    delta = 0
+    shift = 0
+    for byte in bytearray(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += delta
+            ids.append(previous)
+            delta = 0
+            shift = 0
+    return ids
+
+
+def split_key(osm_key):
+    """This function splits an osm key into the (type, key) pair used by the tag tables,
+    the same way shape_tags does"""
+
+    parts = osm_key.split(':')
+    if len(parts) == 1:
+        return 'regular', osm_key
+    return parts[0], ':'.join(parts[-2:]) if len(parts) > 2 else parts[1]
+
+
+class TagIndexBuilder(object):
+    """Collector for process_map that records the id of every element carrying each
+    (type, key, value) of the tag records, and writes the index to path on close.
+
+    Ids are kept in one array per (type, key, value, kind) that is created when the first
+    element of that kind carries the tag, so most distinct values, which only occur once,
+    cost a single small array. The ids are sorted, deduplicated and varint encoded only
+    when the index is written."""
+
+    def __init__(self, path=TAG_INDEX_PATH):
+        self.path = path
+        self.postings = {}
+
+    def add(self, kind, el):
+        postings = self.postings
+        for tag in el[kind + '_tags']:
+            key = (tag.type, tag.key, tag.value, kind)
+            ids = postings.get(key)
+            if ids is None:
+                ids = postings[key] = array('l')
+            ids.append(int(tag.id))
+
+    def close(self):
+        """This function writes a json directory line followed by the encoded posting lists.
+
+        The directory maps type -> key -> value -> kind -> [offset, length, count]."""
+
+        directory = {}
+        blocks = []
+        offset = 0
+        for (tag_type, key, value, kind), ids in sorted(self.postings.iteritems()):
+            entry = directory.setdefault(tag_type, {}).setdefault(key, {}).setdefault(value, {})
+            ids = sorted(set(ids))
+            block = encode_ids(ids)
+            entry[kind] = [offset, len(block), len(ids)]
+            blocks.append(block)
+            offset += len(block)
+
+        with open(self.path, 'wb') as index_file:
+            index_file.write(json.dumps(directory) + '\n')
+            for block in blocks:
+                index_file.write(block)
+        self.postings = {}
+
+
+class TagIndex(object):
+    """Read only view of an index written by TagIndexBuilder.
+
+    Keys are given as osm keys such as 'addr:postcode' and split into the type and key of
+    the tag tables. kind limits a lookup to 'node', 'way' or 'relation'."""
+
+    def __init__(self, path=TAG_INDEX_PATH):
+        self.file = open(path, 'rb')
+        self.directory = json.loads(self.file.readline())
+        self.start = self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def values(self, osm_key):
+        tag_type, key = split_key(osm_key)
+        return self.directory.get(tag_type, {}).get(key, {})
+
+    def keys(self):
+        """This function returns every osm key in the index"""
+
+        return sorted(key if tag_type == 'regular' else '{0}:{1}'.format(tag_type, key)
+                      for tag_type, keys in self.directory.iteritems() for key in keys)
+
+    def ids(self, osm_key, value, kind=None):
+        """This function returns the sorted ids of the elements tagged osm_key=value"""
+
+        entry = self.values(osm_key).get(value, {})
+        ids = []
+        for name in KINDS if kind is None else (kind,):
+            if name in entry:
+                offset, length, _ = entry[name]
+                self.file.seek(self.start + offset)
+                ids.extend(decode_ids(self.file.read(length)))
+        return ids if kind is not None else sorted(ids)
+
+    def count(self, osm_key, value=None, kind=None):
+        """This function returns how many elements carry osm_key=value, or osm_key with any
+        value, without decoding any posting list"""
+
+        values = self.values(osm_key)
+        entries = values.itervalues() if value is None else [values.get(value, {})]
+        return sum(posting[2] for entry in entries
+                   for name, posting in entry.iteritems() if kind is None or name == kind)
+
+    def histogram(self, osm_key, kind=None):
+        """This function returns (value, count) pairs for osm_key, most common first"""
+
+        histogram = []
+        for value, entry in self.values(osm_key).iteritems():
+            count = sum(posting[2] for name, posting in entry.iteritems() if kind is None or name == kind)
+            if count:
+                histogram.append((value, count))
+        return sorted(histogram, key=lambda pair: (-pair[1], pair[0]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the tag index written by process_map")
+    parser.add_argument('--index', default=TAG_INDEX_PATH)
+    parser.add_argument('--kind', choices=KINDS)
+    parser.add_argument('--ids', metavar='KEY=VALUE', help="print the ids carrying a tag")
+    parser.add_argument('--histogram', metavar='KEY', help="print the value counts of a key")
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    index = TagIndex(args.index)
+    try:
+        if args.ids:
+            key, _, value = args.ids.partition('=')
+            for element_id in index.ids(key, value.decode('utf-8'), args.kind):
+                print element_id
+        if args.histogram:
+            for value, count in index.histogram(args.histogram, args.kind)[:args.top]:
+                print u"{0}\t{1}".format(count, value).encode('utf-8')
+        if not args.ids and not args.histogram:
+            for key in index.keys():
+                print key.encode('utf-8')
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# small osm files and working directories for the tests
+
+import os
+import shutil
+import tempfile
+import unittest
+from xml.sax.saxutils import quoteattr
+
+import benchmark
+
+
+def write_osm(path, nodes=(), ways=(), relations=()):
+    """This function writes an osm file from lists of
+    nodes      (id, lat, lon, tags)
+    ways       (id, node ids, tags)
+    relations  (id, [(type, ref, role)], tags)
+    where tags is a list of (k, v) pairs."""
+
+    with open(path, 'w') as osm_file:
+        osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for node_id, lat, lon, tags in nodes:
+            osm_file.write(' <node id="{0}" lat="{1:.7f}" lon="{2:.7f}" {3}>\n'.format(
+                node_id, lat, lon, attributes(node_id)))
+            write_tags(osm_file, tags)
+            osm_file.write(' </node>\n')
+        for way_id, refs, tags in ways:
+            osm_file.write(' <way id="{0}" {1}>\n'.format(way_id, attributes(way_id)))
+            for ref in refs:
+                osm_file.write('  <nd ref="{0}"/>\n'.format(ref))
+            write_tags(osm_file, tags)
+            osm_file.write(' </way>\n')
+        for relation_id, members, tags in relations:
+            osm_file.write(' <relation id="{0}" {1}>\n'.format(relation_id, attributes(relation_id)))
+            for member_type, ref, role in members:
+                osm_file.write('  <member type="{0}" ref="{1}" role="{2}"/>\n'.format(member_type, ref, role))
+            write_tags(osm_file, tags)
+            osm_file.write(' </relation>\n')
+        osm_file.write('</osm>\n')
+
+
+def attributes(element_id, version=1, timestamp="2016-01-01T12:00:00Z"):
+    return 'version="{0}" timestamp="{1}" changeset="{2}" uid="{3}" user="user{3}"'.format(
+        version, timestamp, 1000 + element_id, element_id % 7)
+
+
+def write_tags(osm_file, tags):
+    for key, value in tags:
+        osm_file.write('  <tag k={0} v={1}/>\n'.format(quoteattr(key), quoteattr(value)))
+
+
+def generate_osm(path, nodes=2000, ways=300, relations=40, seed=0):
+    """This function writes a synthetic osm file, see benchmark.generate_osm"""
+
+    benchmark.generate_osm(path, nodes=nodes, ways=ways, relations=relations, seed=seed)
+    return path
+
+
+class WorkDirTestCase(unittest.TestCase):
+    """Test case that runs in its own temporary directory, since process_map writes its
+    outputs to the working directory"""
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.work_dir)
+
+    def read(self, path):
+        with open(path, 'rb') as read_file:
+            return read_file.read()
+
+    def outputs(self, directory='.'):
+        """This function returns the content of every csv in directory by name"""
+
+        return dict((name, self.read(os.path.join(directory, name)))
+                    for name in sorted(os.listdir(directory)) if name.endswith('.csv'))
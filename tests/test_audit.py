@@ -0,0 +1,60 @@
+import os
+import unittest
+from collections import OrderedDict, defaultdict
+
+import audit
+import audit_postcode
+import audit_street_name
+import audit_tag
+import audit_tourism
+from tests.fixtures import WorkDirTestCase, generate_osm, write_osm
+
+# tags of every category of the audits, added to a generated map
+TAGS = [('addr:street', 'Main St'), ('addr:street', 'Tremont Street'), ('addr:street_1', 'Boylston Ave.'),
+        ('addr:postcode', '02116'), ('addr:postcode', 'MA 02116'), ('addr:postcode', '02116'),
+        ('tourism', 'museum'), ('tourism', 'hotel'), ('tourism', 'museum'),
+        ('name', 'Fenway'), ('name:en', 'Fenway'), ('Name', 'Fenway'), ('fixme?', 'check'), ('.note', 'x')]
+
+
+class AuditMapTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(AuditMapTest, self).setUp()
+        # a node for each tag, and one with all of them
+        nodes = [(node_id, 42.3, -71.1, [tag]) for node_id, tag in enumerate(TAGS, 1)]
+        write_osm('tags.osm', nodes + [(100, 42.3, -71.1, TAGS)])
+        self.paths = ['tags.osm', generate_osm(os.path.abspath('map.osm'), nodes=1500, ways=200)]
+
+    def test_matches_the_audit_scripts(self):
+        for path in self.paths:
+            reports = audit.audit_map(path)
+            self.assertEqual(list(reports), ['tag', 'street', 'postcode', 'tourism'])
+            self.assertEqual(reports['tag'], audit_tag.process_map(path))
+            self.assertEqual(reports['street'], audit_street_name.audit_street(path))
+            self.assertEqual(reports['postcode'], audit_postcode.audit_postcode(path))
+            self.assertEqual(reports['tourism'], audit_tourism.audit_tourism(path))
+
+        reports = audit.audit_map('tags.osm')
+        self.assertEqual(set(reports['street']), set(['St', 'Ave.']))
+        self.assertEqual(dict(reports['postcode']), {'02116': 4, 'MA 02116': 2})
+        self.assertEqual(sorted(key for key, (count, _) in reports['tag'].iteritems() if count),
+                         ['lower', 'lower_colon', 'other', 'problemchars'])
+
+    def test_register_auditor(self):
+        auditors = OrderedDict(audit.AUDITORS)
+
+        def name_auditor(report, tag):
+            if tag.attrib['k'] == 'name':
+                report[tag.attrib['v']] += 1
+
+        audit.register_auditor('names', lambda: defaultdict(int), name_auditor, auditors)
+        self.assertNotIn('names', audit.AUDITORS)
+
+        reports = audit.audit_map('tags.osm', auditors)
+        self.assertEqual(list(reports), ['tag', 'street', 'postcode', 'tourism', 'names'])
+        self.assertEqual(dict(reports['names']), {'Fenway': 2})
+        self.assertEqual(reports['tourism'], audit.audit_map('tags.osm')['tourism'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+from collections import OrderedDict, defaultdict
+from functools import partial
+
+import audit
+import audit_cache
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+
+def new_count_report():
+    return defaultdict(int)
+
+
+def key_counter(key):
+    """This function returns an auditor counting the values of key"""
+
+    def auditor(report, tag):
+        if tag.attrib["k"] == key:
+            report[tag.attrib["v"]] += 1
+    return auditor
+
+
+def count_key(key, report, tag):
+    if tag.attrib["k"] == key:
+        report[tag.attrib["v"]] += 1
+
+
+class CountKey(object):
+
+    def __init__(self, key):
+        self.key = key
+
+    def __call__(self, report, tag):
+        count_key(self.key, report, tag)
+
+
+class AuditCacheTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(AuditCacheTest, self).setUp()
+        generate_osm('map.osm', nodes=1500, ways=200)
+
+    def audit(self, auditor):
+        auditors = OrderedDict([("counts", (new_count_report, auditor))])
+        return dict(audit_cache.cached_audit_map('map.osm', auditors=auditors, cache_dir='cache')["counts"])
+
+    def reports(self):
+        return [name for name in os.listdir('cache') if name.endswith('.report')]
+
+    def test_matches_audit_map(self):
+        expected = audit.audit_map('map.osm')
+        self.assertEqual(audit_cache.cached_audit_map('map.osm', cache_dir='cache'), expected)
+        # the second call is served from the cache
+        self.assertEqual(audit_cache.cached_audit_map('map.osm', cache_dir='cache'), expected)
+        self.assertEqual(len(self.reports()), len(audit.AUDITORS))
+
+    def test_factory_arguments_are_part_of_the_key(self):
+        amenity = self.audit(key_counter('amenity'))
+        highway = self.audit(key_counter('highway'))
+        self.assertIn('cafe', amenity)
+        self.assertIn('residential', highway)
+        self.assertNotIn('cafe', highway)
+
+    def test_partial_arguments_are_part_of_the_key(self):
+        self.assertIn('cafe', self.audit(partial(count_key, 'amenity')))
+        self.assertIn('residential', self.audit(partial(count_key, 'highway')))
+
+    def test_unfingerprintable_auditor_is_not_cached(self):
+        self.assertIsNone(audit_cache.auditor_fingerprint(new_count_report, CountKey('amenity')))
+        self.assertIn('cafe', self.audit(CountKey('amenity')))
+        self.assertIn('residential', self.audit(CountKey('highway')))
+        self.assertEqual(self.reports(), [])
+
+    def test_defaults_are_part_of_the_key(self):
+        def first(report, tag, key='amenity'):
+            count_key(key, report, tag)
+
+        def second(report, tag, key='highway'):
+            count_key(key, report, tag)
+
+        self.assertNotEqual(audit_cache.auditor_fingerprint(new_count_report, first),
+                            audit_cache.auditor_fingerprint(new_count_report, second))
+
+    def test_new_auditor_is_replayed_from_the_summary(self):
+        audit_cache.cached_audit_map('map.osm', cache_dir='cache')
+        scan = audit_cache.scan
+
+        def no_scan(filename, missing):
+            raise AssertionError("the file was scanned again")
+
+        audit_cache.scan = no_scan
+        try:
+            amenity = self.audit(key_counter('amenity'))
+        finally:
+            audit_cache.scan = scan
+        auditors = OrderedDict([("counts", (new_count_report, key_counter('amenity')))])
+        self.assertEqual(amenity, dict(audit.audit_map('map.osm', auditors)["counts"]))
+
+    def test_changed_file_is_scanned_again(self):
+        before = self.audit(key_counter('amenity'))
+        generate_osm('map.osm', nodes=300, ways=20, seed=1)
+        after = self.audit(key_counter('amenity'))
+        auditors = OrderedDict([("counts", (new_count_report, key_counter('amenity')))])
+        self.assertEqual(after, dict(audit.audit_map('map.osm', auditors)["counts"]))
+        self.assertNotEqual(after, before)
+        self.assertEqual(len(self.reports()), 2)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import os
+
+import benchmark
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+ARGV = ['--nodes', '1500', '--ways', '200', '--relations', '30']
+
+
+class BenchmarkTest(WorkDirTestCase):
+
+    def test_generated_relations(self):
+        generate_osm('with.osm', nodes=300, ways=40, relations=10)
+        generate_osm('without.osm', nodes=300, ways=40, relations=0)
+        with_relations, without_relations = self.read('with.osm'), self.read('without.osm')
+        self.assertEqual(with_relations.count('<relation '), 10)
+        # the nodes and ways do not depend on the number of relations
+        self.assertEqual(with_relations[:with_relations.index(' <relation ')], without_relations[:-len('</osm>\n')])
+
+    def test_run_pipeline_measures_process_map(self):
+        osm_path = generate_osm(os.path.abspath('map.osm'), nodes=1500, ways=200, relations=30)
+        os.mkdir('out')
+        results = benchmark.run_pipeline(osm_path, os.path.abspath('out'), collectors=['rollups'],
+                                         output='sqlite', geometry=True)
+        self.assertEqual(results['element_counts'], {'node': 1500, 'way': 200, 'relation': 30})
+        self.assertEqual(sorted(results['stages']), ['parse', 'shape', 'validate', 'write'])
+        self.assertEqual(sorted(os.listdir('out')), ['boston_massachusetts.db', 'rollups.json'])
+
+    def test_staged_pipeline_report(self):
+        osm_path = generate_osm(os.path.abspath('map.osm'), nodes=1500, ways=200, relations=30)
+        os.mkdir('out')
+        results = benchmark.run_pipeline(osm_path, os.path.abspath('out'), staged=True, workers=2)
+        self.assertEqual(results['elements'], 1730)
+        self.assertIn('shape1', results['pipeline']['stages'])
+
+    def test_baseline(self):
+        self.assertEqual(benchmark.main(ARGV), 2)
+        self.assertEqual(benchmark.main(ARGV + ['--save-baseline']), 0)
+        self.assertEqual(benchmark.main(ARGV + ['--tolerance', '0.99']), 0)
+
+        with open(benchmark.BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline['elements_per_sec'] *= 100
+        with open(benchmark.BASELINE_PATH, 'w') as baseline_file:
+            json.dump(baseline, baseline_file)
+        self.assertEqual(benchmark.main(ARGV), 1)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,56 @@
+import gzip
+import os
+import shutil
+
+import data
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+
+class MainCheckpointTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(MainCheckpointTest, self).setUp()
+        generate_osm('map.osm')
+        with open('map.osm', 'rb') as osm_file:
+            compressed = gzip.open('map.osm.gz', 'wb')
+            shutil.copyfileobj(osm_file, compressed)
+            compressed.close()
+
+    def convert(self, directory, *argv):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.main(list(argv))
+            return self.outputs()
+        finally:
+            os.chdir(self.work_dir)
+
+    def test_compressed_input_is_converted_without_checkpoints(self):
+        expected = self.convert('plain', '../map.osm')
+        self.assertTrue(os.path.exists(os.path.join('plain', data.checkpoint.CHECKPOINT_PATH)))
+        self.assertEqual(self.convert('gzip', '../map.osm.gz'), expected)
+        self.assertFalse(os.path.exists(os.path.join('gzip', data.checkpoint.CHECKPOINT_PATH)))
+
+    def test_no_checkpoint(self):
+        expected = self.convert('plain', '../map.osm')
+        self.assertEqual(self.convert('once', '../map.osm', '--no-checkpoint'), expected)
+        self.assertFalse(os.path.exists(os.path.join('once', data.checkpoint.CHECKPOINT_PATH)))
+
+    def test_resume_needs_checkpoints(self):
+        self.assertRaises(SystemExit, self.convert, 'gzip', '../map.osm.gz', '--resume')
+
+    def test_collectors_and_geometry_convert_without_checkpoints(self):
+        expected = self.convert('plain', '../map.osm')
+        outputs = self.convert('collected', '../map.osm', '--rollups', '--tag-index', 'map.tags', '--geometry')
+        self.assertIn('ways_geometry.csv', outputs)
+        del outputs['ways_geometry.csv']
+        self.assertEqual(outputs, expected)
+        self.assertTrue(os.path.exists(os.path.join('collected', data.ROLLUPS_PATH)))
+        self.assertTrue(os.path.exists(os.path.join('collected', 'map.tags')))
+        self.assertFalse(os.path.exists(os.path.join('collected', data.checkpoint.CHECKPOINT_PATH)))
+        self.assertRaises(SystemExit, self.convert, 'resumed', '../map.osm', '--rollups', '--resume')
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
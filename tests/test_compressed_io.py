@@ -0,0 +1,133 @@
+import bz2
+import gzip
+import os
+import subprocess
+import unittest
+
+import compressed_io
+import data
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+# command that writes each format, for the formats it can be tested with here
+COMPRESS_COMMANDS = {'gzip': ['gzip', '-c'], 'bz2': ['bzip2', '-c'], 'zstd': ['zstd', '-cq'], 'xz': ['xz', '-c']}
+AVAILABLE = dict((compression, command) for compression, command in COMPRESS_COMMANDS.iteritems()
+                 if compressed_io.find_command([command]))
+
+
+def compress(path, compression):
+    compressed_path = path + compressed_io.EXTENSIONS[compression]
+    with open(compressed_path, 'wb') as out_file:
+        subprocess.check_call(AVAILABLE[compression] + [path], stdout=out_file)
+    return compressed_path
+
+
+def decompress(path, compression):
+    if compression == 'gzip':
+        with gzip.open(path, 'rb') as gzip_file:
+            return gzip_file.read()
+    return subprocess.check_output(compressed_io.DECOMPRESS_COMMANDS[compression][-1] + [path])
+
+
+class CompressedIoTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(CompressedIoTest, self).setUp()
+        self.osm_path = generate_osm(os.path.abspath('map.osm'), nodes=2000, ways=300, relations=40)
+        self.plain = self.convert('plain', self.osm_path)
+        self.find_command = compressed_io.find_command
+
+    def tearDown(self):
+        compressed_io.find_command = self.find_command
+        super(CompressedIoTest, self).tearDown()
+
+    def convert(self, directory, path, **options):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.process_map(path, validate=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+        return self.outputs(directory)
+
+    def without_commands(self):
+        """Makes compressed_io fall back to the in-process readers and writers"""
+
+        compressed_io.find_command = lambda commands: None
+
+    def test_detect_compression(self):
+        self.assertIsNone(compressed_io.detect_compression(self.osm_path))
+        for compression in AVAILABLE:
+            self.assertEqual(compressed_io.detect_compression(compress(self.osm_path, compression)), compression)
+
+    def test_input(self):
+        with open(self.osm_path, 'rb') as osm_file:
+            text = osm_file.read()
+        for compression in sorted(AVAILABLE):
+            path = compress(self.osm_path, compression)
+            self.assertEqual(self.convert(compression, path), self.plain, compression)
+
+            osm_file = compressed_io.open_input(path)
+            self.assertIsInstance(osm_file, compressed_io.PipeReader)
+            self.assertEqual(osm_file.read(), text)
+            osm_file.close()
+
+    def test_threaded_input(self):
+        self.without_commands()
+        with open(self.osm_path, 'rb') as osm_file:
+            text = osm_file.read()
+        with gzip.open('map.osm.gz', 'wb') as gzip_file:
+            gzip_file.write(text)
+        bz2_file = bz2.BZ2File('map.osm.bz2', 'wb')
+        bz2_file.write(text)
+        bz2_file.close()
+
+        for compression in ('gzip', 'bz2'):
+            path = self.osm_path + compressed_io.EXTENSIONS[compression]
+            osm_file = compressed_io.open_input(path)
+            self.assertIsInstance(osm_file, compressed_io.ThreadedReader)
+            self.assertEqual(osm_file.read(1000) + osm_file.read(), text)
+            osm_file.close()
+            self.assertEqual(self.convert(compression, path), self.plain, compression)
+
+    def check_outputs(self, directory, compression):
+        names = sorted(os.listdir(directory))
+        self.assertEqual(names, sorted(name + compressed_io.EXTENSIONS[compression] for name in self.plain))
+        for name, content in self.plain.iteritems():
+            path = os.path.join(directory, name + compressed_io.EXTENSIONS[compression])
+            self.assertEqual(decompress(path, compression), content, name)
+
+    def test_output(self):
+        for compression in compressed_io.OUTPUT_COMPRESSIONS:
+            if compression not in AVAILABLE:
+                continue
+            directory = 'out_' + compression
+            self.convert(directory, self.osm_path, compression=compression)
+            self.check_outputs(directory, compression)
+
+            # the parallel parts are concatenated as gzip members or zstd frames
+            directory = 'parallel_' + compression
+            self.convert(directory, self.osm_path, compression=compression, processes=2)
+            self.check_outputs(directory, compression)
+
+    def test_pipe_writer(self):
+        for compression in compressed_io.OUTPUT_COMPRESSIONS:
+            if compression in AVAILABLE:
+                out_file = compressed_io.open_output('out.csv' + compressed_io.EXTENSIONS[compression], compression)
+                self.assertIsInstance(out_file, compressed_io.PipeWriter)
+                out_file.close()
+
+    def test_buffered_writer(self):
+        self.without_commands()
+        out_file = compressed_io.open_output('out.csv.gz', 'gzip')
+        self.assertIsInstance(out_file, compressed_io.BufferedWriter)
+        out_file.close()
+
+        self.convert('buffered', self.osm_path, compression='gzip')
+        self.check_outputs('buffered', 'gzip')
+
+    def test_unknown_output_compression(self):
+        self.assertRaises(ValueError, compressed_io.open_output, 'out.csv.bz2', 'bz2')
+
+
+if __name__ == '__main__':
+    unittest.main()
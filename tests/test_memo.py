@@ -0,0 +1,41 @@
+import threading
+import unittest
+
+from memo import lru_cache
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        calls = []
+        square = lru_cache(2)(lambda x: calls.append(x) or x * x)
+        self.assertEqual([square(1), square(2), square(1), square(3), square(1), square(2)], [1, 4, 1, 9, 1, 4])
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(square.cache_info().currsize, 2)
+
+    def test_shared_between_threads(self):
+        maxsize = 64
+        identity = lru_cache(maxsize)(lambda x: x)
+        errors = []
+
+        def hammer(offset):
+            try:
+                for value in xrange(20000):
+                    self.assertEqual(identity((value * 7 + offset) % 5000), (value * 7 + offset) % 5000)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=hammer, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        info = identity.cache_info()
+        self.assertLessEqual(info.currsize, maxsize)
+        self.assertEqual(info.hits + info.misses, 80000)
+
+
+if __name__ == '__main__':
+    unittest.main()
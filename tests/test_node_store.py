@@ -0,0 +1,105 @@
+import os
+import random
+
+from node_store import MappedNodeLocationStore, NodeLocationStore, StoreFrozen
+from tests.fixtures import WorkDirTestCase
+
+
+def locations(node_ids, seed=0):
+    rng = random.Random(seed)
+    return [(node_id, round(rng.uniform(-90, 90), 7), round(rng.uniform(-180, 180), 7)) for node_id in node_ids]
+
+
+class NodeStoreTest(WorkDirTestCase):
+
+    def check_stores(self, nodes, probes):
+        memory = NodeLocationStore()
+        mapped = MappedNodeLocationStore('nodes.bin')
+        for node_id, lat, lon in nodes:
+            memory.add(node_id, lat, lon)
+            mapped.add(node_id, lat, lon)
+        try:
+            for node_id, lat, lon in nodes:
+                self.assertEqual(mapped.get(node_id), (lat, lon))
+            for node_id in probes:
+                self.assertEqual(mapped.get(node_id), memory.get(node_id))
+            self.assertEqual(len(mapped), len(nodes))
+            return mapped
+        finally:
+            mapped.close()
+
+    def test_dense_ids(self):
+        nodes = locations(xrange(1000, 3000))
+        mapped = self.check_stores(nodes, [0, 999, 3000, 10 ** 9])
+        self.assertTrue(mapped.dense)
+
+    def test_sparse_ids(self):
+        nodes = locations(xrange(10 ** 9, 10 ** 9 + 3000 * 2000, 3000))
+        mapped = self.check_stores(nodes, [1, 10 ** 9 + 1, 10 ** 9 + 3000 * 2000])
+        self.assertFalse(mapped.dense)
+
+    def test_unsorted_ids_are_sorted_in_runs(self):
+        node_ids = range(5, 500000, 97)
+        random.Random(1).shuffle(node_ids)
+        MappedNodeLocationStore.SORT_RUN, sort_run = 700, MappedNodeLocationStore.SORT_RUN
+        try:
+            self.check_stores(locations(node_ids), [4, 6, 500001])
+        finally:
+            MappedNodeLocationStore.SORT_RUN = sort_run
+        self.assertEqual(sorted(os.listdir('.')), [])
+
+    def test_disk_follows_the_number_of_nodes(self):
+        store = MappedNodeLocationStore('nodes.bin', keep=True)
+        for node_id, lat, lon in locations(xrange(3000, 3000 * 20001, 3000)):
+            store.add(node_id, lat, lon)
+        store.freeze()
+        store.close()
+        self.assertLessEqual(os.stat('nodes.bin').st_blocks * 512, 20000 * 16 + 64 * 1024)
+
+    def test_add_after_read(self):
+        for store in (MappedNodeLocationStore('nodes.bin'), NodeLocationStore()):
+            store.add(1, 0.0, 0.0)
+            self.assertEqual(store.get(1), (0.0, 0.0))
+            self.assertRaises(StoreFrozen, store.add, 2, 0.0, 0.0)
+            store.close()
+        self.assertFalse(os.path.exists('nodes.bin'))
+
+    def check_memory_store(self, nodes, probes):
+        store = NodeLocationStore()
+        for node_id, lat, lon in nodes:
+            store.add(node_id, lat, lon)
+        for node_id, lat, lon in nodes:
+            self.assertEqual(store.get(node_id), (lat, lon))
+        for node_id in probes:
+            self.assertIsNone(store.get(node_id))
+        self.assertEqual(len(store), len(nodes))
+        return store
+
+    def test_memory_store_blocks(self):
+        # runs of close ids with gaps, as in an extract, and ids more than 65536 apart
+        node_ids = [base + step * 7 for base in xrange(10 ** 9, 10 ** 9 + 50 * 10 ** 6, 10 ** 6) for step in xrange(400)]
+        node_ids += range(2 * 10 ** 9, 2 * 10 ** 9 + 100 * 70000, 70000)
+        store = self.check_memory_store(locations(node_ids), [1, 10 ** 9 + 1, 10 ** 9 + 2800, 2 * 10 ** 9 + 65536])
+        self.assertIsNone(store.dense)
+        self.assertEqual(store.nbytes(), len(node_ids) * 10 + 150 * 12)
+
+    def test_memory_store_dense(self):
+        store = self.check_memory_store(locations(xrange(1000, 3000)), [999, 3000, 10 ** 6])
+        self.assertIsNotNone(store.dense)
+        self.assertEqual(len(store.dense) * store.dense.itemsize, 2000 * 8)
+
+    def test_memory_store_sorts_unsorted_ids_in_runs(self):
+        node_ids = range(5, 500000, 97) + range(10 ** 9, 10 ** 9 + 300 * 70000, 70000)
+        random.Random(1).shuffle(node_ids)
+        NodeLocationStore.SORT_RUN, sort_run = 700, NodeLocationStore.SORT_RUN
+        try:
+            store = self.check_memory_store(locations(node_ids), [4, 6, 500001, 10 ** 9 + 1])
+        finally:
+            NodeLocationStore.SORT_RUN = sort_run
+        self.assertIsNone(store.ids)
+        self.assertEqual(list(store.iter_ids()), sorted(node_ids))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
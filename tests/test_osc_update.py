@@ -0,0 +1,133 @@
+import os
+import sqlite3
+
+import osc_update
+from data import process_map
+from tests.fixtures import WorkDirTestCase, write_osm
+
+OSC_START = '<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6">\n'
+
+
+def write_osc(path, action, way_id, version, refs=(), tags=()):
+    """This function writes an osmChange file with a single action on a way"""
+
+    with open(path, 'w') as osc_file:
+        osc_file.write(OSC_START)
+        osc_file.write(' <{0}>\n  <way id="{1}" version="{2}" timestamp="2017-01-0{2}T00:00:00Z" '
+                       'changeset="{3}" uid="1" user="user1">\n'.format(action, way_id, version, 5000 + version))
+        for ref in refs:
+            osc_file.write('   <nd ref="{0}"/>\n'.format(ref))
+        for key, value in tags:
+            osc_file.write('   <tag k="{0}" v="{1}"/>\n'.format(key, value))
+        osc_file.write('  </way>\n </{0}>\n</osmChange>\n'.format(action))
+
+
+class ApplyChangesTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(ApplyChangesTest, self).setUp()
+        write_osm('map.osm',
+                  nodes=[(1, 42.0, -71.0, []), (2, 42.001, -71.001, []), (3, 42.002, -71.002, [])],
+                  ways=[(4, [1, 2], [('highway', 'residential')])])
+        process_map('map.osm', validate=False, output='sqlite', db_path='map.db')
+        write_osc('old.osc', 'modify', 4, 7, refs=[1, 2, 3], tags=[('highway', 'primary')])
+        write_osc('new.osc', 'delete', 4, 8)
+
+    def way_versions(self):
+        connection = sqlite3.connect('map.db')
+        try:
+            return connection.execute('SELECT id, CAST(version AS INTEGER) FROM ways').fetchall()
+        finally:
+            connection.close()
+
+    def test_older_change_does_not_undo_a_delete(self):
+        self.assertEqual(osc_update.apply_changes('old.osc', 'map.db')['modified'], 1)
+        self.assertEqual(self.way_versions(), [(4, 7)])
+        self.assertEqual(osc_update.apply_changes('new.osc', 'map.db')['deleted'], 1)
+        self.assertEqual(self.way_versions(), [])
+
+        counts = osc_update.apply_changes('old.osc', 'map.db')
+        self.assertEqual((counts['modified'], counts['stale']), (0, 1))
+        self.assertEqual(self.way_versions(), [])
+
+    def test_repeated_delete_is_counted_once(self):
+        self.assertEqual(osc_update.apply_changes('new.osc', 'map.db')['deleted'], 1)
+        counts = osc_update.apply_changes('new.osc', 'map.db')
+        self.assertEqual((counts['deleted'], counts['stale']), (0, 1))
+
+    def test_newer_create_replaces_the_tombstone(self):
+        osc_update.apply_changes('new.osc', 'map.db')
+        write_osc('again.osc', 'create', 4, 9, refs=[2, 3])
+        self.assertEqual(osc_update.apply_changes('again.osc', 'map.db')['created'], 1)
+        self.assertEqual(self.way_versions(), [(4, 9)])
+
+    def test_state(self):
+        osc_update.apply_changes('old.osc', 'map.db', sequence=100)
+        self.assertEqual(osc_update.apply_changes('new.osc', 'map.db', sequence=100)['skipped_file'], 1)
+        osc_update.apply_changes('new.osc', 'map.db')
+        connection = sqlite3.connect('map.db')
+        try:
+            self.assertEqual(osc_update.read_state(connection), (100, '2017-01-08T00:00:00Z'))
+        finally:
+            connection.close()
+
+    def test_missing_database(self):
+        with self.assertRaises(IOError) as raised:
+            osc_update.apply_changes('old.osc', 'missing.db')
+        self.assertIn('missing.db does not exist', str(raised.exception))
+        self.assertFalse(os.path.exists('missing.db'))
+
+        sqlite3.connect('empty.db').close()
+        with self.assertRaises(ValueError) as raised:
+            osc_update.apply_changes('old.osc', 'empty.db')
+        self.assertIn('empty.db has no nodes table', str(raised.exception))
+        connection = sqlite3.connect('empty.db')
+        try:
+            self.assertFalse(osc_update.has_table(connection, osc_update.STATE_TABLE))
+        finally:
+            connection.close()
+
+
+class GeometryUpdateTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(GeometryUpdateTest, self).setUp()
+        write_osm('map.osm',
+                  nodes=[(1, 42.0, -71.0, []), (2, 42.001, -71.0, []), (3, 42.002, -71.0, [])],
+                  ways=[(3, [1, 2], []), (4, [2, 3], [])])
+        process_map('map.osm', validate=False, output='sqlite', db_path='map.db', geometry=True)
+
+    def geometry(self):
+        connection = sqlite3.connect('map.db')
+        try:
+            rows = connection.execute('SELECT id, max_lat, coordinates FROM ways_geometry ORDER BY id')
+            return dict((way_id, (max_lat, coordinates)) for way_id, max_lat, coordinates in rows)
+        finally:
+            connection.close()
+
+    def test_deleted_way_loses_its_geometry(self):
+        write_osc('delete.osc', 'delete', 3, 2)
+        osc_update.apply_changes('delete.osc', 'map.db')
+        self.assertEqual(sorted(self.geometry()), [4])
+
+    def test_moved_node_updates_its_ways(self):
+        with open('move.osc', 'w') as osc_file:
+            osc_file.write(OSC_START)
+            osc_file.write(' <modify>\n  <node id="3" lat="42.5" lon="-71.0" version="2" timestamp="2017-01-02T00:00:00Z" '
+                           'changeset="6000" uid="1" user="user1"/>\n </modify>\n</osmChange>\n')
+        before = self.geometry()
+        osc_update.apply_changes('move.osc', 'map.db')
+        after = self.geometry()
+        self.assertEqual(after[3], before[3])
+        self.assertEqual(after[4][0], 42.5)
+        self.assertIn('-71.0000000 42.5000000', after[4][1])
+
+    def test_changed_way_gets_new_geometry(self):
+        write_osc('modify.osc', 'modify', 3, 2, refs=[1, 3])
+        osc_update.apply_changes('modify.osc', 'map.db')
+        self.assertEqual(self.geometry()[3][0], 42.002)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
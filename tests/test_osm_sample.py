@@ -0,0 +1,65 @@
+import unittest
+
+import osm_sample
+import osm_stream
+from tests.fixtures import WorkDirTestCase, generate_osm, write_osm
+
+
+class NodeBitmapTest(unittest.TestCase):
+
+    def test_sparse_ids(self):
+        bitmap = osm_sample.NodeBitmap()
+        for node_id in (1, 2, 2, 70000, 4000000000):
+            bitmap.add(node_id)
+        self.assertEqual(len(bitmap), 4)
+        self.assertIn(4000000000, bitmap)
+        self.assertNotIn(3, bitmap)
+        self.assertEqual(len(bitmap.pages), 3)
+
+
+class SampleTest(WorkDirTestCase):
+
+    def check_complete(self, path):
+        """This function asserts that every way and relation of the sample at path only
+        refers to elements in it and returns the ids by kind"""
+
+        ids = {'node': set(), 'way': set(), 'relation': set()}
+        for elem in osm_stream.iter_elements(path):
+            for child in elem.iter():
+                if child.tag == 'nd':
+                    self.assertIn(child.attrib['ref'], ids['node'])
+                elif child.tag == 'member':
+                    self.assertIn(child.attrib['ref'], ids[child.attrib['type']])
+            ids[elem.tag].add(elem.attrib['id'])
+        return ids
+
+    def test_bbox_does_not_follow_pulled_in_nodes(self):
+        write_osm('map.osm',
+                  nodes=[(1, 1.0, 1.0, []), (2, 5.0, 5.0, []), (3, 6.0, 6.0, [])],
+                  ways=[(10, [1, 2], []), (11, [2, 3], [])],
+                  relations=[(20, [('way', 10, '')], []), (21, [('way', 11, '')], [])])
+        osm_sample.sample_map('map.osm', 'sample.osm', bbox=(0, 0, 2, 2))
+        ids = self.check_complete('sample.osm')
+        self.assertEqual(ids, {'node': set(['1', '2']), 'way': set(['10']), 'relation': set(['20'])})
+
+    def test_every_element_reproduces_the_file(self):
+        generate_osm('map.osm', nodes=500, ways=80)
+        osm_sample.sample_map('map.osm', 'sample.osm', every=1)
+        self.assertEqual(self.read('sample.osm'), self.read('map.osm'))
+
+    def test_samples_are_complete(self):
+        generate_osm('map.osm', nodes=3000, ways=400)
+        for options in (dict(every=7), dict(size=200, seed=3), dict(bbox=(42.25, -71.1, 42.3, -71.0))):
+            counts = osm_sample.sample_map('map.osm', 'sample.osm', **options)
+            ids = self.check_complete('sample.osm')
+            self.assertEqual(counts, (len(ids['node']), len(ids['way']), len(ids['relation'])))
+
+    def test_reservoir_is_deterministic(self):
+        generate_osm('map.osm', nodes=1000, ways=100)
+        osm_sample.sample_map('map.osm', 'first.osm', size=50, seed=1)
+        osm_sample.sample_map('map.osm', 'second.osm', size=50, seed=1)
+        self.assertEqual(self.read('first.osm'), self.read('second.osm'))
+
+
+if __name__ == '__main__':
+    unittest.main()
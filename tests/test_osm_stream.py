@@ -0,0 +1,81 @@
+import gzip
+import os
+import subprocess
+import sys
+import unittest
+
+import audit_postcode
+import osm_stream
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# reads an osm file in a fresh interpreter and prints its peak resident size in KB
+PEAK_MEMORY_SCRIPT = """
+import resource
+import sys
+sys.path.insert(0, sys.argv[1])
+from osm_stream import iter_elements, iter_tags
+path, parser = sys.argv[2], sys.argv[3]
+tags = sum(1 for _ in iter_tags(path, parser=parser))
+elements = sum(1 for _ in iter_elements(path, parser=parser))
+print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+# peak memory a ten times larger file may add, far below what keeping its tree would take
+PEAK_MEMORY_SLACK_KB = 8 * 1024
+
+
+def peak_memory(path, parser):
+    output = subprocess.check_output([sys.executable, '-c', PEAK_MEMORY_SCRIPT, PACKAGE_DIR, path, parser])
+    return int(output.split()[-1])
+
+
+class StreamingMemoryTest(WorkDirTestCase):
+
+    def test_peak_memory_does_not_grow_with_the_file(self):
+        small = generate_osm(os.path.abspath('small.osm'), nodes=6000, ways=900)
+        large = generate_osm(os.path.abspath('large.osm'), nodes=60000, ways=9000)
+        self.assertGreater(os.path.getsize(large), 9 * os.path.getsize(small))
+        for parser in osm_stream.available_parsers():
+            if parser == 'pbf':
+                continue
+            small_peak = peak_memory(small, parser)
+            large_peak = peak_memory(large, parser)
+            self.assertLess(large_peak - small_peak, PEAK_MEMORY_SLACK_KB,
+                            "{0}: {1} KB for the small file, {2} KB for the large one".format(
+                                parser, small_peak, large_peak))
+
+
+class IterElementsTest(WorkDirTestCase):
+
+    def test_parsers_yield_complete_elements(self):
+        path = generate_osm('map.osm', nodes=500, ways=80, relations=20)
+        expected = None
+        for parser in osm_stream.available_parsers():
+            if parser == 'pbf':
+                continue
+            elements = [(elem.tag, dict(elem.attrib), [(child.tag, dict(child.attrib)) for child in elem.iter()][1:])
+                        for elem in osm_stream.iter_elements(path, parser=parser)]
+            if expected is None:
+                expected = elements
+            self.assertEqual(elements, expected)
+        self.assertEqual(len(expected), 600)
+
+    def test_iter_tags_reads_names_files_and_compressed_files(self):
+        path = generate_osm('map.osm', nodes=500, ways=80, relations=20)
+        with open(path, 'rb') as osm_file:
+            text = osm_file.read()
+        with gzip.open('map.osm.gz', 'wb') as gzip_file:
+            gzip_file.write(text)
+
+        expected = [(tag.attrib['k'], tag.attrib['v']) for tag in osm_stream.iter_tags(path)]
+        self.assertTrue(expected)
+        with open(path, 'rb') as osm_file:
+            self.assertEqual([(tag.attrib['k'], tag.attrib['v']) for tag in osm_stream.iter_tags(osm_file)], expected)
+        self.assertEqual([(tag.attrib['k'], tag.attrib['v']) for tag in osm_stream.iter_tags('map.osm.gz')], expected)
+        self.assertEqual(audit_postcode.audit_postcode('map.osm.gz'), audit_postcode.audit_postcode(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
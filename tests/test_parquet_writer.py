@@ -0,0 +1,57 @@
+import csv
+import os
+import unittest
+
+import data
+import parquet_writer
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+
+@unittest.skipUnless(parquet_writer.pq is not None, "parquet output requires pyarrow")
+class ParquetWriterTest(WorkDirTestCase):
+
+    def convert(self, directory, **options):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.process_map(self.osm_path, validate=True, geometry=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+
+    def setUp(self):
+        super(ParquetWriterTest, self).setUp()
+        self.osm_path = generate_osm(os.path.abspath('map.osm'), nodes=2000, ways=300, relations=40)
+
+    def test_tables_match_the_csvs(self):
+        self.convert('csv')
+        self.convert('parquet', output='parquet')
+        for key, csv_path in data.CSV_PATHS.iteritems():
+            with open(os.path.join('csv', csv_path), 'rb') as csv_file:
+                rows = list(csv.reader(csv_file))
+            fields = rows.pop(0)
+            table = parquet_writer.pq.read_table(os.path.join('parquet', data.PARQUET_PATHS[key]))
+            self.assertEqual(table.schema.names, fields)
+            self.assertEqual(table.num_rows, len(rows))
+
+            columns = table.to_pydict()
+            for index, field in enumerate(fields):
+                convert = parquet_writer.COLUMN_TYPES[field][0] or (lambda value: value.decode('utf-8'))
+                expected = [convert(row[index]) if row[index] != '' or convert is not float else None
+                            for row in rows]
+                self.assertEqual(columns[field], expected, (key, field))
+
+    def test_row_groups(self):
+        writer = parquet_writer.ParquetTableWriter('tags.parquet', data.NODE_TAGS_FIELDS, row_group_size=100)
+        writer.writerows([data.TagRecord(node_id, 'amenity', u'caf\xe9', 'regular') for node_id in xrange(250)])
+        writer.writerow({'id': '250', 'key': 'name', 'value': 'Fenway', 'type': 'regular'})
+        writer.close()
+
+        parquet_file = parquet_writer.pq.ParquetFile('tags.parquet')
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        columns = parquet_file.read().to_pydict()
+        self.assertEqual(columns['id'], range(251))
+        self.assertEqual(columns['value'][-2:], [u'caf\xe9', u'Fenway'])
+
+
+if __name__ == '__main__':
+    unittest.main()
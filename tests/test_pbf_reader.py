@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import calendar
+import os
+import struct
+import time
+import unittest
+import zlib
+from xml.sax.saxutils import quoteattr
+
+import data
+import pbf_reader
+from tests.fixtures import WorkDirTestCase
+
+FULL_INFO = ('version', 'timestamp', 'changeset', 'uid', 'user')
+
+
+def metadata(version, uid, user):
+    return {'version': str(version), 'timestamp': '2016-01-01T12:00:00Z', 'changeset': str(1000 + version),
+            'uid': str(uid), 'user': user}
+
+
+# blocks of (kind, DenseInfo fields, elements); elements are (tag, attrib, children) like the
+# tuples of pbf_reader, and the .osm file holds the same elements
+BLOCKS = [
+    ('dense', FULL_INFO, [
+        ('node', dict(metadata(1, 7, u'J\xf6rg'), id='1', lat='42.3601', lon='-71.0589'),
+         [('tag', {'k': 'amenity', 'v': 'cafe'}), ('tag', {'k': 'name', 'v': u'Caf\xe9 東京'})]),
+        ('node', dict(metadata(3, 8, 'ann'), id='2', lat='42.3602', lon='-71.05'), []),
+        ('node', dict(metadata(2, 7, u'J\xf6rg'), id='5', lat='42.35', lon='-71.0591234'),
+         [('tag', {'k': 'addr:postcode', 'v': '02116-1234'})])
+    ]),
+    # an extract without user data has no DenseInfo at all, or only some of its arrays
+    ('dense', (), [
+        ('node', {'id': '6', 'lat': '42.3603', 'lon': '-71.0587'}, [('tag', {'k': 'highway', 'v': 'stop'})]),
+        ('node', {'id': '7', 'lat': '-0.0000001', 'lon': '0.1'}, [])
+    ]),
+    ('dense', ('version', 'timestamp'), [
+        ('node', {'id': '8', 'lat': '42.3604', 'lon': '-71.0586', 'version': '4',
+                  'timestamp': '2017-03-04T05:06:07Z'}, [])
+    ]),
+    ('nodes', FULL_INFO, [
+        ('node', dict(metadata(1, 9, 'bob'), id='9', lat='42.3605', lon='-71.0585'), [('tag', {'k': 'shop', 'v': 'bakery'})])
+    ]),
+    ('ways', FULL_INFO, [
+        ('way', dict(metadata(2, 8, 'ann'), id='10'),
+         [('nd', {'ref': '1'}), ('nd', {'ref': '2'}), ('nd', {'ref': '6'}),
+          ('tag', {'k': 'highway', 'v': 'residential'}), ('tag', {'k': 'name', 'v': u'Stra\xdfe'}),
+          ('tag', {'k': 'addr:street', 'v': 'Main St'})])
+    ]),
+    ('relations', FULL_INFO, [
+        ('relation', dict(metadata(1, 7, u'J\xf6rg'), id='20'),
+         [('member', {'type': 'way', 'ref': '10', 'role': 'outer'}), ('member', {'type': 'node', 'ref': '1', 'role': ''}),
+          ('member', {'type': 'relation', 'ref': '21', 'role': u'r\xf4le'}), ('tag', {'k': 'type', 'v': 'multipolygon'})])
+    ])
+]
+
+
+# ================================================== #
+#               Encoding                             #
+# ================================================== #
+def varint(value):
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return str(encoded)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def scalar_field(number, value):
+    return varint(number << 3) + varint(value)
+
+
+def bytes_field(number, value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return varint((number << 3) | 2) + varint(len(value)) + value
+
+
+def packed_field(number, values):
+    return bytes_field(number, ''.join(varint(value) for value in values))
+
+
+def delta_field(number, values):
+    deltas = [zigzag(value - previous) for previous, value in zip([0] + values, values)]
+    return packed_field(number, deltas)
+
+
+class StringTable(object):
+
+    def __init__(self):
+        self.strings = ['']
+        self.ids = {'': 0}
+
+    def __call__(self, value):
+        if value not in self.ids:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.ids[value]
+
+
+def timestamp(text):
+    return calendar.timegm(time.strptime(text, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def coordinate(text):
+    """This function returns a coordinate in the default granularity of 100 nanodegrees"""
+
+    return int(round(float(text) * 1e7))
+
+
+def info_message(attrib, strings):
+    return (scalar_field(1, int(attrib['version'])) + scalar_field(2, timestamp(attrib['timestamp'])) +
+            scalar_field(3, int(attrib['changeset'])) + scalar_field(4, int(attrib['uid'])) +
+            scalar_field(5, strings(attrib['user'])))
+
+
+def tag_fields(children, strings):
+    tags = [attrib for tag, attrib in children if tag == 'tag']
+    return packed_field(2, [strings(tag['k']) for tag in tags]) + packed_field(3, [strings(tag['v']) for tag in tags])
+
+
+def dense_group(info_fields, elements, strings):
+    attribs = [attrib for _, attrib, _ in elements]
+    dense = delta_field(1, [int(attrib['id']) for attrib in attribs])
+    info = ''
+    if 'version' in info_fields:
+        info += packed_field(1, [int(attrib['version']) for attrib in attribs])
+    if 'timestamp' in info_fields:
+        info += delta_field(2, [timestamp(attrib['timestamp']) for attrib in attribs])
+    if 'changeset' in info_fields:
+        info += delta_field(3, [int(attrib['changeset']) for attrib in attribs])
+    if 'uid' in info_fields:
+        info += delta_field(4, [int(attrib['uid']) for attrib in attribs])
+    if 'user' in info_fields:
+        info += delta_field(5, [strings(attrib['user']) for attrib in attribs])
+    if info:
+        dense += bytes_field(5, info)
+    keys_vals = []
+    for _, _, children in elements:
+        for _, tag in children:
+            keys_vals += [strings(tag['k']), strings(tag['v'])]
+        keys_vals.append(0)
+    dense += delta_field(8, [coordinate(attrib['lat']) for attrib in attribs])
+    dense += delta_field(9, [coordinate(attrib['lon']) for attrib in attribs])
+    dense += packed_field(10, keys_vals)
+    return bytes_field(2, dense)
+
+
+def element_message(tag, attrib, children, strings):
+    if tag == 'node':
+        return (scalar_field(1, zigzag(int(attrib['id']))) + tag_fields(children, strings) +
+                bytes_field(4, info_message(attrib, strings)) +
+                scalar_field(8, zigzag(coordinate(attrib['lat']))) + scalar_field(9, zigzag(coordinate(attrib['lon']))))
+
+    message = scalar_field(1, int(attrib['id'])) + tag_fields(children, strings) + bytes_field(4, info_message(attrib, strings))
+    if tag == 'way':
+        return message + delta_field(8, [int(child['ref']) for child_tag, child in children if child_tag == 'nd'])
+    members = [child for child_tag, child in children if child_tag == 'member']
+    return (message + packed_field(8, [strings(member['role']) for member in members]) +
+            delta_field(9, [int(member['ref']) for member in members]) +
+            packed_field(10, [pbf_reader.MEMBER_TYPES.index(member['type']) for member in members]))
+
+
+GROUP_FIELDS = {'nodes': 1, 'ways': 3, 'relations': 4}
+
+
+def primitive_block(kind, info_fields, elements):
+    strings = StringTable()
+    if kind == 'dense':
+        group = dense_group(info_fields, elements, strings)
+    else:
+        group = ''.join(bytes_field(GROUP_FIELDS[kind], element_message(tag, attrib, children, strings))
+                        for tag, attrib, children in elements)
+    string_table = bytes_field(1, ''.join(bytes_field(1, value) for value in strings.strings))
+    return string_table + bytes_field(2, group)
+
+
+def write_blob(pbf_file, blob_type, content):
+    blob = scalar_field(2, len(content)) + bytes_field(3, zlib.compress(content))
+    header = bytes_field(1, blob_type) + scalar_field(3, len(blob))
+    pbf_file.write(struct.pack('>I', len(header)) + header + blob)
+
+
+def write_pbf(path, blocks=BLOCKS):
+    with open(path, 'wb') as pbf_file:
+        write_blob(pbf_file, 'OSMHeader', bytes_field(4, 'OsmSchema-V0.6') + bytes_field(4, 'DenseNodes'))
+        for kind, info_fields, elements in blocks:
+            write_blob(pbf_file, 'OSMData', primitive_block(kind, info_fields, elements))
+    return path
+
+
+def write_xml(path, blocks=BLOCKS):
+    with open(path, 'wb') as osm_file:
+        osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for _, _, elements in blocks:
+            for tag, attrib, children in elements:
+                osm_file.write(u' <{0}{1}>\n'.format(tag, xml_attributes(attrib)).encode('utf-8'))
+                for child_tag, child in children:
+                    osm_file.write(u'  <{0}{1}/>\n'.format(child_tag, xml_attributes(child)).encode('utf-8'))
+                osm_file.write(' </{0}>\n'.format(tag))
+        osm_file.write('</osm>\n')
+    return path
+
+
+def xml_attributes(attrib):
+    return u''.join(u' {0}={1}'.format(name, quoteattr(value)) for name, value in sorted(attrib.iteritems()))
+
+
+# ================================================== #
+#               Tests                                #
+# ================================================== #
+class PbfReaderTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(PbfReaderTest, self).setUp()
+        self.pbf_path = write_pbf(os.path.abspath('map.osm.pbf'))
+        self.osm_path = write_xml(os.path.abspath('map.osm'))
+
+    def test_is_pbf(self):
+        self.assertTrue(pbf_reader.is_pbf(self.pbf_path))
+        self.assertFalse(pbf_reader.is_pbf(self.osm_path))
+
+    def test_elements(self):
+        expected = [element for _, _, elements in BLOCKS for element in elements]
+        for processes in (1, 2):
+            elements = [(element.tag, element.attrib, element.children)
+                        for element in pbf_reader.iter_elements(self.pbf_path, processes=processes)]
+            self.assertEqual(elements, expected)
+
+    def test_strings_are_decoded_like_xml(self):
+        for element in pbf_reader.iter_elements(self.pbf_path, ('relation',), processes=1):
+            self.assertEqual([type(child.attrib['role']) for child in element.iter('member')], [str, str, unicode])
+            self.assertEqual(type(element.attrib['user']), unicode)
+
+    def convert(self, directory, path, **options):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.process_map(path, validate=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+        return self.outputs(directory)
+
+    def test_process_map_matches_xml(self):
+        xml_outputs = self.convert('xml', self.osm_path)
+        self.assertEqual(xml_outputs['nodes.csv'].splitlines()[5], '7,-0.0000001,0.1,,0,0,0,')
+        for processes in (1, 2):
+            self.assertEqual(self.convert('pbf{0}'.format(processes), self.pbf_path, processes=processes), xml_outputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+from itertools import islice
+
+import data
+from tests.fixtures import WorkDirTestCase, attributes, generate_osm, write_osm
+
+
+class Interrupted(Exception):
+    """Stands in for a crash in the middle of a checkpointed conversion"""
+
+
+class ByteIdentityTest(WorkDirTestCase):
+    """Every way of running the csv conversion writes the same bytes as the serial one"""
+
+    def setUp(self):
+        super(ByteIdentityTest, self).setUp()
+        self.osm_path = generate_osm(os.path.abspath('map.osm'), nodes=4000, ways=600)
+        self.serial = self.convert('serial')
+
+    def convert(self, directory, **options):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.process_map(self.osm_path, validate=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+        return self.outputs(directory)
+
+    def test_parallel(self):
+        self.assertEqual(self.convert('parallel', processes=3), self.serial)
+
+    def test_staged(self):
+        self.assertEqual(self.convert('staged', staged=True, workers=2), self.serial)
+
+    def test_checkpointed(self):
+        self.assertEqual(self.convert('checkpointed', checkpoint_path='map.checkpoint', checkpoint_bytes=64 * 1024),
+                         self.serial)
+
+    def interrupted_then_resumed(self, **options):
+        """This function converts the map in small chunks, fails half way through the
+        third chunk after some rows were written, then resumes the conversion"""
+
+        name = 'write_elements_staged' if options.get('staged') else 'write_elements'
+        write_elements = getattr(data, name)
+        chunks = []
+
+        def failing_write_elements(elements, *args, **kwargs):
+            chunks.append(None)
+            if len(chunks) == 3:
+                write_elements(islice(elements, 50), *args, **kwargs)
+                raise Interrupted()
+            write_elements(elements, *args, **kwargs)
+
+        options = dict(options, checkpoint_path='map.checkpoint', checkpoint_bytes=64 * 1024)
+        setattr(data, name, failing_write_elements)
+        try:
+            self.assertRaises(Interrupted, self.convert, 'resumed', **options)
+        finally:
+            setattr(data, name, write_elements)
+
+        os.chdir('resumed')
+        try:
+            data.process_map(self.osm_path, validate=True, resume=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+        return self.outputs('resumed')
+
+    def test_resumed(self):
+        self.assertEqual(self.interrupted_then_resumed(), self.serial)
+
+    def test_staged_resumed(self):
+        self.assertEqual(self.interrupted_then_resumed(staged=True, workers=2), self.serial)
+
+
+class GeometryTest(WorkDirTestCase):
+
+    def test_node_after_way(self):
+        write_osm('map.osm', nodes=[(1, 42.3, -71.1, []), (2, 42.4, -71.2, [])], ways=[(10, [1, 2], [])])
+        with open('map.osm', 'rb') as osm_file:
+            text = osm_file.read()
+        with open('map.osm', 'wb') as osm_file:
+            osm_file.write(text.replace('</osm>', ' <node id="3" lat="42.5" lon="-71.3" {0}/>\n</osm>'.format(
+                attributes(3))))
+
+        for options in ({}, {'staged': True}):
+            with self.assertRaises(ValueError) as raised:
+                data.process_map('map.osm', validate=True, geometry=True, **options)
+            self.assertEqual(str(raised.exception), "way geometry needs the input sorted with every node "
+                                                    "before the ways, but node 3 follows a way")
+
+
+class ValidationTest(WorkDirTestCase):
+
+    def test_invalid_element(self):
+        write_osm('map.osm', nodes=[(1, 42.3, -71.1, [('amenity', 'cafe')]), (2, 42.4, -71.2, [])])
+        with open('map.osm', 'rb') as osm_file:
+            text = osm_file.read()
+        with open('map.osm', 'wb') as osm_file:
+            osm_file.write(text.replace('uid="2"', 'uid="two"'))
+
+        for options in ({}, {'staged': True}, {'stats': data.PipelineStats()}):
+            with self.assertRaises(Exception) as raised:
+                data.process_map('map.osm', validate=True, **options)
+            self.assertIn("Element of type 'node' has the following errors", str(raised.exception))
+            self.assertIn("'uid'", str(raised.exception))
+        data.process_map('map.osm', validate=False)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
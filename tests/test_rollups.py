@@ -0,0 +1,119 @@
+import json
+import math
+import os
+import unittest
+from collections import defaultdict
+
+import data
+from osm_stream import iter_elements
+from rollups import HyperLogLog, RollupCollector, TopK, hash_pair
+from tests.fixtures import WorkDirTestCase, generate_osm, write_osm
+
+
+def exact_rollups(path):
+    """This function counts what the rollups estimate straight from the file"""
+
+    counts = defaultdict(int)
+    users = defaultdict(int)
+    tourism = defaultdict(int)
+    tourism_max_nodes = defaultdict(int)
+    for element in iter_elements(path):
+        counts[element.tag] += 1
+        if element.tag == 'relation':
+            continue
+        users[element.attrib['user']] += 1
+        for tag in element.iter('tag'):
+            if tag.attrib['k'] == 'tourism':
+                tourism[tag.attrib['v']] += 1
+                if element.tag == 'way':
+                    nodes = len(list(element.iter('nd')))
+                    tourism_max_nodes[tag.attrib['v']] = max(tourism_max_nodes[tag.attrib['v']], nodes)
+    return counts, users, tourism, tourism_max_nodes
+
+
+class SketchTest(unittest.TestCase):
+
+    def test_hyperloglog_error(self):
+        sketch = HyperLogLog()
+        standard_error = 1.04 / math.sqrt(len(sketch.registers))
+        for count in (150, 20000):
+            for index in xrange(count):
+                sketch.add_hash(hash_pair('user{0}'.format(index))[0])
+            self.assertLess(abs(sketch.count() - count), 3 * standard_error * count + 1)
+            sketch = HyperLogLog()
+
+    def test_top_k_drops_the_lowest_candidate(self):
+        top = TopK(k=1, spare=2)
+        for item in ('a', 'a', 'a', 'b'):
+            self.assertIsNone(top.add(item, top.sketch.positions(*hash_pair(item))))
+        self.assertEqual(top.add('c', top.sketch.positions(*hash_pair('c'))), None)
+        self.assertEqual(top.add('c', top.sketch.positions(*hash_pair('c'))), 'b')
+        self.assertEqual(sorted(top.candidates), ['a', 'c'])
+        self.assertEqual(top.top(), [('a', 3)])
+
+
+class RollupCollectorTest(WorkDirTestCase):
+
+    def convert(self, path, collector):
+        data.process_map(path, validate=True, collectors=[collector])
+        with open(collector.path, 'rb') as rollups_file:
+            return json.load(rollups_file)
+
+    def test_matches_exact_counts(self):
+        path = generate_osm(os.path.abspath('map.osm'), nodes=3000, ways=400, relations=30)
+        report = self.convert(path, RollupCollector('rollups.json'))
+        counts, users, tourism, tourism_max_nodes = exact_rollups(path)
+
+        self.assertEqual(report['counts'], counts)
+        standard_error = 1.04 / math.sqrt(1 << 14)
+        self.assertLess(abs(report['unique_users'] - len(users)), 3 * standard_error * len(users) + 1)
+
+        top_tourism = sorted(tourism.iteritems(), key=lambda pair: (-pair[1], pair[0]))[:10]
+        self.assertEqual([tuple(pair) for pair in report['top_tourism']], top_tourism)
+        self.assertEqual([tuple(pair) for pair in report['tourism_max_nodes']],
+                         [(value, tourism_max_nodes[value]) for value, _ in top_tourism])
+
+        # a count-min estimate is never below the count and at most the stated error above it
+        error = report['top_users_error']
+        for user, estimate in report['top_users']:
+            self.assertTrue(users[user] <= estimate <= users[user] + error, (user, users[user], estimate))
+        reported = set(user for user, _ in report['top_users'])
+        tenth = sorted(users.itervalues(), reverse=True)[9]
+        for user, count in users.iteritems():
+            if count > tenth + error:
+                self.assertIn(user, reported)
+
+    def test_staged_conversion_gives_the_same_report(self):
+        path = generate_osm(os.path.abspath('map.osm'), nodes=3000, ways=400, relations=30)
+        serial = self.convert(path, RollupCollector('serial.json'))
+        collector = RollupCollector('staged.json')
+        data.process_map(path, validate=True, collectors=[collector], staged=True, workers=2)
+        with open(collector.path, 'rb') as rollups_file:
+            self.assertEqual(json.load(rollups_file), serial)
+
+    def test_curated_values_of_the_top_user(self):
+        # uid 3 made most of the edits, see fixtures.attributes
+        nodes = [(node_id, 42.3, -71.1, [('tourism', 'museum' if node_id % 2 else 'hotel'), ('leisure', 'park')])
+                 for node_id in range(1, 120)]
+        nodes += [(node_id, 42.3, -71.1, [('tourism', 'zoo')]) for node_id in range(1004, 1704, 7)]
+        write_osm('map.osm', sorted(nodes))
+        report = self.convert('map.osm', RollupCollector('rollups.json'))
+
+        self.assertEqual(report['top_user'], 'user3')
+        self.assertEqual([tuple(pair) for pair in report['top_user_curated']['tourism']],
+                         [('zoo', 100), ('museum', 9), ('hotel', 8)])
+        self.assertEqual([tuple(pair) for pair in report['top_user_curated']['leisure']], [('park', 17)])
+
+    def test_curated_counts_are_kept_for_the_candidates_only(self):
+        collector = RollupCollector('rollups.json')
+        # every user edits twice, which pushes a user with one edit out of the candidates
+        for node_id in xrange(2000):
+            record = data.NodeRecord(node_id, 42.3, -71.1, 'user{0}'.format(node_id // 2), node_id // 2, '1', '1', '')
+            tags = [data.TagRecord(node_id, 'tourism', 'museum', 'regular')]
+            collector.add('node', {'node': record, 'node_tags': tags})
+        self.assertLessEqual(len(collector.curated), collector.top_users.capacity)
+        self.assertEqual(set(collector.curated), set(collector.top_users.candidates))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from collections import namedtuple
+
+import data
+from schema_validator import SchemaValidator, as_mapping
+
+NODE = data.NodeRecord('1', '42.3', '-71.1', 'user1', '1', '2', '300', '2016-01-01T12:00:00Z')
+TAG = data.TagRecord('1', 'street', 'Main Street', 'addr')
+
+# the fields of a tag in another order, which must be matched by name and not by position
+ReorderedTag = namedtuple('ReorderedTag', ['value', 'key', 'type', 'id'])
+
+
+class SchemaValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = SchemaValidator(data.SCHEMA)
+
+    def assertValid(self, document):
+        self.assertTrue(self.validator.validate(document), self.validator.errors)
+        self.assertEqual(self.validator.errors, {})
+
+    def test_records_and_dicts(self):
+        element = {'node': NODE, 'node_tags': [TAG, TAG._replace(key='city')]}
+        self.assertValid(element)
+        self.assertValid(as_mapping(element))
+        self.assertValid({'node': NODE, 'node_tags': []})
+
+    def test_record_classes_are_matched_by_field_name(self):
+        tag = ReorderedTag('Main Street', 'street', 'addr', '1')
+        self.assertValid({'node': NODE, 'node_tags': [tag]})
+        self.assertValid({'node': NODE, 'node_tags': [TAG, tag, as_mapping(TAG)]})
+        self.assertFalse(self.validator.validate({'node': NODE, 'node_tags': [tag._replace(id='x')]}))
+        self.assertEqual(self.validator.errors, {'node_tags': [{0: [{'id': [
+            "field 'id' cannot be coerced: invalid literal for int() with base 10: 'x'"]}]}]})
+
+    def test_invalid_record_is_reported_like_a_dict(self):
+        for node in (NODE._replace(lat='north'), as_mapping(NODE._replace(lat='north'))):
+            self.assertFalse(self.validator.validate({'node': node, 'node_tags': []}))
+            self.assertEqual(self.validator.errors.keys(), ['node'])
+            self.assertEqual(self.validator.errors['node'][0].keys(), ['lat'])
+
+    def test_record_with_other_fields(self):
+        Partial = namedtuple('Partial', ['id', 'key', 'value'])
+        self.assertFalse(self.validator.validate({'node': NODE, 'node_tags': [Partial('1', 'k', 'v')]}))
+        self.assertEqual(self.validator.errors, {'node_tags': [{0: [{'type': ['required field']}]}]})
+
+    def test_unknown_key(self):
+        self.assertFalse(self.validator.validate({'node': NODE, 'nodes': []}))
+        self.assertEqual(self.validator.errors, {'nodes': ['unknown field']})
+
+
+if __name__ == '__main__':
+    unittest.main()
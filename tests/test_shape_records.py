@@ -0,0 +1,67 @@
+import csv
+import unittest
+import xml.etree.cElementTree as ET
+
+import data
+from schema_validator import SchemaValidator
+from tests.fixtures import WorkDirTestCase, attributes
+
+RELATION = '''<relation id="20" {0}>
+  <member type="way" ref="10" role="outer"/>
+  <member type="node" ref="1" role=""/>
+  <member type="relation" ref="21"/>
+  <member type="way" ref="11" role="inner"/>
+  <tag k="type" v="multipolygon"/>
+  <tag k="name:en" v="Boston Common"/>
+  <tag k="?note" v="left out"/>
+  <tag k="addr:street" v="Tremont St"/>
+</relation>'''.format(attributes(20))
+
+RELATION_ROW = ['20', 'user6', '6', '1', '1020', '2016-01-01T12:00:00Z']
+MEMBERS = [('20', 'way', '10', 'outer', 0), ('20', 'node', '1', '', 1), ('20', 'relation', '21', '', 2),
+           ('20', 'way', '11', 'inner', 3)]
+TAGS = [('20', 'type', 'multipolygon', 'regular'), ('20', 'en', 'Boston Common', 'name'),
+        ('20', 'street', 'Tremont Street', 'addr')]
+
+
+class ShapeRelationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.element = ET.fromstring(RELATION)
+
+    def test_shape_records(self):
+        shaped = data.shape_records(self.element)
+        self.assertEqual(sorted(shaped), ['relation', 'relation_members', 'relation_tags'])
+        self.assertEqual(shaped['relation'], data.RelationRecord(*RELATION_ROW))
+        self.assertEqual(shaped['relation_members'], [data.MemberRecord(*member) for member in MEMBERS])
+        self.assertEqual(shaped['relation_tags'], [data.TagRecord(*tag) for tag in TAGS])
+        self.assertTrue(SchemaValidator(data.SCHEMA).validate(shaped))
+
+    def test_shape_element(self):
+        shaped = data.shape_element(self.element)
+        self.assertEqual(shaped['relation']['id'], '20')
+        self.assertEqual(shaped['relation_members'],
+                         [dict(zip(data.RELATION_MEMBERS_FIELDS, member)) for member in MEMBERS])
+        self.assertEqual(shaped['relation_tags'], [dict(zip(data.RELATION_TAGS_FIELDS, tag)) for tag in TAGS])
+
+
+class RelationCsvTest(WorkDirTestCase):
+
+    def test_relation_tables(self):
+        with open('map.osm', 'w') as osm_file:
+            osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+            osm_file.write(RELATION + '\n</osm>\n')
+        data.process_map('map.osm', validate=True)
+
+        tables = {}
+        for key in ('relation', 'relation_members', 'relation_tags'):
+            with open(data.CSV_PATHS[key], 'rb') as csv_file:
+                tables[key] = list(csv.reader(csv_file))
+        self.assertEqual(tables['relation'], [data.RELATION_FIELDS, RELATION_ROW])
+        self.assertEqual(tables['relation_members'],
+                         [data.RELATION_MEMBERS_FIELDS] + [[str(value) for value in member] for member in MEMBERS])
+        self.assertEqual(tables['relation_tags'], [data.RELATION_TAGS_FIELDS] + [list(tag) for tag in TAGS])
+
+
+if __name__ == '__main__':
+    unittest.main()
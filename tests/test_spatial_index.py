@@ -0,0 +1,70 @@
+import csv
+import json
+import os
+from array import array
+
+import data
+from spatial_index import NODE, WAY, ItemPositions, SpatialIndex, build_index
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+BOX = (42.25, -71.15, 42.3, -71.05)
+
+
+class SpatialIndexTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(SpatialIndexTest, self).setUp()
+        data.process_map(generate_osm(os.path.abspath('map.osm')), validate=False)
+        build_index('map.idx', node_size=4)
+        self.index = SpatialIndex('map.idx')
+
+    def tearDown(self):
+        self.index.close()
+        super(SpatialIndexTest, self).tearDown()
+
+    def rows(self, kind):
+        with open(data.CSV_PATHS[kind], 'rb') as csv_file:
+            return list(csv.DictReader(csv_file))
+
+    def nodes_in_box(self, min_lat, min_lon, max_lat, max_lon):
+        return set(('node', int(row['id'])) for row in self.rows('node')
+                   if min_lat <= float(row['lat']) <= max_lat and min_lon <= float(row['lon']) <= max_lon)
+
+    def test_bbox_matches_a_scan(self):
+        results = set(result for result in self.index.bbox(*BOX) if result[0] == 'node')
+        self.assertEqual(results, self.nodes_in_box(*BOX))
+
+    def test_tag_filter_reads_the_postings(self):
+        cafes = set(('node', int(row['id'])) for row in self.rows('node_tags')
+                    if row['key'] == 'amenity' and row['value'] == 'cafe')
+        with_amenity = set(('node', int(row['id'])) for row in self.rows('node_tags') if row['key'] == 'amenity')
+        self.assertTrue(cafes)
+        self.assertEqual(set(self.index.bbox(*BOX, tags={'amenity': 'cafe'})) & cafes,
+                         self.nodes_in_box(*BOX) & cafes)
+        self.assertTrue(set(self.index.bbox(*BOX, tags={'amenity': None})) <= with_amenity | set(
+            result for result in self.index.bbox(*BOX) if result[0] == 'way'))
+        self.assertEqual(self.index.bbox(*BOX, tags={'amenity': 'no such value'}), [])
+
+    def test_header_holds_only_the_directory(self):
+        with open('map.idx', 'rb') as index_file:
+            header = json.loads(index_file.readline())
+        for values in header['tags'].itervalues():
+            for posting in values.itervalues():
+                self.assertEqual(len(posting), 3)
+
+    def test_item_positions(self):
+        ids, kinds = array('l', [7, 3, 7, 12, 5]), array('b', [NODE, NODE, WAY, NODE, WAY])
+        nodes = ItemPositions(ids, kinds, NODE)
+        self.assertEqual([nodes.get(node_id) for node_id in (3, 5, 7, 12, 13)], [1, None, 0, 3, None])
+        self.assertEqual(ItemPositions(ids, kinds, WAY).get(7), 2)
+
+    def test_nearest_is_sorted(self):
+        results = self.index.nearest(42.3, -71.1, k=20, tags={'amenity': None})
+        self.assertEqual(len(results), 20)
+        distances = [dist for dist, _, _ in results]
+        self.assertEqual(distances, sorted(distances))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,78 @@
+import csv
+import os
+import sqlite3
+import unittest
+
+import data
+import sqlite_writer
+from tests.fixtures import WorkDirTestCase, generate_osm
+
+# pragmas that the load changes, with the values close_database restores
+RESTORED_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 2, 'locking_mode': 'normal'}
+
+
+class RecordingConnection(sqlite3.Connection):
+    """Records the pragmas of the connection as it is closed, since synchronous and
+    locking_mode only last as long as the connection"""
+
+    closed_pragmas = []
+
+    def close(self):
+        RecordingConnection.closed_pragmas.append(
+            dict((name, self.execute('PRAGMA {0}'.format(name)).fetchone()[0]) for name in RESTORED_PRAGMAS))
+        sqlite3.Connection.close(self)
+
+
+class RecordingSqlite3(object):
+    """Stands in for the sqlite3 module in sqlite_writer to connect with a RecordingConnection"""
+
+    def connect(self, *args, **kwargs):
+        return sqlite3.connect(*args, factory=RecordingConnection, **kwargs)
+
+
+class SqliteWriterTest(WorkDirTestCase):
+
+    def setUp(self):
+        super(SqliteWriterTest, self).setUp()
+        self.osm_path = generate_osm(os.path.abspath('map.osm'), nodes=2000, ways=300, relations=40)
+        RecordingConnection.closed_pragmas = []
+        sqlite_writer.sqlite3 = RecordingSqlite3()
+
+    def tearDown(self):
+        sqlite_writer.sqlite3 = sqlite3
+        super(SqliteWriterTest, self).tearDown()
+
+    def test_load_matches_the_csvs(self):
+        data.process_map(self.osm_path, validate=True, geometry=True)
+        data.process_map(self.osm_path, validate=True, output='sqlite', db_path='map.db', geometry=True)
+
+        tables = data.SQLITE_TABLES + [data.WAY_GEOMETRY_SQLITE_TABLE]
+        connection = sqlite3.connect('map.db')
+        try:
+            for key, table, fields, _, _ in tables:
+                with open(data.CSV_PATHS[key], 'rb') as csv_file:
+                    rows = list(csv.reader(csv_file))
+                self.assertEqual(rows[0], fields)
+                count = connection.execute('SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0]
+                self.assertEqual(count, len(rows) - 1, table)
+                self.assertGreater(count, 0, table)
+
+            indexes = set(name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+                          if name.endswith('_idx'))
+            self.assertEqual(indexes, set('{0}_{1}_idx'.format(table, field)
+                                          for _, table, _, _, indexed_fields in tables for field in indexed_fields))
+
+            self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        finally:
+            connection.close()
+
+        self.assertEqual(RecordingConnection.closed_pragmas, [RESTORED_PRAGMAS])
+
+    def test_failed_load_closes_the_connection(self):
+        with self.assertRaises(Exception):
+            data.write_sqlite(iter([None]), 'map.db', validate=True)
+        self.assertEqual(len(RecordingConnection.closed_pragmas), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import unittest
+
+import data
+from tests.fixtures import WorkDirTestCase, generate_osm, write_osm
+
+
+class StagedPipelineTest(WorkDirTestCase):
+
+    def convert(self, directory, osm_path, **options):
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            data.process_map(osm_path, validate=True, **options)
+        finally:
+            os.chdir(self.work_dir)
+        return self.outputs(directory)
+
+    def test_staged_matches_serial(self):
+        osm_path = generate_osm(os.path.abspath('map.osm'))
+        serial = self.convert('serial', osm_path)
+        self.assertEqual(self.convert('staged', osm_path, staged=True, workers=3), serial)
+
+    def test_workers_share_the_cleaning_caches(self):
+        # more distinct streets and postcodes than the caches hold, so the workers evict
+        # entries from them concurrently
+        count = data.CLEAN_CACHE_SIZE + 4000
+        nodes = [(node_id, 42.3, -71.1, [('addr:street', 'Street{0} St'.format(node_id)),
+                                          ('addr:postcode', '0{0:04d}-{1}'.format(node_id % 10000, node_id))])
+                 for node_id in xrange(1, count + 1)]
+        write_osm('streets.osm', nodes)
+        osm_path = os.path.abspath('streets.osm')
+
+        serial = self.convert('serial', osm_path)
+        data.clean_street.cache_clear()
+        data.clean_postcode.cache_clear()
+        self.assertEqual(self.convert('staged', osm_path, staged=True, workers=4), serial)
+        self.assertLessEqual(data.clean_street.cache_info().currsize, data.CLEAN_CACHE_SIZE)
+
+    def test_stage_error_is_raised(self):
+        write_osm('broken.osm', [(1, 42.3, -71.1, [])], [(1, ['x'], [])])
+        with self.assertRaises(Exception):
+            self.convert('staged', os.path.abspath('broken.osm'), staged=True, workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
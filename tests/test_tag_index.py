@@ -0,0 +1,64 @@
+import csv
+import os
+from collections import defaultdict
+
+import data
+from tag_index import TagIndex, TagIndexBuilder, decode_ids, encode_ids
+from tests.fixtures import WorkDirTestCase, generate_osm, write_osm
+
+
+class TagIndexTest(WorkDirTestCase):
+
+    def build(self, osm_path):
+        data.process_map(osm_path, validate=False, collectors=[TagIndexBuilder('map.tags')])
+        return TagIndex('map.tags')
+
+    def expected_ids(self):
+        """This function returns the ids of every (osm key, value, kind) read back from the
+        tag csvs"""
+
+        expected = defaultdict(set)
+        for kind in ('node', 'way', 'relation'):
+            with open(data.CSV_PATHS[kind + '_tags'], 'rb') as tags_file:
+                for row in csv.DictReader(tags_file):
+                    key = row['key'] if row['type'] == 'regular' else '{0}:{1}'.format(row['type'], row['key'])
+                    expected[(key, row['value'].decode('utf-8'), kind)].add(int(row['id']))
+        return expected
+
+    def test_matches_the_tag_tables(self):
+        index = self.build(generate_osm('map.osm'))
+        try:
+            expected = self.expected_ids()
+            for (key, value, kind), ids in expected.iteritems():
+                self.assertEqual(index.ids(key, value, kind), sorted(ids))
+                self.assertEqual(index.count(key, value, kind), len(ids))
+            amenity = defaultdict(int)
+            for (key, value, kind), ids in expected.iteritems():
+                if key == 'amenity':
+                    amenity[value] += len(ids)
+            self.assertEqual(sorted(index.histogram('amenity')), sorted(amenity.iteritems()))
+        finally:
+            index.close()
+
+    def test_value_shared_by_kinds(self):
+        write_osm('map.osm',
+                  nodes=[(1, 42.3, -71.1, [('amenity', 'cafe')]), (2, 42.3, -71.1, [('amenity', 'cafe')])],
+                  ways=[(5, [1, 2], [('amenity', 'cafe'), ('addr:street', 'Main Street')])])
+        index = self.build(os.path.abspath('map.osm'))
+        try:
+            self.assertEqual(index.ids('amenity', 'cafe'), [1, 2, 5])
+            self.assertEqual(index.ids('amenity', 'cafe', 'node'), [1, 2])
+            self.assertEqual(index.ids('amenity', 'cafe', 'relation'), [])
+            self.assertEqual(sorted(index.values('amenity')['cafe']), ['node', 'way'])
+            self.assertEqual(index.ids('addr:street', 'Main Street'), [5])
+        finally:
+            index.close()
+
+    def test_varint_round_trip(self):
+        ids = [1, 2, 127, 128, 300, 2 ** 40]
+        self.assertEqual(decode_ids(encode_ids(ids)), ids)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()